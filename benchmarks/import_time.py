@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Import-time budget for the lightweight entry points
+
+Each module is imported in a fresh interpreter. The wall time of the import
+and the heavy dependencies it pulled in are compared with BUDGETS, so the web
+tier, health checks and worker spawns keep starting quickly and do not load
+the ML stack before a request needs it.
+
+Usage:
+    python -m benchmarks.import_time           # Report
+    python -m benchmarks.import_time --check   # Exit 1 when a budget is exceeded
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+HEAVY_MODULES = ("torch", "diffusers", "transformers", "gradio", "cv2", "controlnet_aux", "reportlab")
+
+# module -> (seconds, heavy modules it may import)
+BUDGETS = {
+    "diffusionlab.api.webapp": (1.0, ()),
+    "diffusionlab.api.server": (0.5, ()),
+    "diffusionlab.utils": (0.5, ()),
+    "diffusionlab.preprocess": (0.5, ()),
+    "diffusionlab.export": (0.5, ()),
+    "diffusionlab.tasks.storyboard": (None, ("torch",)),
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(module, repeats=3):
+    """Fastest of ``repeats`` cold imports, and the heavy modules loaded"""
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                cwd=ROOT, capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {"seconds": round(min(run["seconds"] for run in runs), 3), "heavy": runs[0]["heavy"]}
+
+
+def check(results):
+    """Budget violations as messages"""
+    problems = []
+    for module, result in results.items():
+        seconds, allowed = BUDGETS[module]
+        unexpected = [name for name in result["heavy"] if name not in allowed]
+        if unexpected:
+            problems.append(f"{module} imports {', '.join(unexpected)}")
+        if seconds is not None and result["seconds"] > seconds:
+            problems.append(f"{module} takes {result['seconds']}s to import (budget {seconds}s)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 when a budget is exceeded")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    results = {}
+    for module in BUDGETS:
+        try:
+            results[module] = measure(module, args.repeats)
+        except subprocess.CalledProcessError as e:
+            print(f"{module}: import failed\n{e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{module:32s} {results[module]['seconds']:6.3f}s  heavy: {', '.join(results[module]['heavy']) or '-'}")
+
+    problems = check(results)
+    for problem in problems:
+        print(f"OVER BUDGET: {problem}")
+    if args.check and problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
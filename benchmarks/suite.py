@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+Offline end-to-end benchmark suite
+
+Every /generate mode is driven through the Flask test client with the
+miniature random-weight models from benchmarks/tiny_models.py, so the suite
+needs no downloads and runs on a plain CPU box. For each mode it reports
+request latency, per-stage time (text encoding, UNet, ControlNet, VAE,
+captioning, preprocessing, compositing, saving), peak RSS and throughput as
+JSON, and compares the result with a stored baseline.
+
+Stage times are inclusive wall time summed over calls; stages can overlap
+(control maps are computed on a thread pool). Repeats after the warm-up run
+see warm caches, as a long-running server would. Repeats run round-robin
+over the modes and baseline comparisons use the fastest repeat of each
+metric, which is the least affected by other processes. Times are also
+scaled by a fixed reference workload, so a uniformly faster or slower
+machine does not register as a change.
+
+Usage:
+    python -m benchmarks.suite                        # run and compare with benchmarks/baseline.json
+    python -m benchmarks.suite --modes single,batch --repeats 5 --output results.json
+    python -m benchmarks.suite --check                # exit with status 1 on regressions
+    python -m benchmarks.suite --save-baseline        # record this machine's numbers as the baseline
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")  # Everything is built locally
+
+from PIL import Image, ImageDraw
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+PROMPT = "a lighthouse on a rocky cliff at dusk, waves crashing below"
+SEED = 1234
+
+# Relative slowdown that counts as a regression, ignoring differences below the noise floor
+TOLERANCE = 0.25
+MIN_SECONDS = 0.005
+MIN_BYTES = 16 * 1024 * 1024
+
+MODES = {
+    "single": {"genType": "single", "prompt": PROMPT},
+    "single_draft": {"genType": "single", "prompt": PROMPT, "draft": True},
+    "single_two_stage": {"genType": "single", "prompt": PROMPT, "twoStage": True},
+    "storyboard": {"genType": "storyboard", "prompt": PROMPT},
+    "batch": {"genType": "batch", "prompt": PROMPT, "batch": {"count": 4, "layout": "grid"}, "draft": False},
+    "batch_draft": {"genType": "batch", "prompt": PROMPT, "batch": {"count": 4, "layout": "grid"}, "draft": True},
+    "prompt_chain": {"genType": "prompt-chaining", "promptChain": {
+        "prompts": ["a boy on a hill at dawn", "the boy running down the hill", "the boy reaching a river"],
+        "evolutionStrength": 0.3}},
+    "img2img": {"genType": "img2img", "prompt": PROMPT, "img2img": True, "strength": 0.6},
+    "inpainting": {"genType": "inpainting", "prompt": PROMPT, "inpainting": True},
+    "controlnet_canny": {"genType": "controlnet", "prompt": PROMPT, "controlnet": {"model": "canny"}},
+    "controlnet_depth": {"genType": "controlnet", "prompt": PROMPT, "controlnet": {"model": "depth"}},
+    "controlnet_segmentation": {"genType": "controlnet", "prompt": PROMPT, "controlnet": {"model": "segmentation"}},
+}
+
+
+class StageTimer:
+    """Call counts and inclusive wall time per stage, safe to use from worker threads"""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            calls, total = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (calls + 1, total + seconds)
+
+    def timed(self, function, stage):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return wrapper
+
+    def wrap(self, owner, attribute, stage):
+        """Time every call of ``owner.attribute`` (a module function or a model method)"""
+        setattr(owner, attribute, self.timed(getattr(owner, attribute), stage))
+
+    def snapshot(self):
+        with self._lock:
+            stages, self.stages = self.stages, {}
+        return {stage: {"calls": calls, "seconds": total} for stage, (calls, total) in sorted(stages.items())}
+
+
+def sample_image(width=1024, height=768, variant=0):
+    """A JPEG with edges, gradients and flat regions so every preprocessor has work to do"""
+    image = Image.new("RGB", (width, height), (40 + variant % 200, 90, 160))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, width, 64):
+        draw.line([(i, 0), (width - i, height)], fill=(255, 220, 120), width=3)
+    draw.ellipse([width // 4, height // 4, width * 3 // 4, height * 3 // 4], fill=(200, 60, 60))
+    draw.rectangle([0, height * 2 // 3, width, height], fill=(30, 120, 40))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def mask_data_url(width=1024, height=768):
+    """A brush mask as the canvas sends it: red strokes on a transparent PNG data URL"""
+    mask = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    ImageDraw.Draw(mask).ellipse([width // 3, height // 3, width // 2, height // 2], fill=(255, 0, 0, 255))
+    buffer = io.BytesIO()
+    mask.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def configure(size, steps):
+    """Shrink every generation setting to the benchmark size and step count; returns a function undoing it"""
+    from diffusionlab import config
+
+    settings = [config.IMAGE_CONFIG, config.IMG2IMG_CONFIG, config.INPAINTING_CONFIG, config.UPLOAD_CONFIG,
+                config.TWO_STAGE_CONFIG]
+    saved = [dict(setting) for setting in settings]
+    config.IMAGE_CONFIG.update(width=size, height=size, num_inference_steps=steps)
+    config.IMG2IMG_CONFIG.update(width=size, height=size, num_inference_steps=steps)
+    config.INPAINTING_CONFIG.update(width=size, height=size, num_inference_steps=steps, inpaint_min_size=size // 2)
+    config.UPLOAD_CONFIG["target_size"] = (size, size)
+    config.TWO_STAGE_CONFIG["refine_steps"] = steps
+
+    def restore():
+        for setting, values in zip(settings, saved):
+            setting.clear()
+            setting.update(values)
+    return restore
+
+
+def instrument(timer, storyboard, webapp, uploads, engine):
+    pipe = storyboard.pipe
+    timer.wrap(pipe.text_encoder, "forward", "text_encoder")
+    timer.wrap(pipe.text_encoder_2, "forward", "text_encoder")
+    timer.wrap(pipe.unet, "forward", "unet")
+    timer.wrap(pipe.vae, "encode", "vae_encode")
+    timer.wrap(pipe.vae, "decode", "vae_decode")
+    timer.wrap(storyboard.tiny_vae, "decode", "tiny_vae_decode")
+    timer.wrap(storyboard.model, "generate", "caption")
+    for controlnet_pipe in storyboard.controlnet_pipes.values():
+        timer.wrap(controlnet_pipe.controlnet, "forward", "controlnet")
+    for control_type, preprocessor in list(engine.preprocessors.items()):
+        engine.preprocessors[control_type] = timer.timed(preprocessor, "preprocess")
+    timer.wrap(uploads, "decode_upload", "decode_upload")
+    timer.wrap(webapp, "create_storyboard_layout", "compose")
+    timer.wrap(webapp, "save_output", "save")
+
+
+def calibrate(repeats=5):
+    """Seconds for a fixed matmul/conv workload (best of ``repeats``), a yardstick for machine speed"""
+    import torch
+
+    generator = torch.Generator().manual_seed(SEED)
+    matrix = torch.randn(256, 256, generator=generator)
+    images = torch.randn(1, 16, 64, 64, generator=generator)
+    kernel = torch.randn(16, 16, 3, 3, generator=generator)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(20):
+            matrix @ matrix
+            torch.nn.functional.conv2d(images, kernel, padding=1)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def summarize(runs, images):
+    latencies = [run["latency"] for run in runs]
+    latency = statistics.median(latencies)
+    stages = {}
+    for stage in sorted({stage for run in runs for stage in run["stages"]}):
+        values = [run["stages"].get(stage, {"calls": 0, "seconds": 0.0}) for run in runs]
+        stages[stage] = {
+            "calls": max(value["calls"] for value in values),
+            "seconds": round(statistics.median(value["seconds"] for value in values), 4),
+            "min_seconds": round(min(value["seconds"] for value in values), 4),
+        }
+    peaks = [run["peak_rss_bytes"] for run in runs if run["peak_rss_bytes"] is not None]
+    return {
+        "latency_s": round(latency, 4),
+        "latency_min_s": round(min(latencies), 4),
+        "latencies_s": [round(value, 4) for value in latencies],
+        "images": images,
+        "images_per_s": round(images / latency, 3) if latency else None,
+        "peak_rss_bytes": max(peaks) if peaks else None,
+        "stages": stages,
+    }
+
+
+def run(modes=None, repeats=5, size=128, steps=4):
+    """Run the suite and return the report"""
+    import torch
+
+    workdir = tempfile.mkdtemp(prefix="diffusionlab-bench-")
+    previous_dir = os.getcwd()
+    os.chdir(workdir)  # Upload folder and control map cache are relative to the working directory
+    restore_settings = configure(size, steps)
+    try:
+        from benchmarks.tiny_models import install
+        from diffusionlab import uploads
+        from diffusionlab.api import webapp
+        from diffusionlab.config import PERFORMANCE_CONFIG
+        from diffusionlab.preprocess import get_engine
+        from diffusionlab.storage import BlobStore
+        from diffusionlab.tasks import storyboard
+        from diffusionlab.tuning import PeakMemory, configure_performance, _rss_bytes
+
+        pipe = install(storyboard)
+        pipelines = [pipe, storyboard.img2img_pipe, storyboard.inpaint_pipe, *storyboard.controlnet_pipes.values()]
+        # Manual mode: tiny-model autotune results must not end up in the real autotune cache
+        configure_performance(pipe, pipelines, "cpu", dict(PERFORMANCE_CONFIG, mode="manual"))
+        webapp.output_store = BlobStore(os.path.join(workdir, "outputs"))
+        engine = get_engine()  # Pose is not benchmarked: its detector needs downloaded weights
+
+        timer = StageTimer()
+        instrument(timer, storyboard, webapp, uploads, engine)
+        client = webapp.app.test_client()
+
+        def upload(route, data, **form):
+            form["image"] = (io.BytesIO(data), "reference.jpg")
+            response = client.post(route, data=form, content_type="multipart/form-data")
+            return response.get_json()["upload_id"]
+
+        reference = sample_image()
+        references = {
+            "inputImagePath": upload("/upload", reference),
+            "inpaintingImagePath": upload("/upload", reference, purpose="inpainting"),
+            "controlnetImagePath": upload("/upload-controlnet", reference),
+        }
+        mask = mask_data_url()
+
+        def measure(request):
+            timer.snapshot()
+            with PeakMemory("cpu") as memory:
+                start = time.perf_counter()
+                result = request()
+                latency = time.perf_counter() - start
+            return result, {"latency": latency, "stages": timer.snapshot(), "peak_rss_bytes": memory.peak}
+
+        def upload_request(round_index):
+            # Different bytes each time so the content-hash cache does not hide the decode
+            data = sample_image(variant=round_index + 1)
+            return lambda: (upload("/upload", data), 1)
+
+        def generate_request(mode):
+            payload = dict(MODES[mode], seed=SEED, **references)
+            if payload.get("inpainting"):
+                payload["maskData"] = mask
+
+            def request():
+                torch.manual_seed(SEED)  # Captions are sampled from the global generator
+                response = client.post("/generate", json=payload)
+                result = response.get_json()
+                if response.status_code != 200 or not result.get("success"):
+                    raise RuntimeError(f"{mode} failed ({response.status_code}): {result.get('error')}")
+                return result, len(result.get("captions") or [result["image"]])
+            return request
+
+        selected = [mode for mode in ["upload", *MODES] if not modes or mode in modes]
+        runs = {mode: [] for mode in selected}
+        images = {}
+        calibrations = []
+        # Round-robin over the modes (round 0 is a warm-up), so a burst of load
+        # from other processes hits one repeat of several modes rather than
+        # every repeat of one mode
+        for round_index in range(repeats + 1):
+            calibrations.append(calibrate())
+            for mode in selected:
+                request = upload_request(round_index) if mode == "upload" else generate_request(mode)
+                (_, images[mode]), measurement = measure(request)
+                if round_index:
+                    runs[mode].append(measurement)
+
+        report_modes = {}
+        for mode in selected:
+            report_modes[mode] = summarize(runs[mode], images[mode])
+            print(f"{mode:<26} {report_modes[mode]['latency_s'] * 1000:9.1f} ms  "
+                  f"{report_modes[mode]['images_per_s']:7.2f} img/s")
+
+        return {
+            "environment": {
+                "python": platform.python_version(),
+                "torch": torch.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "torch_threads": torch.get_num_threads(),
+            },
+            "settings": {"size": size, "steps": steps, "repeats": repeats},
+            "calibration_s": round(min(calibrations), 5),
+            "final_rss_bytes": _rss_bytes(),
+            "modes": report_modes,
+        }
+    finally:
+        restore_settings()
+        os.chdir(previous_dir)
+
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """Compare a report with a baseline; returns ``(table, regressions)``.
+
+    A metric regresses when it is more than ``tolerance`` above the baseline
+    and the difference is above the noise floor (MIN_SECONDS / MIN_BYTES).
+    Times are scaled by the ratio of the two reports' calibration workloads.
+    """
+    table, regressions = [], []
+    speed = 1.0
+    if report.get("calibration_s") and baseline.get("calibration_s"):
+        speed = report["calibration_s"] / baseline["calibration_s"]
+    for mode, result in report["modes"].items():
+        base = baseline.get("modes", {}).get(mode)
+        if not base:
+            continue
+        checks = [("latency_s", result["latency_min_s"], base["latency_min_s"], MIN_SECONDS),
+                  ("peak_rss_bytes", result["peak_rss_bytes"], base.get("peak_rss_bytes"), MIN_BYTES)]
+        checks += [(f"stages.{stage}.seconds", value["min_seconds"], base["stages"][stage]["min_seconds"], MIN_SECONDS)
+                   for stage, value in result["stages"].items() if stage in base.get("stages", {})]
+        for metric, current, previous, floor in checks:
+            if current is None or not previous:
+                continue
+            if metric != "peak_rss_bytes":
+                current = round(current / speed, 4)
+            row = {"mode": mode, "metric": metric, "current": current, "baseline": previous,
+                   "ratio": round(current / previous, 3)}
+            table.append(row)
+            if current > previous * (1 + tolerance) and current - previous > floor:
+                regressions.append(row)
+    return table, regressions
+
+
+def print_comparison(table, regressions):
+    flagged = {(row["mode"], row["metric"]) for row in regressions}
+    print(f"\n{'mode':<26} {'latency':>10} {'baseline':>10} {'ratio':>7}  (machine speed normalised)")
+    for row in table:
+        if row["metric"] == "latency_s":
+            mark = "  REGRESSION" if (row["mode"], row["metric"]) in flagged else ""
+            print(f"{row['mode']:<26} {row['current'] * 1000:8.1f}ms {row['baseline'] * 1000:8.1f}ms "
+                  f"{row['ratio']:7.2f}{mark}")
+    for row in regressions:
+        if row["metric"] != "latency_s":
+            print(f"REGRESSION {row['mode']} {row['metric']}: {row['current']} vs {row['baseline']} "
+                  f"({row['ratio']}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark suite with miniature models")
+    parser.add_argument("--modes", help="Comma-separated modes (default: all): upload," + ",".join(MODES))
+    parser.add_argument("--repeats", type=int, default=5, help="Measured runs per mode (after one warm-up)")
+    parser.add_argument("--size", type=int, default=128, help="Image width and height")
+    parser.add_argument("--steps", type=int, default=4, help="Denoising steps")
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 if anything regressed")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    modes = set(args.modes.split(",")) if args.modes else None
+    report = run(modes, args.repeats, args.size, args.steps)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print(f"Baseline settings {baseline.get('settings')} differ from this run; ratios are not comparable")
+        elif baseline.get("environment", {}).get("cpu_count") != report["environment"]["cpu_count"]:
+            print("Baseline was recorded on a different machine; refresh it with --save-baseline")
+        table, regressions = compare(report, baseline, args.tolerance)
+        report["comparison"] = {"baseline": args.baseline, "tolerance": args.tolerance, "regressions": regressions}
+        print_comparison(table, regressions)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    if not args.output and not args.save_baseline:
+        print(json.dumps(report, indent=2))
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
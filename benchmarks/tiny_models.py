@@ -0,0 +1,122 @@
+"""
+Miniature random-weight models with the same interfaces as the real ones
+
+Everything is configured locally (no downloads): SDXL-style UNet, VAE,
+ControlNet, tiny autoencoder, both CLIP text encoders with a character-level
+tokenizer, and a small causal LM standing in for the caption model. The
+weights are random, so images are noise, but every pipeline runs the same
+code paths (text encoding, denoising, VAE encode/decode, ControlNet
+conditioning) as with the full models, at a fraction of the cost.
+"""
+
+import json
+import os
+import tempfile
+
+import torch
+from diffusers import (AutoencoderKL, AutoencoderTiny, ControlNetModel, EulerDiscreteScheduler,
+                       StableDiffusionXLControlNetPipeline, StableDiffusionXLImg2ImgPipeline,
+                       StableDiffusionXLInpaintPipeline, StableDiffusionXLPipeline, UNet2DConditionModel)
+from transformers import (CLIPTextConfig, CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer,
+                          GPT2Config, GPT2LMHeadModel)
+
+SEED = 0
+TEXT_HIDDEN = 32
+
+
+def build_tokenizer():
+    """Character-level CLIP tokenizer (every printable ASCII character is a token)"""
+    directory = tempfile.mkdtemp(prefix="tiny-tokenizer-")
+    vocab = {}
+    for code in range(33, 127):
+        vocab[chr(code)] = len(vocab)
+        vocab[chr(code) + "</w>"] = len(vocab)
+    vocab["<|startoftext|>"] = len(vocab)
+    vocab["<|endoftext|>"] = len(vocab)
+    with open(os.path.join(directory, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(directory, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(os.path.join(directory, "vocab.json"), os.path.join(directory, "merges.txt"),
+                         model_max_length=77)
+
+
+def build_text_encoders(vocab_size):
+    config = CLIPTextConfig(hidden_size=TEXT_HIDDEN, intermediate_size=37, num_attention_heads=4,
+                            num_hidden_layers=2, vocab_size=vocab_size, max_position_embeddings=77,
+                            projection_dim=TEXT_HIDDEN, hidden_act="gelu")
+    return CLIPTextModel(config), CLIPTextModelWithProjection(config)
+
+
+def build_unet():
+    # cross_attention_dim = both text encoders' hidden states concatenated;
+    # projection_class_embeddings_input_dim = 6 time ids x 8 + pooled text embeds
+    return UNet2DConditionModel(
+        block_out_channels=(32, 64), layers_per_block=1, sample_size=16, in_channels=4, out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4), use_linear_projection=True, addition_embed_type="text_time",
+        addition_time_embed_dim=8, transformer_layers_per_block=(1, 1),
+        projection_class_embeddings_input_dim=6 * 8 + TEXT_HIDDEN, cross_attention_dim=2 * TEXT_HIDDEN,
+        norm_num_groups=8,
+    )
+
+
+def build_vae():
+    """Four blocks, so latents are 1/8 of the image size like the SDXL VAE"""
+    return AutoencoderKL(
+        block_out_channels=(8, 16, 16, 16), in_channels=3, out_channels=3,
+        down_block_types=("DownEncoderBlock2D",) * 4, up_block_types=("UpDecoderBlock2D",) * 4,
+        latent_channels=4, norm_num_groups=8, sample_size=128, scaling_factor=0.13025,
+    )
+
+
+def build_tiny_vae():
+    return AutoencoderTiny(encoder_block_out_channels=(8, 8, 8, 8), decoder_block_out_channels=(8, 8, 8, 8),
+                           num_encoder_blocks=(1, 1, 1, 1), num_decoder_blocks=(1, 1, 1, 1), latent_channels=4)
+
+
+def build_scheduler():
+    return EulerDiscreteScheduler(beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear",
+                                  timestep_spacing="leading", steps_offset=1)
+
+
+def build_caption_model(vocab_size):
+    return GPT2LMHeadModel(GPT2Config(vocab_size=vocab_size, n_positions=1024, n_embd=32, n_layer=2, n_head=2))
+
+
+def build_pipelines():
+    """Base, img2img and inpainting pipelines sharing one set of tiny components"""
+    torch.manual_seed(SEED)
+    tokenizer = build_tokenizer()
+    text_encoder, text_encoder_2 = build_text_encoders(len(tokenizer))
+    pipe = StableDiffusionXLPipeline(
+        vae=build_vae(), text_encoder=text_encoder, text_encoder_2=text_encoder_2, tokenizer=tokenizer,
+        tokenizer_2=tokenizer, unet=build_unet(), scheduler=build_scheduler(),
+    )
+    return pipe, StableDiffusionXLImg2ImgPipeline(**pipe.components), StableDiffusionXLInpaintPipeline(**pipe.components)
+
+
+def build_controlnet_pipeline(pipe):
+    torch.manual_seed(SEED)
+    controlnet = ControlNetModel.from_unet(pipe.unet)
+    return StableDiffusionXLControlNetPipeline(**pipe.components, controlnet=controlnet)
+
+
+def install(storyboard, control_types=("canny", "depth", "segmentation")):
+    """Replace the storyboard module's models with tiny ones so no weights are downloaded.
+
+    ``load_models`` sees every model as loaded and returns immediately;
+    ControlNet pipelines for ``control_types`` are pre-loaded into its LRU.
+    """
+    pipe, img2img_pipe, inpaint_pipe = build_pipelines()
+    storyboard.pipe = pipe
+    storyboard.img2img_pipe = img2img_pipe
+    storyboard.inpaint_pipe = inpaint_pipe
+    storyboard.tokenizer = pipe.tokenizer
+    storyboard.model = build_caption_model(len(pipe.tokenizer))
+    storyboard.tiny_vae = build_tiny_vae()
+    storyboard.controlnet_pipes.clear()
+    for control_type in control_types:
+        storyboard.controlnet_pipes[control_type] = build_controlnet_pipeline(pipe)
+    return pipe
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Benchmark two-stage generation against native-resolution generation
+
+For each prompt and seed, three images are produced at the two-stage target
+size (IMAGE_CONFIG size x TWO_STAGE_CONFIG["scale"]):
+
+- native_base:   generated at IMAGE_CONFIG size, Lanczos-resized to the target
+- native_target: generated directly at the target size
+- two_stage:     generated at IMAGE_CONFIG size, latent-upscaled and refined
+
+Cost is wall time and peak memory; quality is a CLIP image-text score (when
+the CLIP model can be loaded) and Laplacian variance as a detail measure.
+Results are printed and written as JSON.
+
+Usage:
+    python benchmarks/two_stage.py --prompts 3 --output two_stage.json
+    python benchmarks/two_stage.py --tiny    # Offline smoke run with the miniature models
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from diffusionlab.config import IMAGE_CONFIG, TWO_STAGE_CONFIG
+from diffusionlab.tasks import storyboard
+from diffusionlab.tuning import PeakMemory
+from diffusionlab.utils import get_optimal_device
+
+PROMPTS = [
+    "a lighthouse on a rocky cliff at dusk, waves crashing below",
+    "a detective in a trench coat under a flickering street lamp in the rain",
+    "a market street in an old mediterranean town, crowded, midday sun",
+    "a small robot watering plants in a greenhouse, morning light",
+]
+
+CLIP_MODEL = "openai/clip-vit-base-patch32"
+
+
+def detail(image):
+    """Laplacian variance of the grayscale image (higher = more fine detail)"""
+    gray = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def load_clip_scorer():
+    """Return ``score(image, prompt)`` using CLIP, or None if the model is unavailable"""
+    try:
+        import torch
+        from transformers import CLIPModel, CLIPProcessor
+        model = CLIPModel.from_pretrained(CLIP_MODEL).eval()
+        processor = CLIPProcessor.from_pretrained(CLIP_MODEL)
+    except Exception as e:
+        print(f"CLIP score disabled: {e}")
+        return None
+
+    def score(image, prompt):
+        inputs = processor(text=[prompt], images=image, return_tensors="pt", padding=True, truncation=True)
+        with torch.no_grad():
+            outputs = model(**inputs)
+        image_embeds = outputs.image_embeds / outputs.image_embeds.norm(dim=-1, keepdim=True)
+        text_embeds = outputs.text_embeds / outputs.text_embeds.norm(dim=-1, keepdim=True)
+        return float(100 * (image_embeds * text_embeds).sum())
+    return score
+
+
+def run_variant(name, generate, device):
+    start = time.perf_counter()
+    with PeakMemory(device) as memory:
+        image = generate()
+    return name, image, {"seconds": round(time.perf_counter() - start, 3), "peak_bytes": memory.peak}
+
+
+def benchmark(prompts, seed, steps, clip=True):
+    storyboard.load_models()
+    device = get_optimal_device()
+    width, height = IMAGE_CONFIG["width"], IMAGE_CONFIG["height"]
+    target = (int(width * TWO_STAGE_CONFIG["scale"]) // 8 * 8, int(height * TWO_STAGE_CONFIG["scale"]) // 8 * 8)
+    common = {"num_inference_steps": steps, "guidance_scale": IMAGE_CONFIG["guidance_scale"]}
+    score = load_clip_scorer() if clip else None
+
+    # Warm-up so the first variant does not pay for kernel selection
+    storyboard.pipe("warm-up", num_inference_steps=1, width=width, height=height, output_type="latent")
+
+    runs = []
+    for prompt in prompts:
+        variants = [
+            run_variant("native_base", lambda: storyboard.pipe(
+                prompt, width=width, height=height, generator=storyboard.make_generator(seed), **common
+            ).images[0].resize(target, Image.Resampling.LANCZOS), device),
+            run_variant("native_target", lambda: storyboard.pipe(
+                prompt, width=target[0], height=target[1], generator=storyboard.make_generator(seed), **common
+            ).images[0], device),
+            run_variant("two_stage", lambda: storyboard.generate_two_stage(
+                prompt, width=width, height=height, generator=storyboard.make_generator(seed), **common
+            )[0], device),
+        ]
+        for name, image, result in variants:
+            result.update(prompt=prompt, variant=name, size=list(image.size), detail=round(detail(image), 1))
+            if score:
+                result["clip_score"] = round(score(image, prompt), 2)
+            print(json.dumps(result))
+            runs.append(result)
+
+    summary = {}
+    for name in ("native_base", "native_target", "two_stage"):
+        rows = [run for run in runs if run["variant"] == name]
+        summary[name] = {key: round(float(np.mean([row[key] for row in rows])), 3)
+                         for key in ("seconds", "detail", "clip_score") if key in rows[0]}
+    summary["two_stage_vs_native_target_time"] = round(
+        summary["two_stage"]["seconds"] / summary["native_target"]["seconds"], 3)
+    return {
+        "device": device,
+        "base_size": [width, height],
+        "target_size": list(target),
+        "steps": steps,
+        "two_stage": TWO_STAGE_CONFIG,
+        "summary": summary,
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--prompts", type=int, default=2, help="Number of benchmark prompts (max %d)" % len(PROMPTS))
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--steps", type=int, default=IMAGE_CONFIG["num_inference_steps"])
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--tiny", action="store_true", help="Use the random-weight miniature models (no downloads)")
+    args = parser.parse_args()
+
+    if args.tiny:
+        from benchmarks.tiny_models import install
+        install(storyboard, control_types=())
+        IMAGE_CONFIG.update(width=128, height=128)
+
+    results = benchmark(PROMPTS[:args.prompts], args.seed, args.steps, clip=not args.tiny)
+    print(json.dumps(results["summary"], indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
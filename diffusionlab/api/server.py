@@ -0,0 +1,286 @@
+"""
+Pre-forking production server for the web app
+
+The master process loads the models once (``SERVER_CONFIG["preload"]``) and
+forks ``workers`` processes that accept connections on the socket it opened.
+The workers inherit the weights copy-on-write: inference only reads parameter
+storage, and the master freezes the loaded objects (``gc.freeze``) so garbage
+collections in the workers do not write to the pages holding them. Workers
+are recycled after ``max_requests`` requests (plus jitter) or once their RSS
+exceeds ``max_worker_rss_mb``; a recycled worker finishes its requests before
+exiting and the master starts a replacement.
+
+Signals to the master: SIGTERM/SIGINT stop gracefully, SIGHUP recycles the
+workers one at a time.
+
+Usage:
+    python -m diffusionlab.api.server                 # SERVER_CONFIG settings
+    python -m diffusionlab.api.server --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import ThreadedWSGIServer
+
+from diffusionlab.config import CONTROLNET_CONFIG, SERVER_CONFIG, UPLOAD_CONFIG
+from diffusionlab.memory import rss_bytes
+
+
+def torch_threads(workers):
+    """Torch threads per worker, so that the workers together use each core once"""
+    return SERVER_CONFIG["threads_per_worker"] or max(1, (os.cpu_count() or 1) // workers)
+
+
+def preload(names):
+    """Load models in the master; returns the loaded modules by name (see storyboard.loaded_components)"""
+    import torch
+    from diffusionlab.tasks import storyboard
+    from diffusionlab.utils import get_optimal_device
+
+    if get_optimal_device() != "cpu":
+        # A CUDA/MPS context does not survive fork: each worker loads its own copy on first use
+        print(f"[WARNING] Not preloading models on {get_optimal_device()}; workers load them on demand")
+        return {}
+    # OpenMP thread pools do not survive fork either: the master computes single-threaded
+    # (e.g. while autotuning) and each worker sizes its own pool
+    torch.set_num_threads(1)
+    for name in names:
+        if name == "sdxl":
+            storyboard.load_models()
+        elif name == "tiny_vae":
+            storyboard.load_tiny_vae()
+        elif name in CONTROLNET_CONFIG["models"]:
+            storyboard.load_controlnet_model(name)
+        else:
+            print(f"[WARNING] Unknown model to preload: {name}")
+    return storyboard.loaded_components()
+
+
+def freeze(components):
+    """Make loaded modules safe to share with forked workers.
+
+    Inference mode stops autograd from attaching state to the parameters, and
+    ``gc.freeze`` moves every object alive now out of the collector's reach,
+    so collections in the workers do not touch (and copy) their pages.
+    """
+    for module in components.values():
+        module.eval()
+        module.requires_grad_(False)
+    gc.collect()
+    gc.freeze()
+
+
+class _WorkerServer(ThreadedWSGIServer):
+    """Threaded server on an inherited socket that reports each connection to its worker"""
+
+    def __init__(self, worker, sock, app):
+        self.worker = worker
+        host, port = sock.getsockname()[:2]
+        super().__init__(host, port, app, fd=sock.fileno())
+
+    def process_request(self, request, client_address):
+        # Counted on the serving thread, so none is missed when serving stops right after
+        self.worker.started()
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self.worker.finished()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.worker.finished()
+
+
+class Worker:
+    """Serves ``app`` on the inherited listening socket until it is stopped or due for recycling"""
+
+    def __init__(self, app, sock, max_requests=None, max_rss_bytes=None):
+        self.max_requests = max_requests
+        self.max_rss_bytes = max_rss_bytes
+        self.served = 0
+        self.active = 0  # Connections being handled (one request each: the server closes them after responding)
+        self.stopping = False
+        self._idle = threading.Condition()
+        self.server = _WorkerServer(self, sock, app)
+
+    def started(self):
+        with self._idle:
+            self.active += 1
+
+    def finished(self):
+        with self._idle:
+            self.active -= 1
+            self.served += 1
+            self._idle.notify_all()
+        if self.max_requests and self.served >= self.max_requests:
+            self.stop(f"served {self.served} requests")
+        elif self.max_rss_bytes and (rss_bytes() or 0) > self.max_rss_bytes:
+            self.stop(f"RSS over {self.max_rss_bytes // 2**20} MB")
+
+    def stop(self, reason):
+        """Stop accepting connections; ``run`` returns once in-flight requests are done"""
+        if self.stopping:
+            return
+        self.stopping = True
+        print(f"[DEBUG] Worker {os.getpid()} stopping: {reason}")
+        # shutdown() waits for serve_forever, so it cannot run on the serving (main) thread
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def run(self, graceful_timeout, handle_signals=True):
+        """Serve until stopped; ``handle_signals=False`` leaves the process's signal handlers alone"""
+        if handle_signals:
+            signal.signal(signal.SIGTERM, lambda *_: self.stop("SIGTERM"))
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches the master, which stops the workers
+        self.server.serve_forever()
+        deadline = time.monotonic() + graceful_timeout
+        with self._idle:
+            while self.active and time.monotonic() < deadline:
+                self._idle.wait(deadline - time.monotonic())
+        if self.active:
+            print(f"[WARNING] Worker {os.getpid()} exiting with {self.active} unfinished requests")
+
+
+class Master:
+    """Forks the workers, replaces the ones that exit and relays shutdown and reload signals"""
+
+    def __init__(self, app, sock, workers, threads, on_first_worker=None, on_worker=None):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.threads = threads
+        self.on_first_worker = on_first_worker  # Called in the first worker only (e.g. to resume jobs)
+        self.on_worker = on_worker  # Called in every worker (e.g. to start background threads)
+        self.children = {}  # pid -> start time
+        self.retiring = []  # Workers to recycle on SIGHUP, one at a time
+        self.recycling = None
+        self.stopping = False
+
+    def spawn(self):
+        first, self.on_first_worker = self.on_first_worker, None
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return pid
+        code = 0
+        try:
+            import torch
+            torch.set_num_threads(self.threads)
+            random.seed()
+            max_requests = SERVER_CONFIG["max_requests"]
+            if max_requests:
+                max_requests += random.randint(0, SERVER_CONFIG["max_requests_jitter"] or 0)
+            max_rss = SERVER_CONFIG["max_worker_rss_mb"]
+            worker = Worker(self.app, self.sock, max_requests, max_rss * 2**20 if max_rss else None)
+            print(f"[DEBUG] Worker {os.getpid()} serving ({self.threads} torch threads, "
+                  f"recycled after {max_requests or 'unlimited'} requests)")
+            if self.on_worker is not None:
+                self.on_worker()
+            if first is not None:
+                first()
+            worker.run(SERVER_CONFIG["graceful_timeout"])
+        except BaseException as e:
+            print(f"[WARNING] Worker {os.getpid()} failed: {e}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)  # Never return into the master's code or run its exit handlers
+
+    def _stop(self, *_):
+        self.stopping = True
+
+    def _reload(self, *_):
+        print(f"[DEBUG] Recycling {len(self.children)} workers")
+        self.retiring += [pid for pid in self.children if pid not in self.retiring]
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            started = self.children.pop(pid, None)
+            if pid == self.recycling:
+                self.recycling = None
+            if pid in self.retiring:
+                self.retiring.remove(pid)
+            if not self.stopping:
+                if os.waitstatus_to_exitcode(status) != 0 and started and time.monotonic() - started < 5:
+                    time.sleep(1)  # Do not fork in a tight loop when workers crash on start
+                self.spawn()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._reload)
+        for _ in range(self.workers):
+            self.spawn()
+        while not self.stopping:
+            self._reap()
+            if self.retiring and self.recycling is None:
+                self.recycling = self.retiring[0]
+                os.kill(self.recycling, signal.SIGTERM)
+            time.sleep(0.2)
+        self.shutdown(SERVER_CONFIG["graceful_timeout"])
+
+    def shutdown(self, timeout):
+        print(f"[DEBUG] Stopping {len(self.children)} workers")
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + timeout + 5
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in self.children:
+            print(f"[WARNING] Killing worker {pid}")
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+
+def listen(host, port, backlog):
+    sock = socket.create_server((host, port), backlog=backlog)
+    # Every worker selects on the socket; the ones that lose the race to accept
+    # must not block in accept() (socketserver ignores the failed accept)
+    sock.setblocking(False)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default=SERVER_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=SERVER_CONFIG["port"])
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("DIFFUSIONLAB_WORKERS") or SERVER_CONFIG["workers"]))
+    parser.add_argument("--no-preload", action="store_true", help="Let each worker load the models on first use")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        sys.exit("The pre-forking server needs os.fork; run python -m diffusionlab.api.webapp instead")
+    # An upload may be referenced by a request that another worker handles
+    UPLOAD_CONFIG["persist"] = True
+    from diffusionlab.api.webapp import app, resume_jobs_in_background, start_background_tasks
+
+    sock = listen(args.host, args.port, SERVER_CONFIG["backlog"])
+    components = {} if args.no_preload else preload(SERVER_CONFIG["preload"])
+    freeze(components)
+    print(f"[DEBUG] Master {os.getpid()} listening on http://{args.host}:{args.port} with {args.workers} workers")
+    Master(app, sock, args.workers, torch_threads(args.workers), resume_jobs_in_background,
+           start_background_tasks).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,11 @@ Flask Web Application for Storyboard Generator
 """
 
 import os
-from flask import Flask, render_template, request, jsonify, send_file
+import functools
+import hmac
+import sys
+import threading
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context, g
 from PIL import Image, ImageDraw, ImageFont
 import time
 import io
@@ -13,6 +17,20 @@ from datetime import datetime
 import json
 from werkzeug.utils import secure_filename
 import numpy as np
+import random
+from contextlib import contextmanager
+from diffusionlab.compositor import compose_layout
+from diffusionlab import memory, profiling
+from diffusionlab.broker import broker_token, local_broker
+from diffusionlab.config import EXPORT_CONFIG, UPLOAD_CONFIG, STORAGE_CONFIG, DRAFT_CONFIG, TWO_STAGE_CONFIG, PROFILER_CONFIG, JOB_CONFIG
+from diffusionlab.masking import process_mask_data
+from diffusionlab.metrics import CONTENT_TYPE, Counter, Gauge, Histogram, render, request_stages, server_timing, stage, start_request
+from diffusionlab.node import run_distributed, run_panel
+from diffusionlab.jobs import get_store
+from diffusionlab.export import iter_storyboard_pdf, iter_panel_zip, resolve_image_format
+from diffusionlab.preprocess import get_engine, prefetch_control_maps
+from diffusionlab.storage import BlobStore
+from diffusionlab.uploads import UploadStore
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../..'))
 app = Flask(
@@ -39,9 +57,133 @@ def get_storyboards_dir():
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
 storyboards_dir = get_storyboards_dir()
 os.makedirs(storyboards_dir, exist_ok=True)
 
+# Uploads and outputs are stored by content hash, with background quota cleanup (see start_background_tasks);
+# the stores create their index (under the project root, like storyboards_dir) on first use
+DAY = 24 * 60 * 60
+output_store = BlobStore(
+    storyboards_dir,
+    max_bytes=STORAGE_CONFIG["outputs_max_bytes"],
+    max_age=STORAGE_CONFIG["outputs_max_age_days"] * DAY,
+    index_path=os.path.join(get_project_root(), STORAGE_CONFIG["index_directory"], 'outputs.sqlite')
+)
+upload_blobs = None
+if UPLOAD_CONFIG["persist"]:
+    upload_blobs = BlobStore(
+        app.config['UPLOAD_FOLDER'],
+        max_bytes=STORAGE_CONFIG["uploads_max_bytes"],
+        max_age=STORAGE_CONFIG["uploads_max_age_days"] * DAY,
+        index_path=os.path.join(get_project_root(), STORAGE_CONFIG["index_directory"], 'uploads.sqlite')
+    )
+
+# Decoded uploads are kept in memory and referenced by id from /generate
+upload_store = UploadStore(UPLOAD_CONFIG["store_max_items"], UPLOAD_CONFIG["store_max_bytes"], upload_blobs)
+
+# Requests that run the pipelines share their modules and scheduler, so they run one at a time
+generation_lock = threading.Lock()
+
+def cache_lookups():
+    lookups = [({'cache': 'uploads', 'result': 'hit'}, upload_store.stats['hits']),
+               ({'cache': 'uploads', 'result': 'miss'}, upload_store.stats['misses'])]
+    if get_engine.cache_info().currsize:  # Only once the preprocessing engine exists
+        stats = get_engine().cache.stats
+        lookups += [({'cache': 'control_maps', 'result': result}, stats[name])
+                    for result, name in (('memory_hit', 'memory_hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses'),
+                                         ('coalesced', 'coalesced'))]
+    return lookups
+
+def cache_hit_ratios():
+    totals = {}
+    for labels, count in cache_lookups():
+        hits, lookups = totals.get(labels['cache'], (0, 0))
+        totals[labels['cache']] = (hits + (count if labels['result'] != 'miss' else 0), lookups + count)
+    return [({'cache': cache}, hits / lookups) for cache, (hits, lookups) in totals.items() if lookups]
+
+def preprocess_pending():
+    return [({}, len(get_engine()._pending) if get_engine.cache_info().currsize else 0)]
+
+def loaded_components():
+    """Loaded model modules, without importing (and loading) the models for a probe"""
+    storyboard = sys.modules.get('diffusionlab.tasks.storyboard')
+    return storyboard.loaded_components() if storyboard else {}
+
+def component_bytes():
+    return [({'component': name, 'device': device}, size)
+            for name, devices in memory.component_sizes(loaded_components()).items() for device, size in devices.items()]
+
+REQUEST_SECONDS = Histogram('diffusionlab_request_seconds', 'HTTP request duration by endpoint', ['endpoint'])
+QUEUE_DEPTH = Gauge('diffusionlab_queue_depth', 'Generation requests waiting for the pipelines')
+IN_FLIGHT = Gauge('diffusionlab_jobs_in_flight', 'Generation requests running on the pipelines')
+PREPROCESS_PENDING = Gauge('diffusionlab_preprocess_pending', 'Control maps being computed', collect=preprocess_pending)
+RESIDENT_BYTES = Gauge('diffusionlab_process_resident_bytes', 'Resident set size of the process',
+                       collect=lambda: [({}, memory.rss_bytes() or 0)])
+COMPONENT_BYTES = Gauge('diffusionlab_component_bytes', 'Parameter and buffer bytes of each loaded model',
+                        ['component', 'device'], collect=component_bytes)
+CACHE_LOOKUPS = Counter('diffusionlab_cache_lookups_total', 'Cache lookups by result', ['cache', 'result'],
+                        collect=cache_lookups)
+CACHE_HIT_RATIO = Gauge('diffusionlab_cache_hit_ratio', 'Fraction of cache lookups that were hits', ['cache'],
+                        collect=cache_hit_ratios)
+
+def uses_pipelines(view):
+    """Run a view with exclusive use of the pipelines, counted in the queue and in-flight gauges.
+
+    This is also where requests are profiled while a session is armed (see /admin/profile).
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with QUEUE_DEPTH.track():
+            generation_lock.acquire()
+        try:
+            with IN_FLIGHT.track(), profiling.capture(request.endpoint), memory.RequestMemory(request.endpoint):
+                return view(*args, **kwargs)
+        finally:
+            generation_lock.release()
+    return wrapper
+
+def bearer_error(token, variable):
+    """Error response unless the request carries ``token`` (``Authorization: Bearer <token>``)"""
+    if not token:
+        return jsonify({'error': f'Endpoint disabled (set {variable})'}), 403
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+def requires_admin(view):
+    """Allow a view only with the admin token"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = os.environ.get('DIFFUSIONLAB_ADMIN_TOKEN') or PROFILER_CONFIG["admin_token"]
+        return bearer_error(token, 'DIFFUSIONLAB_ADMIN_TOKEN') or view(*args, **kwargs)
+    return wrapper
+
+def requires_broker(view):
+    """Allow a view only with the broker token while distributed generation is enabled"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if local_broker() is None:
+            return jsonify({'error': 'Distributed generation is disabled'}), 404
+        return bearer_error(broker_token(), 'DIFFUSIONLAB_BROKER_TOKEN') or view(*args, **kwargs)
+    return wrapper
+
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    start_request()
+
+@app.after_request
+def add_server_timing(response):
+    """Report the request's pipeline stages (see diffusionlab.metrics) in a Server-Timing header"""
+    if request.endpoint in (None, 'static', 'metrics'):
+        return response
+    total = time.perf_counter() - g.request_start
+    REQUEST_SECONDS.observe(total, endpoint=request.endpoint)
+    response.headers['Server-Timing'] = server_timing(request_stages() or {}, total)
+    return response
+
 # Configuration
 STYLES = {
     'cinematic': {
@@ -73,128 +215,197 @@ STYLES = {
 
 
 
-def create_storyboard_layout(images, captions, layout="horizontal"):
+@profiling.annotate('create_storyboard_layout')
+def create_storyboard_layout(images, captions, layout="horizontal", columns=None):
     """Create a flexible layout of images with captions"""
+    with stage('layout'):
+        return compose_layout(images, captions, layout, columns)
+
+def save_latents(key, latents):
+    """Keep an image's final latents next to it; returns the sidecar name"""
+    buffer = io.BytesIO()
+    np.save(buffer, latents)
+    return output_store.save_sidecar(key, '.latents.npy', buffer.getvalue())
+
+def load_latents(name):
+    data = output_store.read_sidecar(name, '.latents.npy')
+    return None if data is None else np.load(io.BytesIO(data))
+
+def save_output(image, images=None, captions=None, prompts=None, seeds=None, metadata=None, latents=None, drafts=None):
+    """Store a result by content hash, with its panels and a JSON manifest if given.
+
+    ``latents`` (one array per panel, or a single array for a single image)
+    are stored as sidecars so draft images can be re-decoded with the full
+    VAE by /finalize; ``drafts`` flags which panels are drafts (default: those
+    with latents). The manifest's ``size`` is that of the stored image, or
+    of each panel (after any two-stage upscale). Returns ``(filename,
+    png_bytes)`` so callers can reuse the encoded PNG.
+    """
+    filename, png_bytes = output_store.put_image(image)
     if not images:
-        return None
-    
-    img_width, img_height = images[0].size
-    caption_height = 80
-    spacing = 20
-    num_images = len(images)
-    
-    if layout == "horizontal":
-        # Create horizontal layout
-        total_width = img_width * num_images + spacing * (num_images - 1)
-        total_height = img_height + caption_height + spacing
-        
-        storyboard = Image.new('RGB', (total_width, total_height), 'white')
-        draw = ImageDraw.Draw(storyboard)
-        
-        # Try to load a font
-        try:
-            font = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 16)
-        except:
-            try:
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 16)
-            except:
-                font = ImageFont.load_default()
-        
-        # Place images and captions
-        for i, (image, caption) in enumerate(zip(images, captions)):
-            x = i * (img_width + spacing)
-            
-            # Paste image
-            storyboard.paste(image, (x, 0))
-            
-            # Draw caption background
-            caption_y = img_height + 10
-            draw.rectangle([x, caption_y, x + img_width, caption_y + caption_height - 10], 
-                          fill='#f8f9fa', outline='#dee2e6')
-            
-            # Draw caption text
-            draw.text((x + 10, caption_y + 10), f"Variation {i+1}: {caption}", 
-                     fill='black', font=font)
-    
-    elif layout == "vertical":
-        # Create vertical layout
-        total_width = img_width + 200  # Extra space for captions
-        total_height = (img_height + caption_height + spacing) * num_images
-        
-        storyboard = Image.new('RGB', (total_width, total_height), 'white')
-        draw = ImageDraw.Draw(storyboard)
-        
-        # Try to load a font
-        try:
-            font = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 16)
-        except:
-            try:
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 16)
-            except:
-                font = ImageFont.load_default()
-        
-        # Place images and captions
-        for i, (image, caption) in enumerate(zip(images, captions)):
-            y = i * (img_height + caption_height + spacing)
-            
-            # Paste image
-            storyboard.paste(image, (0, y))
-            
-            # Draw caption background
-            caption_x = img_width + 10
-            caption_y = y + 10
-            draw.rectangle([caption_x, caption_y, caption_x + 190, caption_y + caption_height - 10], 
-                          fill='#f8f9fa', outline='#dee2e6')
-            
-            # Draw caption text
-            draw.text((caption_x + 10, caption_y + 10), f"Variation {i+1}: {caption}", 
-                     fill='black', font=font)
-    
-    elif layout == "grid":
-        # Create grid layout (2 columns)
-        cols = 2
-        rows = (num_images + cols - 1) // cols  # Ceiling division
-        
-        total_width = img_width * cols + spacing * (cols - 1)
-        total_height = (img_height + caption_height + spacing) * rows
-        
-        storyboard = Image.new('RGB', (total_width, total_height), 'white')
-        draw = ImageDraw.Draw(storyboard)
-        
-        # Try to load a font
-        try:
-            font = ImageFont.truetype("/System/Library/Fonts/Arial.ttf", 16)
-        except:
-            try:
-                font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 16)
-            except:
-                font = ImageFont.load_default()
-        
-        # Place images and captions
-        for i, (image, caption) in enumerate(zip(images, captions)):
-            row = i // cols
-            col = i % cols
-            
-            x = col * (img_width + spacing)
-            y = row * (img_height + caption_height + spacing)
-            
-            # Paste image
-            storyboard.paste(image, (x, y))
-            
-            # Draw caption background
-            caption_y_pos = y + img_height + 10
-            draw.rectangle([x, caption_y_pos, x + img_width, caption_y_pos + caption_height - 10], 
-                          fill='#f8f9fa', outline='#dee2e6')
-            
-            # Draw caption text
-            draw.text((x + 10, caption_y_pos + 10), f"Variation {i+1}: {caption}", 
-                     fill='black', font=font)
-    
+        if latents is None:
+            return filename, png_bytes
+        manifest = {
+            'composite': filename,
+            'created': datetime.now().isoformat(),
+            'draft': True if drafts is None else drafts,
+            'latents': save_latents(filename, latents),
+            'panels': [],
+            'size': list(image.size)
+        }
+        manifest.update(metadata or {})
+        output_store.save_json(filename, manifest)
+        return filename, png_bytes
+    panels = []
+    for i, (panel, caption) in enumerate(zip(images, captions)):
+        panel_filename, _ = output_store.put_image(panel)
+        panels.append({
+            'file': panel_filename,
+            'caption': caption,
+            'prompt': prompts[i] if prompts else None,
+            'seed': seeds[i] if seeds else None
+        })
+        if latents and latents[i] is not None:
+            panels[-1]['latents'] = save_latents(panel_filename, latents[i])
+            panels[-1]['draft'] = drafts[i] if drafts else True
+    output_store.link(filename, [panel['file'] for panel in panels])
+    manifest = {
+        'composite': filename,
+        'created': datetime.now().isoformat(),
+        'panels': panels,
+        'size': list(images[0].size)
+    }
+    manifest.update(metadata or {})
+    output_store.save_json(filename, manifest)
+    return filename, png_bytes
+
+def render_panels(jobs, job=None):
+    """Run panel jobs (see diffusionlab.node.run_panel) here, or spread them over inference nodes.
+
+    Nodes are only used while at least one is connected; this process runs
+    the panels no node has picked up, so results never wait on the cluster.
+    With a ``job`` (see ``resumable``), panels it already holds are not
+    generated again and each new one is saved to it as soon as it is done.
+    """
+    results = job.finished_panels() if job else {}
+    missing = [i for i in range(len(jobs)) if i not in results]
+
+    def finished(index, result):
+        results[index] = result
+        if job is not None:
+            job.save_panel(index, result)
+
+    broker = local_broker()
+    if missing and broker is not None and broker.nodes():
+        print(f"[DEBUG] Distributing {len(missing)} panels over {len(broker.nodes())} nodes")
+        run_distributed(broker, 'panel', [jobs[i] for i in missing],
+                        on_result=lambda k, result: finished(missing[k], result))
     else:
-        # Default to horizontal layout
-        return create_storyboard_layout(images, captions, "horizontal")
-    
-    return storyboard
+        for i in missing:
+            print(f"[DEBUG] Generating panel {i+1}/{len(jobs)}: {jobs[i]['prompt'][:60]}")
+            finished(i, run_panel(jobs[i]))
+    return [results[i] for i in range(len(jobs))]
+
+def render_chain(frames, chain, job=None):
+    """Run a prompt chain (one ``{"prompt", "seed"}`` per frame) with ``chain`` as generation parameters.
+
+    With a ``job``, the chain continues after the frames it already holds,
+    from the latents saved with the last of them.
+    """
+    from diffusionlab.tasks.storyboard import generate_prompt_chain
+    results = job.finished_panels() if job else {}
+    start = 0
+    while start in results:
+        start += 1
+
+    def finished(i, image, latents, chain_latents):
+        results[start + i] = {'image': image, 'latents': latents, 'caption': None}
+        if job is not None:
+            job.save_panel(start + i, results[start + i], chain_latents)
+
+    if start < len(frames):
+        generate_prompt_chain(
+            [frame['prompt'] for frame in frames[start:]],
+            seeds=[frame['seed'] for frame in frames[start:]],
+            previous_latents=job.chain_latents(start - 1) if start else None,
+            on_frame=finished,
+            **chain
+        )
+    return [results[i] for i in range(len(frames))]
+
+@contextmanager
+def resumable(kind, panels, **extra):
+    """Keep the progress of a multi-panel request on disk (see diffusionlab.jobs); yields its job, or None.
+
+    Repeating the request after a crash opens the same job, whose ``panels``
+    then hold the parameters and seeds recorded the first time. The job is
+    keyed on the raw request JSON, so until it completes (or expires after
+    ``JOB_CONFIG["max_age_hours"]``) any identical request, including a
+    seedless one that would otherwise get fresh random seeds, gets the stored
+    seeds and panels; such responses carry ``"resumed": true``. The job is
+    removed when the block completes, and kept if it raises.
+    """
+    store = get_store()
+    if store is None:
+        yield None
+        return
+    data = request.get_json()
+    with store.open(kind, data) as job:
+        g.resumed = job.started
+        if job.started:
+            print(f"[DEBUG] Resuming job {job.id} ({len(job.finished())}/{len(job.panels)} panels done)")
+        else:
+            job.start(kind, data, panels, **extra)
+        yield job
+        job.finish()
+
+def resume_unfinished_jobs():
+    """Generate the missing panels of jobs left over from an earlier run.
+
+    The jobs are kept, so the client's retry finds every panel done and only
+    builds the composite.
+    """
+    store = get_store()
+    for key in store.unfinished():
+        with generation_lock, store.open_id(key) as job:
+            if not job.started:  # Finished by a request meanwhile
+                continue
+            print(f"[DEBUG] Resuming job {job.id} ({len(job.finished())}/{len(job.panels)} panels done)")
+            try:
+                from diffusionlab.tasks.storyboard import load_models
+                load_models()
+                if job.state['kind'] == 'prompt_chain':
+                    render_chain(job.panels, job.state['chain'], job)
+                else:
+                    render_panels(job.panels, job)
+            except Exception as e:
+                print(f"[WARNING] Could not resume job {job.id}: {e}")
+
+def start_background_tasks():
+    """Start the storage cleanup threads in the serving process (threads do not survive a fork)"""
+    for store in (output_store, upload_blobs):
+        if store is not None:
+            store.start_cleanup(STORAGE_CONFIG["cleanup_interval"])
+
+def resume_jobs_in_background():
+    """Start ``resume_unfinished_jobs`` on a thread if there are jobs to resume"""
+    store = get_store()
+    if store is None or not JOB_CONFIG["resume_on_start"] or not store.unfinished():
+        return None
+    thread = threading.Thread(target=resume_unfinished_jobs, name='resume-jobs', daemon=True)
+    thread.start()
+    return thread
+
+def load_panel_manifest(filename):
+    """Load the panel manifest saved for a composite, or None if there is none"""
+    return output_store.load_json(secure_filename(filename))
+
+def panel_seeds(base_seed, count, vary=True):
+    """Return one seed per panel, derived from a request seed (random if not given)"""
+    if base_seed is None:
+        base_seed = random.randrange(2**32)
+    base_seed = int(base_seed)
+    return [(base_seed + i) % 2**32 if vary else base_seed for i in range(count)]
 
 def allowed_file(filename):
     """Check if uploaded file has allowed extension"""
@@ -227,184 +438,61 @@ def resize_image(image, target_size=(512, 512)):
     
     return result
 
-def resize_image_for_inpainting(image, target_size=(512, 512)):
-    """Resize image to target size for inpainting (no padding, direct resize)"""
-    # Direct resize to target size without maintaining aspect ratio
-    # This ensures the image and mask are exactly the same size
-    return image.resize(target_size, Image.Resampling.LANCZOS)
-
-def process_mask_data(mask_data_url):
-    """Process base64 mask data and convert to PIL Image for inpainting"""
-    try:
-        # Remove data URL prefix
-        if mask_data_url.startswith('data:image/png;base64,'):
-            mask_data_url = mask_data_url.split(',')[1]
-        
-        # Decode base64 data
-        mask_bytes = base64.b64decode(mask_data_url)
-        
-        # Create PIL Image from bytes
-        mask_image = Image.open(io.BytesIO(mask_bytes))
-        
-        # Convert to RGBA if needed
-        if mask_image.mode != 'RGBA':
-            mask_image = mask_image.convert('RGBA')
-        
-        # Convert to numpy array
-        mask_array = np.array(mask_image)
-        
-        # Extract channels
-        red_channel = mask_array[:, :, 0]
-        green_channel = mask_array[:, :, 1]
-        blue_channel = mask_array[:, :, 2]
-        alpha_channel = mask_array[:, :, 3] if mask_array.shape[2] == 4 else np.full(red_channel.shape, 255)
-        
-        # More precise mask detection:
-        # 1. Red channel should be significantly higher than other channels
-        # 2. Red channel should be above a reasonable threshold
-        # 3. The difference between red and other channels should be significant
-        # 4. Alpha channel should be high (not transparent)
-        
-        # Calculate differences
-        red_green_diff = red_channel - green_channel
-        red_blue_diff = red_channel - blue_channel
-        
-        # Create more precise mask criteria
-        red_threshold = 80  # Minimum red value
-        diff_threshold = 30  # Minimum difference between red and other channels
-        alpha_threshold = 200  # Minimum alpha value
-        
-        # Create mask based on multiple criteria
-        red_brush_mask = (
-            (red_channel > red_threshold) &  # Red channel above threshold
-            (red_green_diff > diff_threshold) &  # Red significantly higher than green
-            (red_blue_diff > diff_threshold) &  # Red significantly higher than blue
-            (alpha_channel > alpha_threshold)  # Not transparent
-        )
-        
-        # Apply morphological operations to clean up the mask
-        try:
-            from scipy import ndimage
-            
-            # Remove small isolated pixels (noise)
-            red_brush_mask = ndimage.binary_opening(red_brush_mask, structure=np.ones((2, 2)))
-            
-            # Fill small holes
-            red_brush_mask = ndimage.binary_closing(red_brush_mask, structure=np.ones((3, 3)))
-            
-            print(f"[DEBUG] Applied morphological operations")
-        except ImportError:
-            print(f"[DEBUG] Scipy not available, skipping morphological operations")
-            # Simple alternative: remove very small isolated areas
-            try:
-                from scipy import ndimage as ndi
-                labeled, num_features = ndi.label(red_brush_mask)
-                for i in range(1, num_features + 1):
-                    component_size = np.sum(labeled == i)
-                    if component_size < 10:  # Remove components smaller than 10 pixels
-                        red_brush_mask[labeled == i] = False
-                print(f"[DEBUG] Removed {num_features} small components")
-            except:
-                print(f"[DEBUG] Could not clean mask, using as-is")
-        
-        # Create binary mask (white = inpaint, black = preserve)
-        binary_mask = np.where(red_brush_mask, 255, 0).astype(np.uint8)
-        
-        # Validate mask has sufficient coverage
-        masked_pixels = np.sum(binary_mask > 0)
-        total_pixels = binary_mask.size
-        mask_coverage = (masked_pixels / total_pixels) * 100
-        
-        print(f"[DEBUG] Mask coverage: {mask_coverage:.2f}% ({masked_pixels} pixels)")
-        
-        # If mask coverage is too low, it might be a detection issue
-        if mask_coverage < 0.1:  # Less than 0.1% coverage
-            print(f"[DEBUG] Warning: Very low mask coverage, might be detection issue")
-            # Try with more lenient thresholds
-            red_brush_mask_relaxed = (
-                (red_channel > 60) &  # Lower red threshold
-                (red_green_diff > 20) &  # Lower difference threshold
-                (red_blue_diff > 20) &
-                (alpha_channel > 150)  # Lower alpha threshold
-            )
-            binary_mask_relaxed = np.where(red_brush_mask_relaxed, 255, 0).astype(np.uint8)
-            relaxed_coverage = (np.sum(binary_mask_relaxed > 0) / total_pixels) * 100
-            print(f"[DEBUG] Relaxed mask coverage: {relaxed_coverage:.2f}%")
-            
-            if relaxed_coverage > mask_coverage:
-                binary_mask = binary_mask_relaxed
-                print(f"[DEBUG] Using relaxed mask detection")
-        
-        # Convert back to PIL Image
-        mask_pil = Image.fromarray(binary_mask, mode='L')
-        
-        print(f"[DEBUG] Mask processed: shape={binary_mask.shape}, unique values={np.unique(binary_mask)}")
-        print(f"[DEBUG] Red channel stats: min={red_channel.min()}, max={red_channel.max()}, mean={red_channel.mean():.2f}")
-        print(f"[DEBUG] Green channel stats: min={green_channel.min()}, max={green_channel.max()}, mean={green_channel.mean():.2f}")
-        print(f"[DEBUG] Blue channel stats: min={blue_channel.min()}, max={blue_channel.max()}, mean={blue_channel.mean():.2f}")
-        print(f"[DEBUG] Alpha channel stats: min={alpha_channel.min()}, max={alpha_channel.max()}, mean={alpha_channel.mean():.2f}")
-        print(f"[DEBUG] Red-Green diff stats: min={red_green_diff.min()}, max={red_green_diff.max()}, mean={red_green_diff.mean():.2f}")
-        print(f"[DEBUG] Red-Blue diff stats: min={red_blue_diff.min()}, max={red_blue_diff.max()}, mean={red_blue_diff.mean():.2f}")
-        print(f"[DEBUG] Red brush mask pixels: {np.sum(red_brush_mask)} out of {red_brush_mask.size}")
-        print(f"[DEBUG] Binary mask stats: min={binary_mask.min()}, max={binary_mask.max()}, mean={binary_mask.mean():.2f}")
-        
-        # Save mask for debugging
-        debug_mask_path = os.path.join(get_storyboards_dir(), 'debug_mask.png')
-        mask_pil.save(debug_mask_path)
-        print(f"[DEBUG] Debug mask saved to: {debug_mask_path}")
-        
-        return mask_pil
-    except Exception as e:
-        print(f"[DEBUG] Error processing mask data: {e}")
-        return None
-
-
-    
-    # Create storyboard layout
-    storyboard = create_storyboard_layout(images, captions)
-    
-    return storyboard, captions
-
 @app.route('/')
 def index():
     """Main page"""
     return render_template('index.html', styles=STYLES)
 
+def load_uploaded_image(ref, target_size=None):
+    """Return the RGB image for an upload id (or a legacy path under the upload folder).
+
+    With ``target_size`` the image is letterboxed to that size if it is not
+    already. Returns None if the upload is unknown.
+    """
+    upload_id = os.path.splitext(os.path.basename(ref))[0]
+    image = upload_store.get(upload_id, keep_resolution=target_size is None)
+    if image is None:
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(ref))
+        if not os.path.exists(filepath):
+            return None
+        with Image.open(filepath) as img:
+            image = img.convert('RGB')
+    if target_size and image.size != tuple(target_size):
+        image = resize_image(image, target_size)
+    return image
+
+def store_upload(keep_resolution=False):
+    """Validate and decode the uploaded file, returning (upload_id, error response)"""
+    if 'image' not in request.files:
+        return None, (jsonify({'error': 'No image file provided'}), 400)
+
+    file = request.files['image']
+    if file.filename == '':
+        return None, (jsonify({'error': 'No image file selected'}), 400)
+    if not allowed_file(file.filename):
+        return None, (jsonify({'error': 'Invalid file type. Please upload a valid image file.'}), 400)
+
+    # Identical uploads hash to the same id and are decoded only once; the spooled file is never read into memory
+    return upload_store.put(file.stream, keep_resolution=keep_resolution), None
+
 @app.route('/upload', methods=['POST'])
 def upload_image():
-    """Handle image upload for img2img"""
+    """Handle image upload for img2img and inpainting"""
     try:
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
-        
-        file = request.files['image']
-        if file.filename == '':
-            return jsonify({'error': 'No image file selected'}), 400
-        
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"upload_{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            
-            # Save the uploaded file
-            file.save(filepath)
-            
-            # Open and resize the image
-            with Image.open(filepath) as img:
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                resized_img = resize_image(img)
-                resized_img.save(filepath)
-            
-            return jsonify({
-                'success': True,
-                'filename': filename,
-                'filepath': filepath
-            })
-        else:
-            return jsonify({'error': 'Invalid file type. Please upload a valid image file.'}), 400
-    
+        start_time = time.perf_counter()
+        # Inpainting keeps the native resolution; only the masked region is denoised
+        upload_id, error = store_upload(keep_resolution=request.form.get('purpose') == 'inpainting')
+        if error:
+            return error
+        print(f"[DEBUG] Upload {upload_id} decoded in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+
+        return jsonify({
+            'success': True,
+            'upload_id': upload_id,
+            'filename': upload_id,
+            'filepath': upload_store.path_for(upload_id)
+        })
+
     except Exception as e:
         return jsonify({'error': f'Error uploading file: {str(e)}'}), 500
 
@@ -412,45 +500,25 @@ def upload_image():
 def upload_controlnet_image():
     """Handle ControlNet image upload"""
     try:
-        if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
-        
-        file = request.files['image']
-        if file.filename == '':
-            return jsonify({'error': 'No image file selected'}), 400
-        
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"controlnet_{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            
-            # Save the uploaded file
-            file.save(filepath)
-            
-            # Open and resize the image
-            with Image.open(filepath) as img:
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                resized_img = resize_image(img)
-                resized_img.save(filepath)
-            
-            # Return the relative path for the frontend
-            relative_path = f"uploads/{filename}"
-            
-            print(f"[DEBUG] ControlNet image uploaded: {filepath}")
-            return jsonify({
-                'success': True,
-                'image_path': relative_path
-            })
-        else:
-            return jsonify({'error': 'Invalid file type. Please upload a valid image file.'}), 400
-    
+        upload_id, error = store_upload()
+        if error:
+            return error
+        # Control maps are computed in the background while the user writes the prompt
+        prefetch_control_maps(upload_store.get(upload_id), image_key=upload_id)
+
+        print(f"[DEBUG] ControlNet image uploaded: {upload_id}")
+        return jsonify({
+            'success': True,
+            'upload_id': upload_id,
+            'image_path': upload_id
+        })
+
     except Exception as e:
         print(f"[ERROR] Error uploading ControlNet image: {e}")
         return jsonify({'error': f'Error uploading file: {str(e)}'}), 500
 
 @app.route('/generate', methods=['POST'])
+@uses_pipelines
 def generate_storyboard():
     try:
         data = request.get_json()
@@ -468,6 +536,10 @@ def generate_storyboard():
         prompt_chain_data = data.get('promptChain', None)
         batch_data = data.get('batch', None)
         controlnet_data = data.get('controlnet', None)
+        seed = data.get('seed', None)
+        draft = data.get('draft', None)  # Decode with the tiny autoencoder (re-decode kept images via /finalize)
+        two_stage = data.get('twoStage', None)  # Generate small, upscale the latents and refine at scale x size
+        two_stage = TWO_STAGE_CONFIG["default"] if two_stage is None else bool(two_stage)
         print(f"[DEBUG] /generate called with mode={mode}, genType={gen_type}, style={style}, prompt={prompt[:40]}")
         
         # Skip main prompt validation for prompt chaining mode and batch mode
@@ -483,7 +555,7 @@ def generate_storyboard():
             style = 'cinematic'
         # Import configurations needed for both AI and demo modes
         try:
-            from diffusionlab.config import INPAINTING_CONFIG, BATCH_CONFIG, CONTROLNET_CONFIG
+            from diffusionlab.config import INPAINTING_CONFIG, IMG2IMG_CONFIG, BATCH_CONFIG, CONTROLNET_CONFIG
         except ImportError as e:
             print(f"[DEBUG] ImportError loading configs: {e}")
             return jsonify({'error': 'Configuration not available. Please ensure diffusionlab/config.py is present.'}), 500
@@ -503,7 +575,7 @@ def generate_storyboard():
         print("[DEBUG] Entering AI generation mode.")
         try:
             from diffusionlab.tasks import storyboard
-            from diffusionlab.tasks.storyboard import generate_scene_variations, generate_caption, STYLE_PRESETS, IMAGE_CONFIG, load_models, generate_with_controlnet
+            from diffusionlab.tasks.storyboard import generate_scene_variations, generate_caption, STYLE_PRESETS, IMAGE_CONFIG, load_models, generate_with_controlnet, inpaint_masked_region, generate_img2img, generate_prompt_chain, generate_text_to_image
             # Load models if not already loaded
             load_models()
             # Access pipe and inpaint_pipe after loading
@@ -519,126 +591,55 @@ def generate_storyboard():
             scene = prompt
             style_preset = STYLE_PRESETS.get(style, STYLE_PRESETS["cinematic"])
             negative_prompt = style_preset["negative_prompt"]
+            latents = None
+            used_two_stage = False
             
             if inpainting_mode and inpainting_image_path and mask_data:
                     print(f"[DEBUG] AI Inpainting mode")
-                    print(f"[DEBUG] inpaint_pipe available: {inpaint_pipe is not None}")
+                    if inpaint_pipe is None:
+                        return jsonify({'error': 'Inpainting pipeline not available'}), 500
                     
-                    # Load the input image
-                    input_image = Image.open(inpainting_image_path).convert('RGB')
-                    input_image = resize_image_for_inpainting(input_image)
+                    # Load the input image at its native resolution; only the masked region is denoised
+                    input_image = load_uploaded_image(inpainting_image_path)
+                    if input_image is None:
+                        return jsonify({'error': 'Uploaded image not found. Please upload it again.'}), 400
                     print(f"[DEBUG] Input image size: {input_image.size}")
                     
                     # Process mask data
                     mask = process_mask_data(mask_data)
                     if mask is None:
                         return jsonify({'error': 'Failed to process mask data'}), 400
-                    print(f"[DEBUG] Mask size: {mask.size}, mode: {mask.mode}")
                     
                     # Ensure mask and image are the same size
                     if mask.size != input_image.size:
                         mask = mask.resize(input_image.size, Image.Resampling.NEAREST)
-                        print(f"[DEBUG] Resized mask to match image: {mask.size}")
                     
-                    # Check if mask contains any masked pixels
-                    mask_array = np.array(mask)
-                    masked_pixels = np.sum(mask_array > 0)
-                    total_pixels = mask_array.size
-                    mask_percentage = (masked_pixels / total_pixels) * 100
-                    print(f"[DEBUG] Mask contains {masked_pixels} masked pixels out of {total_pixels} ({mask_percentage:.2f}%)")
-                    
-                    if masked_pixels == 0:
+                    if mask.getbbox() is None:
                         return jsonify({'error': 'No masked areas detected. Please draw on areas you want to change.'}), 400
                     
-                    # Check if inpaint_pipe is available, fallback to regular pipe if not
-                    if inpaint_pipe is not None:
-                        print(f"[DEBUG] Using inpaint_pipe for inpainting")
-                        print(f"[DEBUG] inpaint_pipe type: {type(inpaint_pipe)}")
-                        try:
-                            # Try with original mask first
-                            print(f"[DEBUG] Trying inpainting with original mask")
-                            image = inpaint_pipe(
-                                scene,
-                                image=input_image,
-                                mask_image=mask,
-                                negative_prompt=negative_prompt,
-                                num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
-                                guidance_scale=IMAGE_CONFIG["guidance_scale"],
-                                # Add inpainting-specific parameters
-                                inpaint_full_res=True,
-                                inpaint_full_res_padding=32,
-                                mask_blur=4
-                            ).images[0]
-                            print(f"[DEBUG] Inpainting completed successfully with original mask")
-                        except Exception as e:
-                            print(f"[DEBUG] Inpainting failed with original mask: {e}")
-                            try:
-                                # Try with inverted mask
-                                print(f"[DEBUG] Trying inpainting with inverted mask")
-                                mask_array = np.array(mask)
-                                inverted_mask = np.where(mask_array > 0, 0, 255).astype(np.uint8)
-                                inverted_mask_pil = Image.fromarray(inverted_mask, mode='L')
-                                
-                                image = inpaint_pipe(
-                                    scene,
-                                    image=input_image,
-                                    mask_image=inverted_mask_pil,
-                                    negative_prompt=negative_prompt,
-                                    num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
-                                    guidance_scale=IMAGE_CONFIG["guidance_scale"],
-                                    inpaint_full_res=True,
-                                    inpaint_full_res_padding=32,
-                                    mask_blur=4
-                                ).images[0]
-                                print(f"[DEBUG] Inpainting completed successfully with inverted mask")
-                            except Exception as e2:
-                                print(f"[DEBUG] Inpainting failed with inverted mask: {e2}")
-                                print(f"[DEBUG] Falling back to regular pipe")
-                                # Fallback to regular pipe if inpainting fails
-                                image = pipe(
-                                    scene,
-                                    image=input_image,
-                                    strength=0.8,
-                                    negative_prompt=negative_prompt,
-                                    num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
-                                    guidance_scale=IMAGE_CONFIG["guidance_scale"]
-                                ).images[0]
-                    else:
-                        print(f"[DEBUG] inpaint_pipe not available, falling back to regular pipe")
-                        # Fallback to regular pipe (this will replace the entire image)
-                        image = pipe(
-                            scene,
-                            image=input_image,
-                            strength=0.8,  # High strength for more transformation
-                            negative_prompt=negative_prompt,
-                            num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
-                            guidance_scale=IMAGE_CONFIG["guidance_scale"]
-                        ).images[0]
+                    image = inpaint_masked_region(
+                        scene,
+                        input_image,
+                        mask,
+                        negative_prompt=negative_prompt,
+                        num_inference_steps=INPAINTING_CONFIG["num_inference_steps"],
+                        guidance_scale=INPAINTING_CONFIG["guidance_scale"]
+                    )
             elif img2img_mode and input_image_path:
                 print(f"[DEBUG] AI Image-to-Image mode with strength={strength}")
                 # Load the input image
-                input_image = Image.open(input_image_path).convert('RGB')
-                input_image = resize_image(input_image)
+                input_image = load_uploaded_image(input_image_path, UPLOAD_CONFIG["target_size"])
+                if input_image is None:
+                    return jsonify({'error': 'Uploaded image not found. Please upload it again.'}), 400
                 
-                # Use the inpainting pipeline for img2img by creating a full mask
-                # This gives us proper img2img functionality
-                width, height = IMAGE_CONFIG["width"], IMAGE_CONFIG["height"]
-                
-                # Create a full mask (all white = inpaint everything)
-                mask = Image.new('L', (width, height), 255)
-                
-                # Use the inpainting pipeline for img2img
-                # Use fewer inference steps to avoid index out of bounds error
-                num_steps = min(20, INPAINTING_CONFIG["num_inference_steps"])
-                image = inpaint_pipe(
-                    prompt=scene,
-                    image=input_image,
-                    mask_image=mask,
+                image = generate_img2img(
+                    scene,
+                    input_image,
+                    strength=strength,
                     negative_prompt=negative_prompt,
-                    num_inference_steps=num_steps,
-                    guidance_scale=INPAINTING_CONFIG["guidance_scale"],
-                    strength=strength  # This controls how much to change
-                ).images[0]
+                    num_inference_steps=IMG2IMG_CONFIG["num_inference_steps"],
+                    guidance_scale=IMG2IMG_CONFIG["guidance_scale"]
+                )
             elif gen_type == 'prompt-chaining' and prompt_chain_data:
                     print(f"[DEBUG] AI Prompt Chaining mode")
                     # Generate a sequence of images for prompt chaining
@@ -649,41 +650,51 @@ def generate_storyboard():
                     if len(prompts) < 2:
                         return jsonify({'error': 'At least 2 prompts required for prompt chaining'}), 400
                     
-                    print(f"[DEBUG] Generating {len(prompts)} images for prompt chain")
-                    images = []
-                    captions = []
+                    evolution_strength = min(max(float(evolution_strength), 0.0), 1.0)
+                    print(f"[DEBUG] Generating {len(prompts)} images for prompt chain (evolution strength {evolution_strength})")
+                    seeds = panel_seeds(seed, len(prompts))
                     style_preset = STYLE_PRESETS.get(style, STYLE_PRESETS["cinematic"])
                     negative_prompt = style_preset["negative_prompt"]
                     
-                    for i, chain_prompt in enumerate(prompts):
-                        print(f"[DEBUG] Generating prompt chain image {i+1}/{len(prompts)}: {chain_prompt[:60]}")
-                        
-                        # Add style suffix to the prompt
-                        full_prompt = f"{chain_prompt}, {style_preset['prompt_suffix']}"
-                        
-                        image = pipe(
-                            full_prompt,
-                            negative_prompt=negative_prompt,
-                            num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
-                            guidance_scale=IMAGE_CONFIG["guidance_scale"],
-                            width=IMAGE_CONFIG["width"],
-                            height=IMAGE_CONFIG["height"]
-                        ).images[0]
+                    # Add style suffix to the prompts; each frame evolves from the previous frame's latents
+                    full_prompts = [f"{chain_prompt}, {style_preset['prompt_suffix']}" for chain_prompt in prompts]
+                    draft = DRAFT_CONFIG["default"] if draft is None else bool(draft)
+                    frames = [{'prompt': full_prompt, 'seed': seeds[i]} for i, full_prompt in enumerate(full_prompts)]
+                    chain = {
+                        'evolution_strength': evolution_strength,
+                        'negative_prompt': negative_prompt,
+                        'num_inference_steps': IMAGE_CONFIG["num_inference_steps"],
+                        'draft': draft,
+                        'guidance_scale': IMAGE_CONFIG["guidance_scale"],
+                        'width': IMAGE_CONFIG["width"],
+                        'height': IMAGE_CONFIG["height"]
+                    }
+                    with resumable('prompt_chain', frames, chain=chain) as job:
+                        if job is not None:
+                            frames, chain = job.panels, job.state['chain']
+                            seeds, draft = [frame['seed'] for frame in frames], chain['draft']
+                        results = render_chain(frames, chain, job)
+                        images = [result['image'] for result in results]
+                        latents = [result['latents'] for result in results] if draft else None
+                        captions = [f"Step {i+1}: {chain_prompt[:50]}..." for i, chain_prompt in enumerate(prompts)]
                         
-                        caption = f"Step {i+1}: {chain_prompt[:50]}..."
-                        images.append(image)
-                        captions.append(caption)
-                    
-                    # Create storyboard layout for the prompt chain
-                    storyboard = create_storyboard_layout(images, captions)
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"prompt_chain_{timestamp}.png"
-                    filepath = os.path.join(get_storyboards_dir(), filename)
-                    storyboard.save(filepath)
-                    buffer = io.BytesIO()
-                    storyboard.save(buffer, format='PNG')
-                    buffer.seek(0)
-                    img_base64 = base64.b64encode(buffer.getvalue()).decode()
+                        # Create storyboard layout for the prompt chain
+                        storyboard = create_storyboard_layout(images, captions, layout)
+                        filename, png_bytes = save_output(storyboard, images, captions, prompts=prompts, seeds=seeds, latents=latents, metadata={
+                            'kind': 'prompt_chain',
+                            'prompt': prompt or "Story Evolution",
+                            'style': style,
+                            'layout': layout,
+                            'evolutionStrength': evolution_strength,
+                            'parameters': {
+                                'negative_prompt': negative_prompt,
+                                'num_inference_steps': IMAGE_CONFIG["num_inference_steps"],
+                                'guidance_scale': IMAGE_CONFIG["guidance_scale"],
+                                'width': IMAGE_CONFIG["width"],
+                                'height': IMAGE_CONFIG["height"]
+                            }
+                        })
+                    img_base64 = base64.b64encode(png_bytes).decode()
                     return jsonify({
                         'success': True,
                         'image': img_base64,
@@ -694,7 +705,10 @@ def generate_storyboard():
                         'mode': mode,
                         'promptChain': True,
                         'evolutionStrength': evolution_strength,
-                        'layout': layout
+                        'layout': layout,
+                        'seeds': seeds,
+                        'draft': draft,
+                        'resumed': g.get('resumed', False)
                     })
             elif gen_type == 'batch' and batch_data:
                 print(f"[DEBUG] AI Batch Generation mode")
@@ -709,44 +723,57 @@ def generate_storyboard():
                 
                 print(f"[DEBUG] Generating {batch_count} variations with layout={batch_layout}, variation_strength={variation_strength}")
                 
-                images = []
-                captions = []
                 style_preset = STYLE_PRESETS.get(style, STYLE_PRESETS["cinematic"])
                 negative_prompt = style_preset["negative_prompt"]
                 
                 # Add style suffix to the prompt
                 full_prompt = f"{scene}, {style_preset['prompt_suffix']}"
+                seeds = panel_seeds(seed, batch_count, BATCH_CONFIG["seed_variation"])
+                draft = DRAFT_CONFIG["batch_variations"] if draft is None else bool(draft)
                 
-                for i in range(batch_count):
-                    print(f"[DEBUG] Generating batch variation {i+1}/{batch_count}")
-                    
-                    # Vary the guidance scale and inference steps for diversity
-                    guidance_variation = IMAGE_CONFIG["guidance_scale"] + (variation_strength - 0.5) * 2
-                    step_variation = max(20, IMAGE_CONFIG["num_inference_steps"] + int((variation_strength - 0.5) * 10))
-                    
-                    image = pipe(
-                        full_prompt,
-                        negative_prompt=negative_prompt,
-                        num_inference_steps=step_variation,
-                        guidance_scale=guidance_variation,
-                        width=IMAGE_CONFIG["width"],
-                        height=IMAGE_CONFIG["height"]
-                    ).images[0]
-                    
-                    caption = f"Variation {i+1}: {scene[:50]}..."
-                    images.append(image)
-                    captions.append(caption)
+                # Vary the guidance scale and inference steps for diversity
+                guidance_variation = IMAGE_CONFIG["guidance_scale"] + (variation_strength - 0.5) * 2
+                step_variation = max(20, IMAGE_CONFIG["num_inference_steps"] + int((variation_strength - 0.5) * 10))
                 
-                # Create batch layout (outside the for loop)
-                storyboard = create_storyboard_layout(images, captions, batch_layout)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"batch_{timestamp}.png"
-                filepath = os.path.join(get_storyboards_dir(), filename)
-                storyboard.save(filepath)
-                buffer = io.BytesIO()
-                storyboard.save(buffer, format='PNG')
-                buffer.seek(0)
-                img_base64 = base64.b64encode(buffer.getvalue()).decode()
+                jobs = [{
+                    'prompt': full_prompt,
+                    'negative_prompt': negative_prompt,
+                    'num_inference_steps': step_variation,
+                    'guidance_scale': guidance_variation,
+                    'width': IMAGE_CONFIG["width"],
+                    'height': IMAGE_CONFIG["height"],
+                    'seed': seeds[i],
+                    'draft': draft,
+                    'two_stage': two_stage
+                } for i in range(batch_count)]
+                with resumable('batch', jobs) as job:
+                    if job is not None:
+                        jobs = job.panels
+                        seeds = [params['seed'] for params in jobs]
+                    panels = render_panels(jobs, job)
+                    images = [panel['image'] for panel in panels]
+                    captions = [f"Variation {i+1}: {scene[:50]}..." for i in range(batch_count)]
+                    latents = [panel['latents'] for panel in panels]
+                    
+                    # Create batch layout
+                    storyboard = create_storyboard_layout(images, captions, batch_layout)
+                    filename, png_bytes = save_output(storyboard, images, captions, prompts=[full_prompt] * len(images), seeds=seeds, latents=latents, metadata={
+                        'kind': 'batch',
+                        'prompt': prompt,
+                        'style': style,
+                        'layout': batch_layout,
+                        'variationStrength': variation_strength,
+                        'parameters': {
+                            'negative_prompt': negative_prompt,
+                            'num_inference_steps': step_variation,
+                            'guidance_scale': guidance_variation,
+                            'width': IMAGE_CONFIG["width"],
+                            'height': IMAGE_CONFIG["height"],
+                            'two_stage': two_stage,
+                            'scale': TWO_STAGE_CONFIG["scale"] if two_stage else 1.0  # Output = width/height x scale
+                        }
+                    })
+                img_base64 = base64.b64encode(png_bytes).decode()
                 return jsonify({
                     'success': True,
                     'image': img_base64,
@@ -758,15 +785,19 @@ def generate_storyboard():
                     'batch': True,
                     'batchCount': batch_count,
                     'layout': batch_layout,
-                    'variationStrength': variation_strength
+                    'variationStrength': variation_strength,
+                    'seeds': seeds,
+                    'draft': draft,
+                    'twoStage': two_stage,
+                    'resumed': g.get('resumed', False)
                 })
             elif gen_type == 'controlnet' and controlnet_image_path and controlnet_data:
                 print(f"[DEBUG] AI ControlNet mode")
-                # Load the control image - construct proper path
-                control_image_full_path = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(controlnet_image_path))
-                print(f"[DEBUG] Loading control image from: {control_image_full_path}")
-                control_image = Image.open(control_image_full_path).convert('RGB')
-                control_image = resize_image(control_image)
+                # Load the control image from the upload store
+                print(f"[DEBUG] Loading control image: {controlnet_image_path}")
+                control_image = load_uploaded_image(controlnet_image_path, UPLOAD_CONFIG["target_size"])
+                if control_image is None:
+                    return jsonify({'error': 'ControlNet reference image not found. Please upload it again.'}), 400
                 
                 # Get ControlNet parameters
                 control_model = controlnet_data.get('model', 'canny')
@@ -788,6 +819,7 @@ def generate_storyboard():
                         guidance_start=guidance_start,
                         guidance_end=guidance_end,
                         negative_prompt=negative_prompt,
+                        image_key=os.path.splitext(os.path.basename(controlnet_image_path))[0],
                         num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
                         guidance_scale=IMAGE_CONFIG["guidance_scale"],
                         width=IMAGE_CONFIG["width"],
@@ -797,75 +829,92 @@ def generate_storyboard():
                 except Exception as e:
                     print(f"[DEBUG] ControlNet generation failed: {e}")
                     # Fallback to regular generation
-                    image = pipe(
-                        scene,
-                        negative_prompt=negative_prompt,
-                        num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
-                        guidance_scale=IMAGE_CONFIG["guidance_scale"],
-                        width=IMAGE_CONFIG["width"],
-                        height=IMAGE_CONFIG["height"]
-                    ).images[0]
+                    with profiling.region('pipe:text_to_image'):
+                        image = pipe(
+                            scene,
+                            negative_prompt=negative_prompt,
+                            num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
+                            guidance_scale=IMAGE_CONFIG["guidance_scale"],
+                            width=IMAGE_CONFIG["width"],
+                            height=IMAGE_CONFIG["height"]
+                        ).images[0]
             else:
                 # Generate image using text-to-image
-                image = pipe(
+                used_two_stage = two_stage
+                image, latents = generate_text_to_image(
                     scene,
+                    draft=DRAFT_CONFIG["default"] if draft is None else bool(draft),
+                    two_stage=two_stage,
                     negative_prompt=negative_prompt,
                     num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
                     guidance_scale=IMAGE_CONFIG["guidance_scale"],
                     width=IMAGE_CONFIG["width"],
                     height=IMAGE_CONFIG["height"]
-                ).images[0]
-                
-                caption = generate_caption(scene)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"single_art_{timestamp}.png"
-                filepath = os.path.join(get_storyboards_dir(), filename)
-                image.save(filepath)
-                buffer = io.BytesIO()
-                image.save(buffer, format='PNG')
-                buffer.seek(0)
-                img_base64 = base64.b64encode(buffer.getvalue()).decode()
-                return jsonify({
-                    'success': True,
-                    'image': img_base64,
-                    'filename': filename,
-                    'caption': caption,
-                    'prompt': prompt,
-                    'style': style,
-                    'mode': mode,
-                    'img2img': img2img_mode,
-                    'inpainting': inpainting_mode,
-                    'controlnet': gen_type == 'controlnet'
-                })
+                )
+            
+            # Single-image modes (text-to-image, img2img, inpainting, ControlNet) share the response
+            caption = generate_caption(scene)
+            filename, png_bytes = save_output(image, latents=latents, metadata={'kind': 'single', 'prompt': prompt, 'style': style,
+                                                                                'two_stage': used_two_stage})
+            img_base64 = base64.b64encode(png_bytes).decode()
+            return jsonify({
+                'success': True,
+                'image': img_base64,
+                'filename': filename,
+                'caption': caption,
+                'prompt': prompt,
+                'style': style,
+                'mode': mode,
+                'img2img': img2img_mode,
+                'inpainting': inpainting_mode,
+                'controlnet': gen_type == 'controlnet',
+                'draft': latents is not None,
+                'twoStage': used_two_stage
+            })
         else:
             print("[DEBUG] AI Storyboard mode.")
             scene_variations = generate_scene_variations(prompt, style)
-            images = []
-            captions = []
+            seeds = panel_seeds(seed, len(scene_variations))
+            draft = DRAFT_CONFIG["default"] if draft is None else bool(draft)
             style_preset = STYLE_PRESETS.get(style, STYLE_PRESETS["cinematic"])
             negative_prompt = style_preset["negative_prompt"]
-            for i, scene in enumerate(scene_variations):
-                print(f"[DEBUG] Generating AI image {i+1}/5 for: {scene[:60]}")
-                image = pipe(
-                    scene,
-                    negative_prompt=negative_prompt,
-                    num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
-                    guidance_scale=IMAGE_CONFIG["guidance_scale"],
-                    width=IMAGE_CONFIG["width"],
-                    height=IMAGE_CONFIG["height"]
-                ).images[0]
-                caption = generate_caption(scene)
-                images.append(image)
-                captions.append(caption)
-            storyboard = create_storyboard_layout(images, captions)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"storyboard_{timestamp}.png"
-            filepath = os.path.join(get_storyboards_dir(), filename)
-            storyboard.save(filepath)
-            buffer = io.BytesIO()
-            storyboard.save(buffer, format='PNG')
-            buffer.seek(0)
-            img_base64 = base64.b64encode(buffer.getvalue()).decode()
+            jobs = [{
+                'prompt': scene,
+                'negative_prompt': negative_prompt,
+                'num_inference_steps': IMAGE_CONFIG["num_inference_steps"],
+                'guidance_scale': IMAGE_CONFIG["guidance_scale"],
+                'width': IMAGE_CONFIG["width"],
+                'height': IMAGE_CONFIG["height"],
+                'seed': seeds[i],
+                'draft': draft,
+                'two_stage': two_stage,
+                'caption': True
+            } for i, scene in enumerate(scene_variations)]
+            with resumable('storyboard', jobs) as job:
+                if job is not None:
+                    jobs = job.panels
+                    seeds = [params['seed'] for params in jobs]
+                panels = render_panels(jobs, job)
+                images = [panel['image'] for panel in panels]
+                captions = [panel['caption'] for panel in panels]
+                latents = [panel['latents'] for panel in panels]
+                storyboard = create_storyboard_layout(images, captions)
+                filename, png_bytes = save_output(storyboard, images, captions, prompts=[params['prompt'] for params in jobs], seeds=seeds, latents=latents, metadata={
+                    'kind': 'storyboard',
+                    'prompt': prompt,
+                    'style': style,
+                    'layout': 'horizontal',
+                    'parameters': {
+                        'negative_prompt': negative_prompt,
+                        'num_inference_steps': IMAGE_CONFIG["num_inference_steps"],
+                        'guidance_scale': IMAGE_CONFIG["guidance_scale"],
+                        'width': IMAGE_CONFIG["width"],
+                        'height': IMAGE_CONFIG["height"],
+                        'two_stage': two_stage,
+                        'scale': TWO_STAGE_CONFIG["scale"] if two_stage else 1.0  # Output = width/height x scale
+                    }
+                })
+            img_base64 = base64.b64encode(png_bytes).decode()
             return jsonify({
                 'success': True,
                 'image': img_base64,
@@ -873,25 +922,163 @@ def generate_storyboard():
                 'captions': captions,
                 'prompt': prompt,
                 'style': style,
-                'mode': mode
+                'mode': mode,
+                'seeds': seeds,
+                'draft': draft,
+                'twoStage': two_stage,
+                'resumed': g.get('resumed', False)
             })
     except Exception as e:
         print(f"[DEBUG] Exception in /generate: {e}")
         return jsonify({'error': f'Error generating: {str(e)}'}), 500
 
+@app.route('/finalize/<filename>', methods=['POST'])
+@uses_pipelines
+def finalize_output(filename):
+    """Re-decode the kept draft images of a result with the full VAE.
+
+    The JSON body may list ``panels`` (indices) to keep; by default every draft
+    panel is re-decoded. A new composite is stored and returned like /generate.
+    """
+    try:
+        filename = secure_filename(filename)
+        manifest = load_panel_manifest(filename)
+        if not manifest:
+            return jsonify({'error': f'No stored latents for {filename}'}), 404
+        data = request.get_json(silent=True) or {}
+        
+        from diffusionlab.tasks.storyboard import load_models, decode_latents
+        load_models()
+        
+        metadata = {key: value for key, value in manifest.items() if key not in ('composite', 'created', 'panels', 'draft', 'latents', 'size')}
+        metadata['finalized_from'] = filename
+        if not manifest['panels']:
+            latents = load_latents(filename)
+            if latents is None:
+                return jsonify({'error': f'No stored latents for {filename}'}), 404
+            image = decode_latents(latents)[0]
+            new_filename, png_bytes = save_output(image, latents=latents, drafts=False, metadata=metadata)
+            finalized = [0]
+        else:
+            panels = manifest['panels']
+            keep = data.get('panels')
+            if keep is None:
+                keep = [i for i, panel in enumerate(panels) if panel.get('draft')]
+            keep = [int(i) for i in keep if 0 <= int(i) < len(panels)]
+            
+            images, latents, drafts, finalized = [], [], [], []
+            for i, panel in enumerate(panels):
+                panel_latents = load_latents(panel['file']) if panel.get('latents') else None
+                if i in keep and panel_latents is not None:
+                    images.append(decode_latents(panel_latents)[0])
+                    drafts.append(False)
+                    finalized.append(i)
+                else:
+                    path = output_store.path(panel['file'])
+                    if not os.path.exists(path):
+                        return jsonify({'error': f'Panel files missing for {filename}'}), 404
+                    with Image.open(path) as img:
+                        images.append(img.convert('RGB'))
+                    drafts.append(bool(panel.get('draft')))
+                latents.append(panel_latents)
+            
+            captions = [panel['caption'] for panel in panels]
+            storyboard = create_storyboard_layout(images, captions, manifest.get('layout', 'horizontal'))
+            new_filename, png_bytes = save_output(
+                storyboard, images, captions,
+                prompts=[panel.get('prompt') for panel in panels],
+                seeds=[panel.get('seed') for panel in panels],
+                metadata=metadata, latents=latents, drafts=drafts
+            )
+        print(f"[DEBUG] Finalized {filename} -> {new_filename} (panels {finalized})")
+        return jsonify({
+            'success': True,
+            'image': base64.b64encode(png_bytes).decode(),
+            'filename': new_filename,
+            'finalized': finalized
+        })
+    except Exception as e:
+        print(f"[DEBUG] Exception in /finalize: {e}")
+        return jsonify({'error': f'Error finalizing: {str(e)}'}), 500
+
 @app.route('/download/<filename>')
 def download_storyboard(filename):
     """Download storyboard as PNG"""
     try:
-        filepath = os.path.join(get_storyboards_dir(), filename)
+        filename = secure_filename(filename)
+        filepath = output_store.path(filename)
         
         if os.path.exists(filepath):
+            output_store.touch(filename)
             return send_file(filepath, as_attachment=True, download_name=filename)
         else:
-            return jsonify({'error': f'File not found: {filepath}'}), 404
+            return jsonify({'error': f'File not found: {filename}'}), 404
     except Exception as e:
         return jsonify({'error': f'Error downloading file: {str(e)}'}), 500
 
+@app.route('/export/pdf/<filename>')
+def export_pdf(filename):
+    """Stream a multi-page PDF with one or more panels per page"""
+    try:
+        filename = secure_filename(filename)
+        manifest = load_panel_manifest(filename)
+        if manifest and manifest['panels']:
+            panels = [output_store.path(panel['file']) for panel in manifest['panels']]
+            captions = [panel['caption'] for panel in manifest['panels']]
+            prompt = manifest.get('prompt')
+            style = manifest.get('style')
+            metadata = {'timestamp': manifest.get('created', 'Unknown')}
+        else:
+            composite_path = output_store.path(filename)
+            if not os.path.exists(composite_path):
+                return jsonify({'error': f'File not found: {filename}'}), 404
+            panels, captions, prompt, style, metadata = [composite_path], [], None, None, None
+        
+        missing = [path for path in panels if not os.path.exists(path)]
+        if missing:
+            return jsonify({'error': f'Panel files missing for {filename}'}), 404
+        output_store.touch(filename, *(os.path.basename(path) for path in panels))
+        
+        per_page = request.args.get('per_page', EXPORT_CONFIG["pdf_panels_per_page"], type=int)
+        pdf_name = f"{os.path.splitext(filename)[0]}.pdf"
+        return Response(
+            stream_with_context(iter_storyboard_pdf(
+                panels, captions, prompt=prompt, style=style, metadata=metadata, panels_per_page=per_page
+            )),
+            mimetype='application/pdf',
+            headers={'Content-Disposition': f'attachment; filename={pdf_name}'}
+        )
+    except Exception as e:
+        return jsonify({'error': f'Error exporting PDF: {str(e)}'}), 500
+
+@app.route('/export/zip/<filename>')
+def export_zip(filename):
+    """Stream a ZIP with every panel at full resolution, the composite and a manifest"""
+    try:
+        filename = secure_filename(filename)
+        composite_path = output_store.path(filename)
+        if not os.path.exists(composite_path):
+            return jsonify({'error': f'File not found: {filename}'}), 404
+        
+        manifest = load_panel_manifest(filename) or {'composite': filename, 'panels': []}
+        panels = [output_store.path(panel['file']) for panel in manifest['panels']]
+        missing = [path for path in panels if not os.path.exists(path)]
+        if missing:
+            return jsonify({'error': f'Panel files missing for {filename}'}), 404
+        output_store.touch(filename, *(panel['file'] for panel in manifest['panels']))
+        
+        image_format = resolve_image_format(request.args.get('format'))
+        zip_name = f"{os.path.splitext(filename)[0]}.zip"
+        return Response(
+            stream_with_context(iter_panel_zip(panels, composite=composite_path, manifest=manifest, image_format=image_format)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename={zip_name}'}
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Error exporting ZIP: {str(e)}'}), 500
+
 @app.route('/api/styles')
 def get_styles():
     """Get available styles"""
@@ -900,19 +1087,105 @@ def get_styles():
 @app.route('/health')
 def health_check():
     """Health check endpoint"""
-    try:
-        # Test if inpainting pipeline is available
-        from diffusionlab.tasks.storyboard import inpaint_pipe
-        inpaint_available = inpaint_pipe is not None
-    except:
-        inpaint_available = False
+    # Only look at modules that are already imported: a probe must not load the ML stack
+    storyboard = sys.modules.get('diffusionlab.tasks.storyboard')
+    inpaint_available = storyboard is not None and storyboard.inpaint_pipe is not None
+    # Attention/VAE/offload settings chosen when the models were loaded
+    tuning = sys.modules.get('diffusionlab.tuning')
+    performance = dict(tuning.performance_report) if tuning else None
     
     return jsonify({
         'status': 'healthy', 
         'timestamp': datetime.now().isoformat(),
-        'inpainting_available': inpaint_available
+        'inpainting_available': inpaint_available,
+        'performance': performance,
+        'memory': memory.report(loaded_components()),
+        'broker': broker_status()
     })
 
+def broker_status():
+    broker = local_broker()
+    if broker is None:
+        return None
+    return {'nodes': broker.nodes(), 'jobs': broker.stats()}
+
+@app.route('/health/memory')
+def memory_health():
+    """Memory report including live tensor and image counts (walks the heap, so not for frequent probes)"""
+    return jsonify(memory.report(loaded_components(), live=True))
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics"""
+    return Response(render(), content_type=CONTENT_TYPE)
+
+@app.route('/admin/profile', methods=['POST'])
+@requires_admin
+def start_profiling():
+    """Profile the next ``requests`` generation requests and/or those within ``seconds``.
+
+    Body: ``{"profiler": "torch" | "sampling", "requests": N, "seconds": S}``
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        session = profiling.start(data.get('profiler', 'torch'), data.get('requests'), data.get('seconds'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'session': session})
+
+@app.route('/admin/profile', methods=['GET'])
+@requires_admin
+def profiling_status():
+    """Current session and the stored traces"""
+    return jsonify({'session': profiling.status(), 'sessions': profiling.sessions()})
+
+@app.route('/admin/profile', methods=['DELETE'])
+@requires_admin
+def stop_profiling():
+    return jsonify({'success': True, 'session': profiling.stop()})
+
+@app.route('/admin/profile/<session_id>/<name>')
+@requires_admin
+def download_profile(session_id, name):
+    """Download a trace (.trace.json) or folded stacks (.folded)"""
+    path = profiling.artifact_path(secure_filename(session_id), secure_filename(name))
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, as_attachment=True)
+
+@app.route('/broker/heartbeat', methods=['POST'])
+@requires_broker
+def broker_heartbeat():
+    """Inference node heartbeat: ``{node, capacity, busy, info}``"""
+    data = request.get_json()
+    local_broker().heartbeat(data['node'], data.get('capacity', 1), data.get('busy', 0), data.get('info'))
+    return jsonify({'success': True})
+
+@app.route('/broker/claim', methods=['POST'])
+@requires_broker
+def broker_claim():
+    """Hand the oldest queued job to an inference node (``job`` is null when there is none)"""
+    return jsonify({'job': local_broker().claim(request.get_json()['node'])})
+
+@app.route('/broker/jobs/<job_id>/complete', methods=['POST'])
+@requires_broker
+def broker_complete(job_id):
+    data = request.get_json()
+    return jsonify({'accepted': local_broker().complete(job_id, data['node'], data['result'])})
+
+@app.route('/broker/jobs/<job_id>/fail', methods=['POST'])
+@requires_broker
+def broker_fail(job_id):
+    data = request.get_json()
+    return jsonify({'accepted': local_broker().fail(job_id, data['node'], data.get('error', 'unknown error'))})
+
+@app.route('/admin/memory/cleanup', methods=['POST'])
+@requires_admin
+def cleanup_memory():
+    """Run the post-request cleanup now; returns RSS before and after"""
+    with generation_lock:
+        return jsonify(memory.cleanup())
+
 @app.route('/test-mask', methods=['POST'])
 def test_mask():
     """Test endpoint for mask processing"""
@@ -970,6 +1243,7 @@ def test_mask():
         return jsonify({'error': f'Error processing mask: {str(e)}'}), 500
 
 @app.route('/test-inpainting', methods=['POST'])
+@uses_pipelines
 def test_inpainting():
     """Test endpoint for inpainting functionality"""
     try:
@@ -986,7 +1260,6 @@ def test_inpainting():
             image_data = image_data.split(',')[1]
         image_bytes = base64.b64decode(image_data)
         input_image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        input_image = resize_image_for_inpainting(input_image)
         
         # Process mask data
         mask = process_mask_data(mask_data)
@@ -995,16 +1268,16 @@ def test_inpainting():
         
         # Check if inpainting pipeline is available
         try:
-            from diffusionlab.tasks.storyboard import inpaint_pipe
+            from diffusionlab.tasks.storyboard import inpaint_pipe, inpaint_masked_region
             if inpaint_pipe is not None:
                 # Try inpainting
-                result = inpaint_pipe(
+                result = inpaint_masked_region(
                     prompt,
-                    image=input_image,
-                    mask_image=mask,
+                    input_image,
+                    mask,
                     num_inference_steps=10,  # Use fewer steps for testing
                     guidance_scale=7.5
-                ).images[0]
+                )
                 
                 # Convert result to base64
                 buffer = io.BytesIO()
@@ -1030,5 +1303,8 @@ if __name__ == '__main__':
     print("🌐 Open your browser to: http://localhost:5001")
     print("🚀 AI-powered diffusion models ready for generation")
     print("✨ Ready to create amazing AI-generated art and storyboards!")
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':  # The reloader's serving process, not its watcher
+        start_background_tasks()
+        resume_jobs_in_background()
     
     app.run(debug=True, host='0.0.0.0', port=5001) 
\ No newline at end of file
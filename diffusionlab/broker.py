@@ -0,0 +1,260 @@
+"""
+Job broker for spreading generation work across inference nodes
+
+A web node submits jobs (e.g. the panels of a storyboard) to a broker and
+collects their results; inference nodes (``python -m diffusionlab.node``)
+claim jobs, run them and report back. Results are stored with the job until
+the web node that submitted it collects them. Nodes send heartbeats with their
+capacity; jobs held by a node that stops sending them are queued again.
+
+``SQLiteBroker`` keeps the queue in a SQLite file, shared by the web node's
+processes and any node on the same host. ``HTTPBroker`` is the network client
+nodes on other machines use: it calls the ``/broker`` endpoints through which
+the web node serves its own queue.
+"""
+
+import base64
+import io
+import json
+import os
+import sqlite3
+import time
+import urllib.error
+import urllib.request
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import closing
+
+import numpy as np
+from PIL import Image
+
+from diffusionlab.config import BROKER_CONFIG
+
+
+def broker_token():
+    return os.environ.get("DIFFUSIONLAB_BROKER_TOKEN") or BROKER_CONFIG["token"]
+
+
+def encode_result(result):
+    """JSON-safe form of a job result (images as PNG, arrays as .npy, both base64)"""
+    encoded = {}
+    for name, value in result.items():
+        if isinstance(value, Image.Image):
+            buffer = io.BytesIO()
+            value.save(buffer, format="PNG")
+            value = {"png": base64.b64encode(buffer.getvalue()).decode()}
+        elif isinstance(value, np.ndarray):
+            buffer = io.BytesIO()
+            np.save(buffer, value, allow_pickle=False)
+            value = {"npy": base64.b64encode(buffer.getvalue()).decode()}
+        encoded[name] = value
+    return encoded
+
+
+def decode_result(encoded):
+    result = {}
+    for name, value in encoded.items():
+        if isinstance(value, dict) and "png" in value:
+            value = Image.open(io.BytesIO(base64.b64decode(value["png"])))
+            value.load()
+        elif isinstance(value, dict) and "npy" in value:
+            value = np.load(io.BytesIO(base64.b64decode(value["npy"])), allow_pickle=False)
+        result[name] = value
+    return result
+
+
+class Broker(ABC):
+    """What inference nodes need from a broker"""
+
+    @abstractmethod
+    def heartbeat(self, node, capacity, busy, info=None):
+        """Report a node as alive, with how many jobs it can run at once and is running"""
+
+    @abstractmethod
+    def claim(self, node):
+        """Take the oldest queued job (``{"id", "kind", "params"}``), or None if there is none"""
+
+    @abstractmethod
+    def complete(self, job_id, node, result):
+        """Store the result (see ``encode_result``) of a job the node claimed"""
+
+    @abstractmethod
+    def fail(self, job_id, node, error):
+        """Give a claimed job back after an error; it is retried up to ``max_attempts`` times"""
+
+
+class SQLiteBroker(Broker):
+    """Job queue in a SQLite file, usable from any thread or process on the host"""
+
+    def __init__(self, path, node_timeout=None, max_attempts=None):
+        self.path = path
+        self.node_timeout = node_timeout or BROKER_CONFIG["node_timeout"]
+        self.max_attempts = max_attempts or BROKER_CONFIG["max_attempts"]
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, params TEXT, origin TEXT, '
+                       'state TEXT, node TEXT, attempts INTEGER, result TEXT, error TEXT, '
+                       'created REAL, claimed REAL, finished REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)')
+            db.execute('CREATE TABLE IF NOT EXISTS nodes '
+                       '(name TEXT PRIMARY KEY, capacity INTEGER, busy INTEGER, info TEXT, seen REAL)')
+
+    def _connect(self):
+        # One short-lived connection per call, like BlobStore
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def submit(self, kind, params, origin):
+        """Queue a job and return its id"""
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as db:
+            db.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, 'queued', NULL, 0, NULL, NULL, ?, NULL, NULL)",
+                       (job_id, kind, json.dumps(params), origin, time.time()))
+        return job_id
+
+    def _requeue_lost(self, db, now):
+        """Queue the running jobs of nodes that stopped sending heartbeats again (or fail them)"""
+        lost = 'SELECT name FROM nodes WHERE seen < ?'
+        cutoff = now - self.node_timeout
+        db.execute("UPDATE jobs SET state = 'failed', error = 'node lost', finished = ? "
+                   f"WHERE state = 'running' AND attempts >= ? AND node IN ({lost})", (now, self.max_attempts, cutoff))
+        db.execute("UPDATE jobs SET state = 'queued', node = NULL "
+                   f"WHERE state = 'running' AND node IN ({lost})", (cutoff,))
+
+    def claim(self, node, origin=None):
+        """Take the oldest queued job, only among those submitted by ``origin`` if given.
+
+        A node that sent heartbeats is not given more running jobs than the
+        capacity it reported.
+        """
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                self._requeue_lost(db, now)
+                full = db.execute("SELECT capacity <= (SELECT COUNT(*) FROM jobs WHERE state = 'running' "
+                                  "AND node = ?) FROM nodes WHERE name = ?", (node, node)).fetchone()
+                if full and full[0]:
+                    db.execute('COMMIT')
+                    return None
+                query = "SELECT id, kind, params FROM jobs WHERE state = 'queued'"
+                args = ()
+                if origin is not None:
+                    query += ' AND origin = ?'
+                    args = (origin,)
+                row = db.execute(query + ' ORDER BY created LIMIT 1', args).fetchone()
+                if row is not None:
+                    db.execute("UPDATE jobs SET state = 'running', node = ?, claimed = ?, attempts = attempts + 1 "
+                               "WHERE id = ?", (node, now, row[0]))
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return {"id": row[0], "kind": row[1], "params": json.loads(row[2])}
+
+    def complete(self, job_id, node, result):
+        with closing(self._connect()) as db:
+            cursor = db.execute("UPDATE jobs SET state = 'done', result = ?, finished = ? "
+                                "WHERE id = ? AND node = ? AND state = 'running'",
+                                (json.dumps(result), time.time(), job_id, node))
+        return cursor.rowcount == 1  # False if the job was requeued or collected meanwhile
+
+    def fail(self, job_id, node, error):
+        with closing(self._connect()) as db:
+            cursor = db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                                "node = NULL, error = ?, finished = ? WHERE id = ? AND node = ? AND state = 'running'",
+                                (self.max_attempts, str(error), time.time(), job_id, node))
+        return cursor.rowcount == 1
+
+    def results(self, job_ids):
+        """Finished jobs among ``job_ids``: ``{id: {"state", "node", "result" or "error"}}``"""
+        if not job_ids:
+            return {}
+        marks = ','.join('?' * len(job_ids))
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT id, state, node, result, error FROM jobs "
+                              f"WHERE state IN ('done', 'failed') AND id IN ({marks})", list(job_ids)).fetchall()
+        return {job_id: {"state": state, "node": node, "result": json.loads(result) if result else None, "error": error}
+                for job_id, state, node, result, error in rows}
+
+    def forget(self, job_ids):
+        """Drop jobs once their results are collected (or no longer wanted, which cancels queued ones)"""
+        if not job_ids:
+            return
+        marks = ','.join('?' * len(job_ids))
+        with closing(self._connect()) as db:
+            db.execute(f'DELETE FROM jobs WHERE id IN ({marks})', list(job_ids))
+
+    def heartbeat(self, node, capacity, busy, info=None):
+        with closing(self._connect()) as db:
+            db.execute('INSERT INTO nodes VALUES (?, ?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET '
+                       'capacity = excluded.capacity, busy = excluded.busy, info = excluded.info, seen = excluded.seen',
+                       (node, int(capacity), int(busy), json.dumps(info or {}), time.time()))
+
+    def nodes(self):
+        """Nodes that sent a heartbeat within ``node_timeout``"""
+        with closing(self._connect()) as db:
+            rows = db.execute('SELECT name, capacity, busy, info, seen FROM nodes WHERE seen >= ? ORDER BY name',
+                              (time.time() - self.node_timeout,)).fetchall()
+        return [{"name": name, "capacity": capacity, "busy": busy, "info": json.loads(info), "seen": round(seen, 3)}
+                for name, capacity, busy, info, seen in rows]
+
+    def stats(self):
+        """Job counts by state, for /health"""
+        with closing(self._connect()) as db:
+            return dict(db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+
+class HTTPBroker(Broker):
+    """Broker client for nodes on other hosts, calling a web node's ``/broker`` endpoints"""
+
+    def __init__(self, url, token=None, timeout=30):
+        self.url = url.rstrip('/')
+        self.token = token or broker_token()
+        self.timeout = timeout
+
+    def _post(self, path, payload):
+        request = urllib.request.Request(self.url + path, data=json.dumps(payload).encode(), method='POST',
+                                         headers={'Content-Type': 'application/json',
+                                                  'Authorization': f'Bearer {self.token or ""}'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"Broker {self.url}{path} returned {e.code}: {e.read()[:200]!r}") from e
+        return json.loads(body) if body else None
+
+    def heartbeat(self, node, capacity, busy, info=None):
+        self._post('/broker/heartbeat', {'node': node, 'capacity': capacity, 'busy': busy, 'info': info or {}})
+
+    def claim(self, node):
+        return self._post('/broker/claim', {'node': node}).get('job')
+
+    def complete(self, job_id, node, result):
+        return self._post(f'/broker/jobs/{job_id}/complete', {'node': node, 'result': result})['accepted']
+
+    def fail(self, job_id, node, error):
+        return self._post(f'/broker/jobs/{job_id}/fail', {'node': node, 'error': str(error)})['accepted']
+
+
+def connect(spec):
+    """Broker for a node's ``--broker`` argument: a web node URL, or the path of a SQLite queue"""
+    if spec.startswith(('http://', 'https://')):
+        return HTTPBroker(spec)
+    return SQLiteBroker(spec)
+
+
+_local = None
+
+
+def local_broker():
+    """The web node's own queue (None unless ``BROKER_CONFIG["enabled"]``)"""
+    global _local
+    if not BROKER_CONFIG["enabled"]:
+        return None
+    if _local is None:
+        _local = SQLiteBroker(BROKER_CONFIG["path"])
+    return _local
@@ -0,0 +1,154 @@
+"""
+Layout compositor for storyboards, batch results and prompt chains
+"""
+
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from diffusionlab.config import COMPOSITOR_CONFIG
+
+FONT_PATHS = [
+    "/System/Library/Fonts/Arial.ttf",  # macOS
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",  # Linux
+    "C:/Windows/Fonts/arial.ttf",  # Windows
+    "/System/Library/Fonts/Helvetica.ttc",  # macOS alternative
+]
+
+LAYOUTS = ("horizontal", "vertical", "grid")
+
+
+@lru_cache(maxsize=None)
+def get_font(size=None):
+    """Load a font once per size and reuse it for every layout"""
+    size = size or COMPOSITOR_CONFIG["font_size"]
+    for font_path in FONT_PATHS:
+        if os.path.exists(font_path):
+            try:
+                return ImageFont.truetype(font_path, size)
+            except OSError:
+                continue
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=256)
+def compute_geometry(layout, num_panels, panel_width, panel_height, columns=None):
+    """Compute canvas size and panel/caption boxes for a layout.
+
+    Returns a dict with ``canvas_size`` and per-panel ``panels`` and
+    ``captions`` boxes as ``(x0, y0, x1, y1)`` tuples. Results are cached,
+    so repeated layouts of the same shape cost nothing to plan.
+    """
+    caption_height = COMPOSITOR_CONFIG["caption_height"]
+    spacing = COMPOSITOR_CONFIG["spacing"]
+    side_caption_width = COMPOSITOR_CONFIG["side_caption_width"]
+
+    if layout == "vertical":
+        cols = 1
+    elif layout == "grid":
+        cols = columns or COMPOSITOR_CONFIG["grid_columns"]
+    else:
+        cols = columns or num_panels
+    cols = max(1, min(cols, num_panels))
+    rows = (num_panels + cols - 1) // cols
+
+    row_height = panel_height + caption_height + spacing
+    if layout == "vertical":
+        # Captions sit to the right of each panel
+        canvas_size = (panel_width + side_caption_width, row_height * rows)
+    else:
+        canvas_size = (panel_width * cols + spacing * (cols - 1), row_height * rows)
+
+    panels = []
+    captions = []
+    for i in range(num_panels):
+        row, col = divmod(i, cols)
+        x = col * (panel_width + spacing)
+        y = row * row_height
+        panels.append((x, y, x + panel_width, y + panel_height))
+        if layout == "vertical":
+            cx = panel_width + 10
+            cy = y + 10
+            captions.append((cx, cy, cx + side_caption_width - 10, cy + caption_height - 10))
+        else:
+            cy = y + panel_height + 10
+            captions.append((x, cy, x + panel_width, cy + caption_height - 10))
+
+    return {
+        "canvas_size": canvas_size,
+        "panels": tuple(panels),
+        "captions": tuple(captions),
+        "columns": cols,
+        "rows": rows,
+    }
+
+
+def _hex_to_rgb(color):
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def compose_layout(images, captions, layout="horizontal", columns=None, label="Variation"):
+    """Compose panels and captions into a single storyboard image.
+
+    Works for any panel count. Panels are copied into one preallocated RGB
+    buffer, caption boxes are filled with array slices, and only the caption
+    text goes through ``ImageDraw``.
+    """
+    if not images:
+        return None
+    if layout not in LAYOUTS:
+        layout = "horizontal"
+
+    panel_width, panel_height = images[0].size
+    geometry = compute_geometry(layout, len(images), panel_width, panel_height, columns)
+    canvas_width, canvas_height = geometry["canvas_size"]
+
+    buffer = np.full((canvas_height, canvas_width, 3), 255, dtype=np.uint8)
+    caption_fill = np.array(_hex_to_rgb(COMPOSITOR_CONFIG["caption_fill"]), dtype=np.uint8)
+    caption_outline = np.array(_hex_to_rgb(COMPOSITOR_CONFIG["caption_outline"]), dtype=np.uint8)
+
+    for image, (x0, y0, x1, y1) in zip(images, geometry["panels"]):
+        if image.size != (panel_width, panel_height):
+            image = image.resize((panel_width, panel_height), Image.Resampling.LANCZOS)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        buffer[y0:y1, x0:x1] = np.asarray(image)
+
+    for x0, y0, x1, y1 in geometry["captions"][:len(captions)]:
+        # Same box ImageDraw.rectangle would draw: inclusive corners, 1px outline
+        buffer[y0:y1 + 1, x0:x1 + 1] = caption_outline
+        buffer[y0 + 1:y1, x0 + 1:x1] = caption_fill
+
+    storyboard = Image.fromarray(buffer, mode='RGB')
+    draw = ImageDraw.Draw(storyboard)
+    font = get_font()
+    for i, (caption, (x0, y0, _, _)) in enumerate(zip(captions, geometry["captions"])):
+        draw.text((x0 + 10, y0 + 10), f"{label} {i+1}: {caption}", fill='black', font=font)
+
+    return storyboard
+
+
+def benchmark_layouts(num_panels=5, panel_size=(512, 512), repeats=10, columns=None):
+    """Time compose_layout for every layout and return milliseconds per call"""
+    images = [Image.new('RGB', panel_size, (i * 40 % 256, 90, 160)) for i in range(num_panels)]
+    captions = [f"Benchmark caption {i+1}" for i in range(num_panels)]
+    results = {}
+    for layout in LAYOUTS:
+        # Warm up the font and geometry caches so we measure steady state
+        compose_layout(images, captions, layout, columns)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            compose_layout(images, captions, layout, columns)
+        results[layout] = (time.perf_counter() - start) * 1000 / repeats
+    return results
+
+
+if __name__ == "__main__":
+    for count in (5, 8, 16):
+        timings = benchmark_layouts(num_panels=count)
+        summary = ", ".join(f"{layout}={ms:.1f}ms" for layout, ms in timings.items())
+        print(f"{count} panels: {summary}")
@@ -49,7 +49,9 @@ UI_CONFIG = {
     "server_port": 7860,
     "share": False,
     "show_error": True,
-    "theme": "soft"
+    "theme": "soft",
+    "concurrency_limit": 4,  # Storyboards generated at once; they share the pipelines panel by panel
+    "max_queue_size": 32  # Requests waiting beyond that are turned away
 }
 
 # Style Presets
@@ -119,37 +121,152 @@ SCENE_VARIATIONS = [
 LAYOUT_OPTIONS = {
     "horizontal": {
         "name": "Horizontal",
-        "description": "5 panels in a single row",
+        "description": "All panels in a single row",
         "function": "create_horizontal_layout"
     },
     "vertical": {
         "name": "Vertical",
-        "description": "5 panels in a single column",
+        "description": "All panels in a single column",
         "function": "create_vertical_layout"
     },
     "grid": {
         "name": "Grid",
-        "description": "2x3 grid layout (5 panels + 1 empty)",
+        "description": "Multi-column grid layout (2 columns by default)",
         "function": "create_grid_layout"
     }
 }
 
+# Layout Compositor Settings
+COMPOSITOR_CONFIG = {
+    "caption_height": 80,  # Height of the caption band under each panel
+    "spacing": 20,  # Gap between panels
+    "side_caption_width": 200,  # Caption column width for vertical layouts
+    "grid_columns": 2,  # Default column count for grid layouts
+    "font_size": 16,
+    "caption_fill": "#f8f9fa",
+    "caption_outline": "#dee2e6"
+}
+
 # Export Settings
 EXPORT_CONFIG = {
     "pdf_page_size": "A4",
     "pdf_margin": 50,
+    "pdf_panels_per_page": 2,  # Panels laid out on each PDF page
     "image_format": "PNG",
     "image_quality": 95,
+    "zip_workers": 4,  # Threads encoding panels for ZIP exports
     "output_directory": "output"
 }
 
+# Upload Settings
+UPLOAD_CONFIG = {
+    "target_size": (512, 512),  # Letterboxed size for img2img and ControlNet uploads
+    "max_native_side": 2048,  # Cap for uploads kept at native resolution (inpainting)
+    "store_max_items": 64,  # Decoded uploads kept in memory
+    "store_max_bytes": 512 * 1024 * 1024,
+    "persist": False  # Also keep the original uploads in static/uploads (see STORAGE_CONFIG)
+}
+
+# Storage Settings (content-addressed uploads and outputs)
+STORAGE_CONFIG = {
+    "uploads_max_bytes": 1024 * 1024 * 1024,
+    "uploads_max_age_days": 1,
+    "outputs_max_bytes": 5 * 1024 * 1024 * 1024,
+    "outputs_max_age_days": 30,
+    "cleanup_interval": 600,  # Seconds between background quota sweeps
+    "index_directory": "cache/storage"  # Blob indexes (relative to the project root), outside the served directories
+}
+
 # Performance Settings
 PERFORMANCE_CONFIG = {
-    "enable_memory_efficient_attention": True,
-    "enable_xformers_memory_efficient_attention": True,
+    "mode": "auto",  # "auto" benchmarks attention/VAE modes at startup; "manual" uses the flags below
+    "enable_memory_efficient_attention": True,  # PyTorch SDPA attention (classic attention when False)
+    "enable_xformers_memory_efficient_attention": True,  # Used on CUDA when xformers is installed
     "enable_attention_slicing": True,
-    "enable_model_cpu_offload": False,
-    "enable_sequential_cpu_offload": False
+    "enable_vae_slicing": False,
+    "enable_vae_tiling": False,
+    "enable_model_cpu_offload": False,  # CUDA only
+    "enable_sequential_cpu_offload": False,  # CUDA only
+    "memory_budget_gb": None,  # Autotune budget (None = 90% of free VRAM / 80% of available RAM)
+    "autotune_steps": 2,  # UNet steps timed per attention mode
+    "autotune_repeats": 1,
+    "autotune_cache": "cache/autotune.json"  # Remembered decisions per host, model and size
+}
+
+# Draft Decoding Settings (tiny autoencoder instead of the full SDXL VAE)
+DRAFT_CONFIG = {
+    "tiny_vae_model": "madebyollin/taesdxl",
+    "default": False,  # Decode /generate results as drafts unless the request sets "draft"
+    "batch_variations": True,  # Batch variations are drafts unless the request sets "draft"
+    "preview_every": 5  # Denoising steps between step previews
+}
+
+# Two-Stage Generation (low-res pass, latent upscale, short refinement at the target size)
+TWO_STAGE_CONFIG = {
+    "default": False,  # Used when the request does not set "twoStage"
+    "scale": 2.0,  # Target size = requested width/height x scale (512x512 -> 1024x1024)
+    "upscale_mode": "bicubic",  # Latent interpolation: nearest-exact, bilinear or bicubic
+    "refine_strength": 0.55,  # Share of the refinement schedule re-run at the target size
+    "refine_steps": 20  # Refinement schedule length (only refine_strength x refine_steps run)
+}
+
+# Profiling (admin endpoint /admin/profile)
+PROFILER_CONFIG = {
+    "admin_token": None,  # Overridden by DIFFUSIONLAB_ADMIN_TOKEN; admin endpoints are disabled without one
+    "directory": "cache/profiles",  # One subdirectory of traces and folded stacks per session
+    "max_requests": 50,  # Caps on a single session
+    "max_seconds": 3600,
+    "sampling_interval": 0.005,  # Seconds between stack samples (sampling profiler)
+    "torch_with_stack": True,  # Python stacks in torch traces (needed for its folded stacks; much larger traces)
+    "torch_record_shapes": False
+}
+
+# Memory Accounting (reported on /health and /health/memory)
+MEMORY_CONFIG = {
+    "recent_requests": 20,  # Generation requests whose RSS and peak are kept
+    "cleanup_after_request": False,  # gc.collect + malloc_trim + CUDA cache release after each generation
+    "malloc_trim": True  # Return freed heap to the OS during cleanup (glibc)
+}
+
+# Production Server (python -m diffusionlab.api.server)
+SERVER_CONFIG = {
+    "host": "0.0.0.0",
+    "port": 5001,
+    "workers": 2,  # Forked worker processes (DIFFUSIONLAB_WORKERS overrides)
+    "threads_per_worker": None,  # Torch threads per worker (None = CPU cores / workers)
+    "preload": ["sdxl", "tiny_vae"],  # Loaded in the master and shared copy-on-write; ControlNet types may be added
+    "max_requests": 500,  # Requests a worker serves before it is recycled (None = never)
+    "max_requests_jitter": 50,  # Random extra requests so workers do not recycle together
+    "max_worker_rss_mb": None,  # Recycle a worker once its RSS exceeds this after a request
+    "graceful_timeout": 120,  # Seconds a stopping worker gets to finish its requests
+    "backlog": 64
+}
+
+# Distributed Generation (job broker and inference nodes: python -m diffusionlab.node)
+BROKER_CONFIG = {
+    "enabled": False,  # Spread storyboard panels and batch variations over connected inference nodes
+    "path": "cache/broker.sqlite",  # Job queue shared by the web node's processes and nodes on the same host
+    "token": None,  # Overridden by DIFFUSIONLAB_BROKER_TOKEN; the /broker endpoints are disabled without one
+    "node_timeout": 30,  # Seconds without a heartbeat before a node's jobs are queued again
+    "heartbeat_interval": 5,
+    "poll_interval": 0.2,  # Seconds between queue checks while waiting or idle
+    "job_timeout": 900,  # Seconds a request waits for its jobs
+    "max_attempts": 2  # Runs of a job (after errors or lost nodes) before the request fails
+}
+
+# Resumable Jobs (storyboard, batch and prompt chain progress survives a crash)
+JOB_CONFIG = {
+    "enabled": True,
+    "directory": "cache/jobs",  # One directory per unfinished job: parameters, seeds and finished panels
+    "max_age_hours": 24,  # Unfinished jobs older than this are discarded
+    "resume_on_start": True  # Generate the missing panels of stored jobs in the background after a restart
+}
+
+# Synthetic Backend (load-testing the web tier without models: diffusionlab/synthetic.py)
+SYNTHETIC_CONFIG = {
+    "enabled": False,  # Replace the models with timed stand-ins (or set DIFFUSIONLAB_SYNTHETIC=1 or =<profile.json>)
+    "profile": None,  # Profile written by python -m diffusionlab.synthetic --calibrate (None = built-in reference)
+    "memory_scale": 0.25  # Fraction of the profile's model and activation memory to allocate (1.0 = as measured)
 }
 
 # Image-to-Image Settings
@@ -172,14 +289,26 @@ INPAINTING_CONFIG = {
     "mask_blur": 4,  # Blur radius for mask edges
     "fill_mode": "fill",  # fill, original, latent_fill, latent_noise
     "inpaint_full_res": True,
-    "inpaint_full_res_padding": 32
+    "inpaint_full_res_padding": 32,
+    "inpaint_min_size": 256,  # Smallest working resolution for cropped inpainting
+    "mask_detection": {
+        "red_threshold": 80,  # Minimum red value for a brush pixel
+        "diff_threshold": 30,  # Minimum margin of red over green and blue
+        "alpha_threshold": 200,  # Minimum alpha (ignore transparent pixels)
+        "min_coverage": 0.1,  # Percent coverage below which relaxed thresholds are tried
+        "relaxed": {
+            "red_threshold": 60,
+            "diff_threshold": 20,
+            "alpha_threshold": 150
+        }
+    }
 }
 
 # Prompt Chaining / Story Evolution Settings
 PROMPT_CHAINING_CONFIG = {
     "max_prompts": 5,  # Maximum number of prompts in a chain
     "min_prompts": 2,  # Minimum number of prompts required
-    "evolution_strength": 0.3,  # How much each image influences the next (0.0-1.0)
+    "evolution_strength": 0.3,  # How far each frame moves from the previous one (0.0-1.0, 1.0 = independent frames)
     "style_consistency": True,  # Maintain consistent style across the chain
     "character_consistency": True,  # Maintain consistent characters across the chain
     "guidance_scale": 7.5,
@@ -242,27 +371,35 @@ STORY_EVOLUTION_TEMPLATES = [
 CONTROLNET_CONFIG = {
     "models": {
         "canny": {
-            "name": "lllyasviel/control_v11p_sd15_canny",
+            "name": "diffusers/controlnet-canny-sdxl-1.0",
             "description": "Edge detection for precise line control",
             "use_case": "Line art, architectural drawings, precise outlines"
         },
         "depth": {
-            "name": "lllyasviel/control_v11f1p_sd15_depth",
+            "name": "diffusers/controlnet-depth-sdxl-1.0",
             "description": "Depth map control for 3D-like generation",
             "use_case": "3D scenes, architectural visualization, spatial control"
         },
         "pose": {
-            "name": "lllyasviel/control_v11p_sd15_openpose",
+            "name": "thibaud/controlnet-openpose-sdxl-1.0",
             "description": "Human pose estimation and control",
             "use_case": "Character poses, figure drawing, animation"
         },
         "segmentation": {
-            "name": "lllyasviel/control_v11p_sd15_seg",
+            "name": "SargeZT/sdxl-controlnet-seg",
             "description": "Semantic segmentation for object placement",
             "use_case": "Object placement, scene composition, layout control"
         }
     },
     "default_model": "canny",
+    "max_loaded_models": 2,  # ControlNet modules kept in memory (least recently used are unloaded)
+    "preprocess_workers": 4,  # Threads computing control maps
+    "map_cache": {
+        "memory_items": 32,  # Preprocessed control maps kept in memory
+        "directory": "cache/control_maps",  # Disk tier (None to disable)
+        "max_bytes": 256 * 1024 * 1024,
+        "max_age_days": 7
+    },
     "control_strength": 1.0,
     "guidance_start": 0.0,
     "guidance_end": 1.0,
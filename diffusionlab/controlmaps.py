@@ -0,0 +1,101 @@
+"""
+Cache for preprocessed ControlNet control maps
+"""
+
+import io
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from diffusionlab.storage import BlobStore, content_key
+
+
+def image_content_key(image):
+    """Content hash of an image's pixels (used when no upload id is available)"""
+    array = np.ascontiguousarray(np.asarray(image))
+    return content_key(f"{array.shape}{array.dtype}".encode() + array.tobytes())
+
+
+def control_map_key(image_key, control_type, settings, size):
+    """Cache key for one source image, control type, preprocessor settings and output size"""
+    description = json.dumps([image_key, control_type, settings, list(size)], sort_keys=True)
+    return content_key(description.encode())
+
+
+class ControlMapCache:
+    """Two-tier cache of control maps.
+
+    The memory tier is an LRU of ``max_items`` uint8 arrays shared by every
+    request in the process. With a ``directory`` the maps are also written as
+    PNGs to a BlobStore (in the background), so they survive restarts, are
+    shared between worker processes and are cleaned up by its quotas.
+    """
+
+    def __init__(self, max_items, directory=None, max_bytes=None, max_age=None, cleanup_interval=None):
+        self.max_items = max_items
+        self.blobs = BlobStore(directory, max_bytes=max_bytes, max_age=max_age) if directory else None
+        if self.blobs and cleanup_interval:
+            self.blobs.start_cleanup(cleanup_interval)
+        # 'coalesced': requests that joined a computation already in flight (see PreprocessEngine.submit)
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0}
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='control-map-writer') if directory else None
+
+    def _remember(self, key, control_map):
+        with self._lock:
+            self._maps[key] = control_map
+            self._maps.move_to_end(key)
+            while len(self._maps) > self.max_items:
+                self._maps.popitem(last=False)
+
+    def _persist(self, key, control_map):
+        buffer = io.BytesIO()
+        Image.fromarray(control_map).save(buffer, format='PNG')
+        self.blobs.put_bytes(buffer.getvalue(), '.png', key=key)
+
+    def get(self, key):
+        """Return a cached control map (uint8 array) or None"""
+        with self._lock:
+            control_map = self._maps.get(key)
+            if control_map is not None:
+                self._maps.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return control_map
+        data = self.blobs.read_bytes(key + '.png') if self.blobs else None
+        if data is None:
+            return None
+        with Image.open(io.BytesIO(data)) as img:
+            control_map = np.asarray(img.convert('RGB'))
+        self._remember(key, control_map)
+        self.stats['disk_hits'] += 1
+        return control_map
+
+    def put(self, key, control_map):
+        control_map = np.array(control_map, dtype=np.uint8)
+        if control_map.ndim == 2:
+            control_map = np.repeat(control_map[..., None], 3, axis=2)
+        control_map.flags.writeable = False  # Shared between requests
+        self._remember(key, control_map)
+        if self._writer:
+            self._writer.submit(self._persist, key, control_map)
+        return control_map
+
+    def get_or_compute(self, key, compute):
+        """Return the cached map for ``key``, computing (and caching) it on a miss.
+
+        ``compute`` returns an array or None when no preprocessor is available;
+        None results are not cached.
+        """
+        control_map = self.get(key)
+        if control_map is not None:
+            return control_map
+        self.stats['misses'] += 1
+        control_map = compute()
+        if control_map is None:
+            return None
+        return self.put(key, control_map)
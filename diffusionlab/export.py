@@ -0,0 +1,339 @@
+"""
+Export helpers for storyboards (streaming multi-page PDF and ZIP bundles)
+"""
+
+import io
+import json
+import os
+import tempfile
+import textwrap
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+from PIL import Image
+
+from diffusionlab.config import EXPORT_CONFIG
+
+PAGE_SIZES = {
+    "A4": (595.28, 841.89),
+    "letter": (612.0, 792.0),
+}
+
+JPEG_MAGIC = b'\xff\xd8'
+FORMAT_EXTENSIONS = {"PNG": "png", "JPEG": "jpg", "WEBP": "webp"}
+CAPTION_FONT_SIZE = 10
+CAPTION_LINES = 3
+
+
+def _pdf_escape(text):
+    """Escape text for a PDF literal string using the WinAnsi subset"""
+    text = text.encode('latin-1', 'replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _encode_jpeg(image):
+    buffer = io.BytesIO()
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, format='JPEG', quality=EXPORT_CONFIG["image_quality"])
+    return buffer.getvalue(), image.size, image.mode
+
+
+def _jpeg_header(data):
+    """Read size and mode from JPEG bytes without decoding pixels"""
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size, img.mode
+
+
+def load_jpeg_stream(panel):
+    """Return ``(jpeg_bytes, (width, height), mode)`` for a panel.
+
+    JPEG inputs (raw bytes, ``.jpg`` paths or freshly opened JPEG images) are
+    passed through untouched. Other files get a ``.jpg`` sidecar the first time
+    they are exported, so later exports pass through as well. In-memory images
+    are encoded once.
+    """
+    if isinstance(panel, (bytes, bytearray)):
+        data = bytes(panel)
+        if data[:2] == JPEG_MAGIC:
+            size, mode = _jpeg_header(data)
+            if mode in ('RGB', 'L'):
+                return data, size, mode
+        with Image.open(io.BytesIO(data)) as img:
+            return _encode_jpeg(img)
+
+    if isinstance(panel, str):
+        with open(panel, 'rb') as f:
+            magic = f.read(2)
+        if magic == JPEG_MAGIC:
+            with open(panel, 'rb') as f:
+                return load_jpeg_stream(f.read())
+        sidecar = os.path.splitext(panel)[0] + '.jpg'
+        if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(panel):
+            return load_jpeg_stream(sidecar)
+        with Image.open(panel) as img:
+            encoded = _encode_jpeg(img)
+        try:
+            with open(sidecar, 'wb') as f:
+                f.write(encoded[0])
+        except OSError:
+            pass
+        return encoded
+
+    # PIL image: pass through the original file if it has not been modified
+    filename = getattr(panel, 'filename', None)
+    if getattr(panel, 'format', None) == 'JPEG' and filename and os.path.exists(filename):
+        return load_jpeg_stream(filename)
+    return _encode_jpeg(panel)
+
+
+def _page_grid(panels_per_page):
+    cols = 1 if panels_per_page <= 2 else 2
+    rows = (panels_per_page + cols - 1) // cols
+    return cols, rows
+
+
+def iter_storyboard_pdf(panels, captions, title="Storyboard", prompt=None, style=None,
+                        metadata=None, panels_per_page=None, page_size=None):
+    """Yield a multi-page storyboard PDF chunk by chunk.
+
+    ``panels`` may hold PIL images, file paths or JPEG bytes; each is embedded
+    as a DCTDecode image, and only one page's images are held in memory at a
+    time. The page tree is written last so pages can be streamed as soon as
+    they are laid out.
+    """
+    panels_per_page = max(1, panels_per_page or EXPORT_CONFIG["pdf_panels_per_page"])
+    page_width, page_height = PAGE_SIZES.get(page_size or EXPORT_CONFIG["pdf_page_size"], PAGE_SIZES["A4"])
+    margin = EXPORT_CONFIG["pdf_margin"]
+    gap = 20
+    caption_block = CAPTION_LINES * (CAPTION_FONT_SIZE + 2) + 6
+
+    offsets = {}
+    position = 0
+    next_obj = [5]  # 1 catalog, 2 pages, 3/4 fonts
+
+    def emit(obj_num, body):
+        nonlocal position
+        offsets[obj_num] = position
+        chunk = f"{obj_num} 0 obj\n".encode() + body + b"\nendobj\n"
+        position += len(chunk)
+        return chunk
+
+    def allocate():
+        num = next_obj[0]
+        next_obj[0] += 1
+        return num
+
+    def stream_object(dictionary, data):
+        return dictionary.encode() + f" /Length {len(data)} >>\nstream\n".encode() + data + b"\nendstream"
+
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    position += len(header)
+    yield header
+    yield emit(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    yield emit(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    yield emit(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+
+    cols, rows = _page_grid(panels_per_page)
+    total_pages = max(1, (len(panels) + panels_per_page - 1) // panels_per_page)
+    page_objects = []
+
+    for page_index in range(total_pages):
+        ops = []
+        top = page_height - margin
+
+        # Header: title on every page, prompt/style/metadata on the first
+        ops.append(f"BT /F2 18 Tf {margin:.2f} {top - 18:.2f} Td ({_pdf_escape(title)}) Tj ET")
+        ops.append(f"BT /F1 9 Tf {page_width - margin - 60:.2f} {top - 14:.2f} Td "
+                   f"(Page {page_index + 1} of {total_pages}) Tj ET")
+        top -= 30
+        if page_index == 0:
+            header_lines = []
+            if prompt:
+                header_lines.append(f"Prompt: {prompt}")
+            if style:
+                header_lines.append(f"Style: {style}")
+            if metadata:
+                header_lines.append(f"Generated: {metadata.get('timestamp', 'Unknown')}")
+            for line in header_lines:
+                ops.append(f"BT /F1 10 Tf {margin:.2f} {top - 10:.2f} Td ({_pdf_escape(line[:110])}) Tj ET")
+                top -= 14
+            top -= 6
+
+        cell_width = (page_width - 2 * margin - gap * (cols - 1)) / cols
+        cell_height = (top - margin - gap * (rows - 1)) / rows
+        chars_per_line = max(10, int(cell_width / (CAPTION_FONT_SIZE * 0.5)))
+
+        xobjects = []
+        start = page_index * panels_per_page
+        for slot, panel in enumerate(panels[start:start + panels_per_page]):
+            index = start + slot
+            row, col = divmod(slot, cols)
+            cell_x = margin + col * (cell_width + gap)
+            cell_top = top - row * (cell_height + gap)
+
+            data, (img_w, img_h), mode = load_jpeg_stream(panel)
+            image_obj = allocate()
+            colorspace = '/DeviceGray' if mode == 'L' else '/DeviceRGB'
+            yield emit(image_obj, stream_object(
+                f"<< /Type /XObject /Subtype /Image /Width {img_w} /Height {img_h} "
+                f"/ColorSpace {colorspace} /BitsPerComponent 8 /Filter /DCTDecode", data))
+            del data
+            name = f"Im{slot}"
+            xobjects.append(f"/{name} {image_obj} 0 R")
+
+            max_h = cell_height - caption_block
+            scale = min(cell_width / img_w, max_h / img_h)
+            draw_w, draw_h = img_w * scale, img_h * scale
+            draw_x = cell_x + (cell_width - draw_w) / 2
+            draw_y = cell_top - draw_h
+            ops.append(f"q {draw_w:.2f} 0 0 {draw_h:.2f} {draw_x:.2f} {draw_y:.2f} cm /{name} Do Q")
+
+            caption = captions[index] if index < len(captions) else ""
+            text = f"Panel {index + 1}: {caption}" if caption else f"Panel {index + 1}"
+            line_y = draw_y - CAPTION_FONT_SIZE - 4
+            for line in textwrap.wrap(text, chars_per_line)[:CAPTION_LINES]:
+                ops.append(f"BT /F1 {CAPTION_FONT_SIZE} Tf {cell_x:.2f} {line_y:.2f} Td ({_pdf_escape(line)}) Tj ET")
+                line_y -= CAPTION_FONT_SIZE + 2
+
+        content = "\n".join(ops).encode('latin-1')
+        content_obj = allocate()
+        yield emit(content_obj, stream_object("<<", content))
+
+        page_obj = allocate()
+        page_objects.append(page_obj)
+        yield emit(page_obj, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> /XObject << {' '.join(xobjects)} >> >> "
+            f"/Contents {content_obj} 0 R >>").encode())
+
+    kids = " ".join(f"{num} 0 R" for num in page_objects)
+    yield emit(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_objects)} >>".encode())
+
+    xref_offset = position
+    total_objects = next_obj[0]
+    xref = [f"xref\n0 {total_objects}\n", "0000000000 65535 f \n"]
+    for num in range(1, total_objects):
+        xref.append(f"{offsets[num]:010d} 00000 n \n")
+    xref.append(f"trailer\n<< /Size {total_objects} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+    yield "".join(xref).encode()
+
+
+def export_to_pdf(storyboard_image, prompt, style, panel_state=None):
+    """Write a storyboard PDF to a temporary file and return its path (Gradio export)"""
+    if storyboard_image is None:
+        return None
+    if panel_state and panel_state.get("images"):
+        panels = panel_state["images"]
+        captions = panel_state.get("captions", [])
+    else:
+        panels = [storyboard_image]
+        captions = []
+    metadata = {"timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    with tempfile.NamedTemporaryFile(suffix='.pdf', prefix='storyboard_', delete=False) as f:
+        for chunk in iter_storyboard_pdf(panels, captions, prompt=prompt, style=style, metadata=metadata):
+            f.write(chunk)
+        return f.name
+
+
+class _StreamSink:
+    """Write-only, unseekable file object that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def resolve_image_format(image_format=None):
+    """Normalize a requested export format, raising ValueError if unsupported"""
+    image_format = (image_format or EXPORT_CONFIG["image_format"]).upper()
+    if image_format == "JPG":
+        image_format = "JPEG"
+    if image_format not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unsupported export format: {image_format}")
+    return image_format
+
+
+def _encode_entry(name, source, image_format):
+    """Return ``(name, bytes)`` for one archive entry, reusing file bytes when possible"""
+    extension = FORMAT_EXTENSIONS[image_format]
+    if isinstance(source, str):
+        if source.lower().endswith('.' + extension) or (image_format == "JPEG" and source.lower().endswith('.jpeg')):
+            with open(source, 'rb') as f:
+                return name, f.read()
+        with Image.open(source) as img:
+            return _encode_entry(name, img.copy(), image_format)
+    buffer = io.BytesIO()
+    image = source
+    if image_format == "JPEG" and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    save_kwargs = {"quality": EXPORT_CONFIG["image_quality"]} if image_format in ("JPEG", "WEBP") else {}
+    image.save(buffer, format=image_format, **save_kwargs)
+    return name, buffer.getvalue()
+
+
+def iter_panel_zip(panels, composite=None, manifest=None, image_format=None, max_workers=None):
+    """Yield a ZIP bundle of panels, the composite and a JSON manifest chunk by chunk.
+
+    Panels (PIL images or file paths) are encoded across a thread pool and each
+    entry is written to the stream as soon as its encode finishes. At most
+    ``2 * max_workers`` encoded entries are in flight, so memory stays bounded
+    no matter how many panels the bundle holds.
+    """
+    image_format = resolve_image_format(image_format)
+    extension = FORMAT_EXTENSIONS[image_format]
+    max_workers = max_workers or EXPORT_CONFIG["zip_workers"]
+
+    entries = [(f"panels/panel_{i+1:02d}.{extension}", panel) for i, panel in enumerate(panels)]
+    if composite is not None:
+        entries.append((f"composite.{extension}", composite))
+
+    manifest = dict(manifest or {})
+    manifest["files"] = {
+        "panels": [name for name, _ in entries[:len(panels)]],
+        "composite": f"composite.{extension}" if composite is not None else None,
+    }
+
+    sink = _StreamSink()
+    archive = zipfile.ZipFile(sink, mode='w')
+    archive.writestr("manifest.json", json.dumps(manifest, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+    yield sink.drain()
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending = set()
+        queued = iter(entries)
+
+        def refill():
+            for name, source in queued:
+                pending.add(pool.submit(_encode_entry, name, source, image_format))
+                if len(pending) >= max_workers * 2:
+                    break
+
+        refill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                name, data = future.result()
+                # Images are already compressed, so store them as-is
+                archive.writestr(name, data, compress_type=zipfile.ZIP_STORED)
+                del data
+                yield sink.drain()
+            refill()
+        archive.close()
+        yield sink.drain()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,182 @@
+"""
+Durable progress of multi-panel generations (storyboards, batches and prompt chains)
+
+A job is keyed by its request, so repeating a request after a crash finds the
+job again. Its parameters, seeds and every finished panel (image, caption,
+draft latents and, for prompt chains, the latents the next frame evolves
+from) are written to disk as soon as they exist, so only the missing panels
+are generated again; after a restart the web app generates them without
+waiting for the client to retry (``JOB_CONFIG["resume_on_start"]``).
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+from diffusionlab.config import JOB_CONFIG
+
+try:
+    import fcntl
+except ImportError:  # Windows: jobs are only locked within the process
+    fcntl = None
+
+
+def _write(path, data):
+    """Write a file so that it is either complete or absent after a crash"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _npy(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def job_key(kind, request):
+    """Job id for a request: the same parameters always map to the same job"""
+    data = json.dumps({'kind': kind, 'request': request}, sort_keys=True, default=str)
+    return f"{kind}-{hashlib.blake2b(data.encode(), digest_size=12).hexdigest()}"
+
+
+class Job:
+    """One job's directory: ``job.json``, then ``panel-<i>.png/.json`` (and ``.npy``) per finished panel"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.id = os.path.basename(directory)
+        self.state = {}
+        path = os.path.join(directory, 'job.json')
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    @property
+    def started(self):
+        return 'panels' in self.state
+
+    @property
+    def panels(self):
+        return self.state.get('panels')
+
+    def start(self, kind, request, panels, **extra):
+        """Record what the job generates: one parameter dict per panel, plus anything needed to resume"""
+        self.state = dict(extra, kind=kind, request=request, panels=panels, created=time.time())
+        os.makedirs(self.directory, exist_ok=True)  # Gone if a concurrent identical request finished it meanwhile
+        _write(os.path.join(self.directory, 'job.json'), json.dumps(self.state).encode())
+
+    def _path(self, index, suffix):
+        return os.path.join(self.directory, f"panel-{index}{suffix}")
+
+    def save_panel(self, index, result, chain_latents=None):
+        """Persist a finished panel (``{"image", "latents", "caption"}``); its .json is written last"""
+        buffer = io.BytesIO()
+        result['image'].save(buffer, format='PNG')
+        _write(self._path(index, '.png'), buffer.getvalue())
+        if result.get('latents') is not None:
+            _write(self._path(index, '.npy'), _npy(result['latents']))
+        if chain_latents is not None:
+            _write(self._path(index, '.chain.npy'), _npy(chain_latents))
+        _write(self._path(index, '.json'), json.dumps({'caption': result.get('caption')}).encode())
+
+    def finished(self):
+        """Indexes of the panels saved so far"""
+        return [index for index in range(len(self.panels or ())) if os.path.exists(self._path(index, '.json'))]
+
+    def finished_panels(self):
+        """``{index: result}`` for every panel saved so far"""
+        results = {}
+        for index in self.finished():
+            with open(self._path(index, '.json')) as f:
+                meta = json.load(f)
+            image = Image.open(self._path(index, '.png'))
+            image.load()
+            latents = np.load(self._path(index, '.npy')) if os.path.exists(self._path(index, '.npy')) else None
+            results[index] = {'image': image, 'latents': latents, 'caption': meta['caption']}
+        return results
+
+    def chain_latents(self, index):
+        """Latents saved with a prompt chain frame, which the next frame evolves from"""
+        path = self._path(index, '.chain.npy')
+        return np.load(path) if os.path.exists(path) else None
+
+    def finish(self):
+        """Remove the job once its output is stored"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class JobStore:
+    def __init__(self, directory, max_age=None):
+        self.directory = directory
+        self.max_age = max_age
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, kind, request):
+        """The job for a request (new or left over from an earlier run), held exclusively while in use"""
+        return self.open_id(job_key(kind, request))
+
+    @contextmanager
+    def open_id(self, key):
+        with self._lock(key):
+            job = Job(os.path.join(self.directory, key))
+            try:
+                yield job
+            finally:
+                if not job.started:  # Failed before recording anything
+                    shutil.rmtree(job.directory, ignore_errors=True)
+
+    @contextmanager
+    def _lock(self, key):
+        # A thread lock per job within the process, and a file lock across processes (pre-fork workers)
+        with self._locks_lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            directory = os.path.join(self.directory, key)
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, '.lock'), 'w') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                yield
+
+    def unfinished(self):
+        """Ids of stored jobs, oldest first; jobs older than ``max_age`` are discarded"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name, 'job.json')
+            try:
+                created = os.path.getmtime(path)
+            except OSError:
+                continue
+            if self.max_age and time.time() - created > self.max_age:
+                print(f"[DEBUG] Discarding expired job {name}")
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                continue
+            entries.append((created, name))
+        return [name for _, name in sorted(entries)]
+
+
+_store = None
+
+
+def get_store():
+    """The configured job store (None if resumable jobs are disabled)"""
+    global _store
+    if not JOB_CONFIG["enabled"]:
+        return None
+    if _store is None:
+        _store = JobStore(JOB_CONFIG["directory"], JOB_CONFIG["max_age_hours"] * 3600)
+    return _store
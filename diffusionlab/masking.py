@@ -0,0 +1,169 @@
+"""
+Mask processing for inpainting
+"""
+
+import base64
+import binascii
+import io
+import logging
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from diffusionlab.config import INPAINTING_CONFIG
+from diffusionlab.profiling import annotate
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def _morphology_backend():
+    """Pick the fastest available morphology backend (OpenCV, then SciPy, then none)"""
+    try:
+        import cv2
+        return "cv2", cv2
+    except ImportError:
+        pass
+    try:
+        from scipy import ndimage
+        return "scipy", ndimage
+    except ImportError:
+        return None, None
+
+
+def decode_mask_image(mask_data_url):
+    """Decode a base64 (data URL) mask into an RGBA uint8 array"""
+    if mask_data_url.startswith('data:'):
+        mask_data_url = mask_data_url.split(',', 1)[1]
+    mask_bytes = base64.b64decode(mask_data_url)
+    with Image.open(io.BytesIO(mask_bytes)) as mask_image:
+        if mask_image.mode != 'RGBA':
+            mask_image = mask_image.convert('RGBA')
+        return np.asarray(mask_image)
+
+
+def classify_brush_pixels(rgba, red_threshold, diff_threshold, alpha_threshold):
+    """Return a boolean mask of red brush strokes.
+
+    A pixel is masked when red is above ``red_threshold``, exceeds both green
+    and blue by more than ``diff_threshold`` and alpha is above
+    ``alpha_threshold``. The red margin is computed in int16 so that
+    ``red - green`` cannot wrap around as it does on uint8.
+    """
+    red = rgba[..., 0]
+    margin = red.astype(np.int16) - np.maximum(rgba[..., 1], rgba[..., 2])
+    mask = margin > diff_threshold
+    mask &= red > red_threshold
+    mask &= rgba[..., 3] > alpha_threshold
+    return mask
+
+
+def clean_mask(mask):
+    """Remove isolated noise pixels and fill small holes"""
+    backend, module = _morphology_backend()
+    if backend == "cv2":
+        mask_u8 = mask.view(np.uint8)
+        mask_u8 = module.morphologyEx(mask_u8, module.MORPH_OPEN, np.ones((2, 2), np.uint8))
+        mask_u8 = module.morphologyEx(mask_u8, module.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+        return mask_u8.astype(bool)
+    if backend == "scipy":
+        mask = module.binary_opening(mask, structure=np.ones((2, 2)))
+        return module.binary_closing(mask, structure=np.ones((3, 3)))
+    return mask
+
+
+def _log_debug_stats(rgba, mask):
+    red, green, blue, alpha = (rgba[..., i] for i in range(4))
+    for name, channel in (("Red", red), ("Green", green), ("Blue", blue), ("Alpha", alpha)):
+        logger.debug("%s channel stats: min=%d, max=%d, mean=%.2f",
+                     name, channel.min(), channel.max(), channel.mean())
+    logger.debug("Mask pixels: %d out of %d, morphology backend: %s",
+                 int(np.count_nonzero(mask)), mask.size, _morphology_backend()[0])
+
+
+@annotate('process_mask_data')
+def process_mask_data(mask_data_url):
+    """Process base64 mask data and convert to PIL Image for inpainting.
+
+    Returns an ``L`` mode image (white = inpaint, black = preserve), or None
+    if the data cannot be decoded.
+    """
+    try:
+        rgba = decode_mask_image(mask_data_url)
+    except (binascii.Error, OSError, ValueError, IndexError) as e:
+        logger.warning("Error decoding mask data: %s", e)
+        return None
+
+    settings = INPAINTING_CONFIG["mask_detection"]
+    mask = classify_brush_pixels(rgba, settings["red_threshold"], settings["diff_threshold"],
+                                 settings["alpha_threshold"])
+    mask = clean_mask(mask)
+
+    coverage = np.count_nonzero(mask) * 100 / mask.size
+    if coverage < settings["min_coverage"]:
+        # Faint strokes (anti-aliased or low-opacity brushes): retry with relaxed thresholds
+        relaxed = settings["relaxed"]
+        relaxed_mask = classify_brush_pixels(rgba, relaxed["red_threshold"], relaxed["diff_threshold"],
+                                             relaxed["alpha_threshold"])
+        relaxed_coverage = np.count_nonzero(relaxed_mask) * 100 / relaxed_mask.size
+        if relaxed_coverage > coverage:
+            mask, coverage = relaxed_mask, relaxed_coverage
+            logger.debug("Using relaxed mask detection")
+
+    if logger.isEnabledFor(logging.DEBUG):
+        _log_debug_stats(rgba, mask)
+    logger.info("Mask coverage: %.2f%%", coverage)
+
+    return Image.fromarray(mask.view(np.uint8) * np.uint8(255))
+
+
+def mask_crop_box(mask, padding, aspect=1.0):
+    """Return the padded bounding box ``(x0, y0, x1, y1)`` of the masked area.
+
+    The box is grown to ``aspect`` (width / height) around the mask centre and
+    kept inside the image, so the crop can be resized to the working
+    resolution without distortion. Returns None if nothing is masked.
+    """
+    mask_array = np.asarray(mask)
+    rows = np.flatnonzero(mask_array.any(axis=1))
+    cols = np.flatnonzero(mask_array.any(axis=0))
+    if rows.size == 0:
+        return None
+    image_height, image_width = mask_array.shape[:2]
+
+    x0, x1 = cols[0] - padding, cols[-1] + 1 + padding
+    y0, y1 = rows[0] - padding, rows[-1] + 1 + padding
+    width, height = x1 - x0, y1 - y0
+    if width / height < aspect:
+        width = min(int(round(height * aspect)), image_width)
+    else:
+        height = min(int(round(width / aspect)), image_height)
+    width, height = int(min(width, image_width)), int(min(height, image_height))
+
+    center_x, center_y = (x0 + x1) / 2, (y0 + y1) / 2
+    x0 = int(min(max(round(center_x - width / 2), 0), image_width - width))
+    y0 = int(min(max(round(center_y - height / 2), 0), image_height - height))
+    return x0, y0, x0 + width, y0 + height
+
+
+def inpaint_working_size(crop_size, max_side, min_side):
+    """Pick a denoise resolution for a crop: its own size clamped to [min_side, max_side], multiple of 8"""
+    crop_width, crop_height = crop_size
+    long_side = max(crop_width, crop_height)
+    scale = min(max(long_side, min_side), max_side) / long_side
+    return (max(64, int(round(crop_width * scale / 8)) * 8),
+            max(64, int(round(crop_height * scale / 8)) * 8))
+
+
+def paste_feathered(image, patch, mask, box, blur):
+    """Blend an inpainted patch back into ``image`` at ``box`` through a feathered mask"""
+    box_size = (box[2] - box[0], box[3] - box[1])
+    if patch.size != box_size:
+        patch = patch.resize(box_size, Image.Resampling.LANCZOS)
+    alpha = mask.crop(box)
+    if blur:
+        alpha = alpha.filter(ImageFilter.GaussianBlur(blur))
+    result = image.copy()
+    result.paste(patch.convert(result.mode), box[:2], alpha)
+    return result
@@ -0,0 +1,208 @@
+"""
+Process memory accounting: model residency, per-request peaks and live objects
+"""
+
+import ctypes
+import ctypes.util
+import gc
+import os
+import sys
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+from diffusionlab.config import MEMORY_CONFIG
+
+# Most recent generation requests, oldest first (see RequestMemory)
+recent_requests = deque(maxlen=MEMORY_CONFIG["recent_requests"])
+_lock = threading.Lock()
+_lifetime_peak = 0  # Peak RSS from before the last reset of the kernel's counter
+
+
+def rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _kernel_peak():
+    """Peak RSS since the last reset (VmHWM), or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _reset_kernel_peak():
+    """Restart VmHWM from the current RSS (Linux); False where unsupported"""
+    global _lifetime_peak
+    peak = _kernel_peak()
+    if peak is None:
+        return False
+    _lifetime_peak = max(_lifetime_peak, peak)
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """Peak RSS of the process since it started"""
+    peak = _kernel_peak()
+    return None if peak is None else max(_lifetime_peak, peak)
+
+
+def module_bytes(module):
+    """Bytes held by a torch module's parameters and buffers, per device"""
+    sizes = {}
+    seen = set()
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        key = (tensor.device, tensor.data_ptr())
+        if key in seen:
+            continue
+        seen.add(key)
+        device = str(tensor.device)
+        sizes[device] = sizes.get(device, 0) + tensor.numel() * tensor.element_size()
+    return sizes
+
+
+def component_sizes(components):
+    """``{name: {device: bytes}}`` for a ``{name: module}`` mapping"""
+    return {name: module_bytes(module) for name, module in components.items()}
+
+
+def live_objects():
+    """Counts and sizes of live tensors (other than parameters) and PIL images.
+
+    Walks every object the garbage collector tracks, so it costs tens of
+    milliseconds; growth between idle snapshots points at a leak.
+    """
+    torch = sys.modules.get("torch")
+    pil_image = sys.modules.get("PIL.Image")
+    result = {"tensors": 0, "tensor_bytes": 0, "images": 0, "image_bytes": 0}
+    storages = set()
+    for obj in gc.get_objects():
+        cls = type(obj)  # Not isinstance: some module proxies warn when their __class__ is read
+        if torch is not None and issubclass(cls, torch.Tensor):
+            if issubclass(cls, torch.nn.Parameter):
+                continue
+            result["tensors"] += 1
+            try:
+                storage = obj.untyped_storage()
+            except RuntimeError:  # Tensors without storage (e.g. sparse)
+                continue
+            if (obj.device, storage.data_ptr()) not in storages:
+                storages.add((obj.device, storage.data_ptr()))
+                result["tensor_bytes"] += storage.nbytes()
+        elif pil_image is not None and issubclass(cls, pil_image.Image):
+            result["images"] += 1
+            result["image_bytes"] += obj.width * obj.height * len(obj.getbands())
+    return result
+
+
+@lru_cache(maxsize=1)
+def _libc():
+    name = ctypes.util.find_library("c")
+    try:
+        return ctypes.CDLL(name) if name else None
+    except OSError:
+        return None
+
+
+def cleanup():
+    """Collect garbage, hand freed heap back to the OS and empty the CUDA cache.
+
+    Returns RSS before and after, so the effect shows up in the request log.
+    """
+    start = time.perf_counter()
+    before = rss_bytes()
+    collected = gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    trimmed = False
+    libc = _libc()
+    if MEMORY_CONFIG["malloc_trim"] and libc is not None and hasattr(libc, "malloc_trim"):
+        trimmed = bool(libc.malloc_trim(0))  # glibc only
+    after = rss_bytes()
+    return {
+        "rss_before_bytes": before,
+        "rss_after_bytes": after,
+        "freed_bytes": before - after if before is not None and after is not None else None,
+        "collected_objects": collected,
+        "malloc_trim": trimmed,
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+
+
+class RequestMemory:
+    """Records RSS before and after a request and its peak, into ``recent_requests``.
+
+    The peak comes from the kernel's high-water mark, reset at the start of
+    the request (Linux), so it only covers requests that do not overlap; the
+    web app tracks the requests it serializes on the pipelines.
+    """
+
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        self.started = time.time()
+        self.rss_before = rss_bytes()
+        with _lock:
+            self.exact_peak = _reset_kernel_peak()
+        torch = sys.modules.get("torch")
+        self.cuda = torch is not None and torch.cuda.is_available()
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+        return self
+
+    def __exit__(self, *exc):
+        record = {
+            "endpoint": self.label,
+            "started": round(self.started, 3),
+            "seconds": round(time.time() - self.started, 3),
+            "rss_before_bytes": self.rss_before,
+            "rss_after_bytes": rss_bytes(),
+            "peak_rss_bytes": _kernel_peak() if self.exact_peak else None,
+        }
+        if self.cuda:
+            record["cuda_peak_bytes"] = sys.modules["torch"].cuda.max_memory_allocated()
+        if MEMORY_CONFIG["cleanup_after_request"]:
+            record["cleanup"] = cleanup()
+        recent_requests.append(record)
+        return False
+
+
+def report(components=None, live=False):
+    """Memory summary for /health: process RSS, model residency and recent requests"""
+    sizes = component_sizes(components or {})
+    result = {
+        "rss_bytes": rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "components": sizes,
+        "component_bytes_total": sum(sum(devices.values()) for devices in sizes.values()),
+        "recent_requests": list(recent_requests),
+        "cleanup_after_request": MEMORY_CONFIG["cleanup_after_request"],
+    }
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        result["cuda_allocated_bytes"] = torch.cuda.memory_allocated()
+        result["cuda_reserved_bytes"] = torch.cuda.memory_reserved()
+    if live:
+        result["live_objects"] = live_objects()
+    return result
@@ -0,0 +1,259 @@
+"""
+Prometheus metrics and per-request stage timing
+
+Metrics are rendered in the Prometheus text exposition format (0.0.4) by
+``render()``, so /metrics works without the prometheus_client package. Stage
+timings recorded with ``stage()`` (or by hooks on model modules) go both to
+the ``diffusionlab_stage_seconds`` histogram and to the current request, which
+the web app reports in a ``Server-Timing`` header.
+"""
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond stages (prompt building) up to full SDXL generations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+LOAD_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with optional labels.
+
+    ``collect`` (a callable returning ``[(labels_dict, value), ...]``) makes the
+    values computed at scrape time instead of tracked, e.g. for cache stats
+    that another object already counts.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self):
+        """``[(sample_name, label_text, value)]`` for the exposition"""
+        if self.collect:
+            values = {self._key(labels): value for labels, value in self.collect()}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [(self.name, self._labels(key), value) for key, value in sorted(values.items())]
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in progress while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry=registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', self._labels(key, [('le', _format_value(float(bound)))]),
+                                cumulative))
+            samples.append((self.name + '_sum', self._labels(key), total))
+            samples.append((self.name + '_count', self._labels(key), cumulative))
+        return samples
+
+
+def render(registry=REGISTRY):
+    """All metrics in the Prometheus text format"""
+    lines = []
+    for metric in registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        try:
+            samples = metric.samples()
+        except Exception as e:
+            print(f"[WARNING] Could not collect metric {metric.name}: {e}")
+            continue
+        for name, labels, value in samples:
+            lines.append(f'{name}{labels} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+STAGE_SECONDS = Histogram(
+    'diffusionlab_stage_seconds',
+    'Time spent in each generation stage (denoise_step and encoders: per forward pass)',
+    ['stage']
+)
+MODEL_LOAD_SECONDS = Histogram(
+    'diffusionlab_model_load_seconds', 'Time taken to load each model', ['model'], buckets=LOAD_BUCKETS
+)
+
+# Stage totals of the request being handled: {stage: [calls, seconds]}
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+def start_request():
+    """Begin collecting stage timings for the current request (or thread)"""
+    stages = {}
+    _request_stages.set(stages)
+    return stages
+
+
+def request_stages():
+    return _request_stages.get()
+
+
+def _add_to_request(name, seconds):
+    stages = _request_stages.get()
+    if stages is not None:
+        entry = stages.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    _add_to_request(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+@contextmanager
+def model_load(name):
+    """Time loading a model (reported to the request as the ``model_load`` stage)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        MODEL_LOAD_SECONDS.observe(seconds, model=name)
+        _add_to_request('model_load', seconds)
+
+
+def time_module(module, name):
+    """Record every forward pass of a torch module as stage ``name`` (once per module)"""
+    if module is None or getattr(module, '_stage_timer', None):
+        return
+    starts = threading.local()
+
+    def before(_module, _args):
+        starts.value = time.perf_counter()
+
+    def after(_module, _args, _output):
+        start = getattr(starts, 'value', None)
+        if start is not None:
+            starts.value = None
+            record_stage(name, time.perf_counter() - start)
+
+    module.register_forward_pre_hook(before)
+    module.register_forward_hook(after)
+    module._stage_timer = name
+
+
+def server_timing(stages, total=None):
+    """``Server-Timing`` header value: one metric per stage, in milliseconds"""
+    entries = [f'{name};dur={seconds * 1000:.1f};desc="{calls}x"' for name, (calls, seconds) in stages.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
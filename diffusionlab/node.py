@@ -0,0 +1,189 @@
+"""
+Inference node: runs generation jobs from a broker (see diffusionlab.broker)
+
+A node loads the models, sends heartbeats with its capacity and runs up to
+``--capacity`` claimed jobs at once. The pipelines are shared, as in the web
+app, so the image generation of those jobs takes turns; captioning, encoding
+and reporting one job's result overlap with the next job's denoising. Run one
+node per GPU or host. The web node that submitted the jobs also runs its own
+queued ones while it waits, so a storyboard never waits on an idle cluster.
+
+Usage:
+    python -m diffusionlab.node --broker http://web-host:5001    # Another host (DIFFUSIONLAB_BROKER_TOKEN)
+    python -m diffusionlab.node --broker cache/broker.sqlite     # Same host as the web node
+    python -m diffusionlab.node --broker cache/broker.sqlite --capacity 2
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+import uuid
+
+from diffusionlab.broker import connect, decode_result, encode_result
+from diffusionlab.config import BROKER_CONFIG
+from diffusionlab.metrics import stage
+
+def run_panel(params):
+    """Text-to-image for one panel: ``{"image", "latents", "caption"}``"""
+    from diffusionlab.tasks import storyboard
+
+    storyboard.load_models()
+    with storyboard.panel_lock:
+        image, latents = storyboard.generate_text_to_image(
+            params["prompt"],
+            draft=params["draft"],
+            two_stage=params["two_stage"],
+            negative_prompt=params["negative_prompt"],
+            num_inference_steps=params["num_inference_steps"],
+            guidance_scale=params["guidance_scale"],
+            width=params["width"],
+            height=params["height"],
+            generator=storyboard.make_generator(params["seed"])
+        )
+    caption = storyboard.generate_caption(params["prompt"]) if params.get("caption") else None
+    return {"image": image, "latents": latents, "caption": caption}
+
+
+JOB_KINDS = {"panel": run_panel}
+
+
+def run_job(job):
+    return JOB_KINDS[job["kind"]](job["params"])
+
+
+def run_distributed(broker, kind, jobs, timeout=None, on_result=None):
+    """Run jobs through ``broker`` and return their results in order.
+
+    While waiting, this process claims its own queued jobs and runs them
+    locally, so the jobs finish even when every node is busy or gone; nodes
+    that are free pick up the rest in parallel. ``on_result(index, result)``
+    is called as each job's result arrives.
+    """
+    timeout = timeout or BROKER_CONFIG["job_timeout"]
+    # Unique per call: concurrent requests (threads, or workers forked from one master) only run their own jobs
+    origin = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    ids = [broker.submit(kind, params, origin) for params in jobs]
+    results = {}
+    deadline = time.monotonic() + timeout
+
+    def finished(job_id, result):
+        if job_id not in ids:
+            return
+        results[job_id] = result
+        if on_result is not None:
+            on_result(ids.index(job_id), result)
+
+    try:
+        while len(results) < len(ids):
+            for job_id, status in broker.results([i for i in ids if i not in results]).items():
+                if status["state"] == "failed":
+                    raise RuntimeError(f"Job {job_id} failed: {status['error']}")
+                print(f"[DEBUG] Job {job_id} done on {status['node']}")
+                finished(job_id, decode_result(status["result"]))
+            if len(results) == len(ids):
+                break
+            job = broker.claim(origin, origin=origin)
+            if job is not None:
+                finished(job["id"], run_job(job))
+                broker.complete(job["id"], origin, None)  # Kept in memory; nothing to hand over
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{len(ids) - len(results)} of {len(ids)} jobs unfinished after {timeout}s")
+            with stage("broker_wait"):
+                time.sleep(BROKER_CONFIG["poll_interval"])
+    finally:
+        broker.forget(ids)  # Also cancels jobs still queued after an error
+    return [results[job_id] for job_id in ids]
+
+
+def device_info():
+    from diffusionlab.utils import get_optimal_device
+    return {"device": get_optimal_device(), "host": socket.gethostname(), "pid": os.getpid()}
+
+
+class Node:
+    """Claims and runs jobs until stopped, with heartbeats on a background thread"""
+
+    def __init__(self, broker, name, capacity=1):
+        self.broker = broker
+        self.name = name
+        self.capacity = capacity
+        self.busy = 0
+        self.busy_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def _heartbeats(self):
+        info = device_info()
+        while not self.stopped.is_set():
+            try:
+                self.broker.heartbeat(self.name, self.capacity, self.busy, info)
+            except Exception as e:
+                print(f"[WARNING] Heartbeat failed: {e}")
+            self.stopped.wait(BROKER_CONFIG["heartbeat_interval"])
+
+    def run_once(self):
+        """Claim and run one job; False if the queue was empty"""
+        job = self.broker.claim(self.name)
+        if job is None:
+            return False
+        with self.busy_lock:
+            self.busy += 1
+        start = time.perf_counter()
+        try:
+            result = encode_result(run_job(job))
+        except Exception as e:
+            print(f"[WARNING] Job {job['id']} failed: {e}")
+            self.broker.fail(job["id"], self.name, e)
+        else:
+            accepted = self.broker.complete(job["id"], self.name, result)
+            print(f"[DEBUG] Job {job['id']} ({job['kind']}) took {time.perf_counter() - start:.1f}s"
+                  + ("" if accepted else " (no longer wanted)"))
+        finally:
+            with self.busy_lock:
+                self.busy -= 1
+        return True
+
+    def _runner(self):
+        while not self.stopped.is_set():
+            try:
+                if not self.run_once():
+                    self.stopped.wait(BROKER_CONFIG["poll_interval"])
+            except Exception as e:  # Broker unreachable: keep trying
+                print(f"[WARNING] {e}")
+                self.stopped.wait(BROKER_CONFIG["heartbeat_interval"])
+
+    def run(self):
+        thread = threading.Thread(target=self._heartbeats, name="node-heartbeat", daemon=True)
+        thread.start()
+        print(f"[DEBUG] Node {self.name} waiting for jobs (capacity {self.capacity})")
+        runners = [threading.Thread(target=self._runner, name=f"node-runner-{i}", daemon=True)
+                   for i in range(1, self.capacity)]
+        for runner in runners:
+            runner.start()
+        try:
+            self._runner()
+        finally:
+            self.stopped.set()
+            for runner in runners:
+                runner.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--broker", default=BROKER_CONFIG["path"], help="Web node URL or SQLite queue path")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--capacity", type=int, default=1, help="Jobs this node runs at once")
+    args = parser.parse_args()
+
+    from diffusionlab.tasks import storyboard
+    storyboard.load_models()  # Before the first heartbeat, so the node only advertises itself once ready
+    try:
+        Node(connect(args.broker), args.name, max(1, args.capacity)).run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
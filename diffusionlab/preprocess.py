@@ -0,0 +1,192 @@
+"""
+OpenCV preprocessing engine for ControlNet control maps
+"""
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+from diffusionlab.config import CONTROLNET_CONFIG, STORAGE_CONFIG
+from diffusionlab.controlmaps import ControlMapCache, control_map_key, image_content_key
+from diffusionlab.metrics import stage
+
+# cv2 is imported inside the preprocessors, so importing the engine (e.g. from the web app) stays light
+
+# ADE20K-style colours so the map resembles what segmentation ControlNets were trained on
+SEGMENT_PALETTE = np.array([
+    [120, 120, 120], [180, 120, 120], [6, 230, 230], [80, 50, 50],
+    [4, 200, 3], [120, 120, 80], [140, 140, 140], [204, 5, 255],
+    [230, 230, 230], [4, 250, 7], [224, 5, 255], [235, 255, 7],
+], dtype=np.uint8)
+
+
+def _to_rgb(gray):
+    import cv2
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+
+
+def _detect_size(shape, detect_resolution):
+    """Working size with the short side at ``detect_resolution`` (never upscaled)"""
+    height, width = shape[:2]
+    scale = min(1.0, detect_resolution / min(height, width))
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def canny_map(image, low_threshold=100, high_threshold=200):
+    """Canny edges of an RGB uint8 array, as a 3-channel map"""
+    import cv2
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    return _to_rgb(cv2.Canny(gray, low_threshold, high_threshold))
+
+
+def depth_proxy_map(image, bg_threshold=0.1, detect_resolution=256):
+    """Cheap monocular depth stand-in (near = bright).
+
+    Blends three cues that hold for most photos and renders: lower parts of
+    the frame are closer, in-focus detailed regions are closer than soft
+    backgrounds, and brighter surfaces tend to face the camera. Values below
+    ``bg_threshold`` are treated as background.
+    """
+    import cv2
+    height, width = image.shape[:2]
+    small = cv2.resize(image, _detect_size(image.shape, detect_resolution), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY).astype(np.float32) / 255.0
+
+    detail = np.abs(cv2.Laplacian(gray, cv2.CV_32F, ksize=3))
+    blur = max(3, (min(gray.shape) // 8) | 1)
+    detail = cv2.GaussianBlur(detail, (blur, blur), 0)
+    detail /= max(float(detail.max()), 1e-6)
+    vertical = np.linspace(0.0, 1.0, gray.shape[0], dtype=np.float32)[:, None]
+
+    depth = 0.45 * vertical + 0.35 * detail + 0.2 * cv2.GaussianBlur(gray, (blur, blur), 0)
+    depth -= depth.min()
+    depth /= max(float(depth.max()), 1e-6)
+    depth[depth < bg_threshold] = 0.0
+    depth = cv2.resize(depth, (width, height), interpolation=cv2.INTER_CUBIC)
+    return _to_rgb(np.clip(depth * 255.0, 0, 255).astype(np.uint8))
+
+
+def segmentation_map(image, detect_resolution=512, segments=8, cluster_resolution=128):
+    """Colour-cluster segmentation fallback painted with a fixed palette.
+
+    Clustering runs at no more than ``cluster_resolution`` pixels on the short
+    side; the label map is scaled back up with nearest-neighbour sampling.
+    """
+    import cv2
+    height, width = image.shape[:2]
+    small = cv2.resize(image, _detect_size(image.shape, min(detect_resolution, cluster_resolution)),
+                       interpolation=cv2.INTER_AREA)
+    small = cv2.bilateralFilter(small, 7, 40, 7)
+    samples = cv2.cvtColor(small, cv2.COLOR_RGB2LAB).reshape(-1, 3).astype(np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+    cv2.setRNGSeed(0)  # Same image, same map (the result is cached)
+    _, labels, centers = cv2.kmeans(samples, segments, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+
+    # Order clusters by lightness so colours are stable between similar images
+    rank = np.argsort(np.argsort(centers[:, 0]))
+    labels = rank[labels.ravel()].reshape(small.shape[:2]).astype(np.uint8)
+    labels = cv2.medianBlur(labels, 5)
+    labels = cv2.resize(labels, (width, height), interpolation=cv2.INTER_NEAREST)
+    return SEGMENT_PALETTE[labels % len(SEGMENT_PALETTE)]
+
+
+PREPROCESSORS = {
+    "canny": canny_map,
+    "depth": depth_proxy_map,
+    "segmentation": segmentation_map,
+}
+
+
+class PreprocessEngine:
+    """Runs control map preprocessors on a thread pool.
+
+    OpenCV releases the GIL inside its kernels, so several maps (or a batch of
+    reference images) are computed in parallel while the main thread keeps
+    loading models or denoising. Results go through the control map cache,
+    and concurrent requests for the same map share one computation.
+    """
+
+    def __init__(self, max_workers, cache=None):
+        self.cache = cache
+        self.preprocessors = dict(PREPROCESSORS)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='preprocess')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def register(self, control_type, preprocessor):
+        """Add a preprocessor (e.g. a model-based detector) that returns an array or None"""
+        self.preprocessors[control_type] = preprocessor
+
+    def submit(self, image, control_type, settings=None, image_key=None):
+        """Start computing a control map; returns a Future of a uint8 array (None if unsupported)"""
+        preprocessor = self.preprocessors.get(control_type)
+        future = Future()
+        if preprocessor is None:
+            future.set_result(None)
+            return future
+
+        image = np.asarray(image)
+        if settings is None:
+            settings = CONTROLNET_CONFIG["preprocessor_settings"].get(control_type, {})
+        key = control_map_key(image_key or image_content_key(image), control_type, settings,
+                              (image.shape[1], image.shape[0]))
+        if self.cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                future.set_result(cached)
+                return future
+
+        with self._lock:
+            if key in self._pending:  # Joins the computation already running for this map
+                if self.cache:
+                    self.cache.stats['coalesced'] += 1
+                return self._pending[key]
+            if self.cache:
+                self.cache.stats['misses'] += 1
+            future = self._executor.submit(self._run, key, preprocessor, image, settings)
+            self._pending[key] = future
+        return future
+
+    def _run(self, key, preprocessor, image, settings):
+        try:
+            with stage('preprocess'):
+                control_map = preprocessor(image, **settings)
+            if control_map is None or not self.cache:
+                return control_map
+            return self.cache.put(key, control_map)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def run(self, image, control_type, settings=None, image_key=None):
+        """Compute (or fetch) one control map and wait for it"""
+        return self.submit(image, control_type, settings, image_key).result()
+
+    def map(self, images, control_type, settings=None, image_keys=None):
+        """Compute control maps for a batch of images in parallel, preserving order"""
+        image_keys = image_keys or [None] * len(images)
+        futures = [self.submit(image, control_type, settings, key) for image, key in zip(images, image_keys)]
+        return [future.result() for future in futures]
+
+
+@lru_cache(maxsize=1)
+def get_engine():
+    """Shared preprocessing engine and its control map cache"""
+    cache_config = CONTROLNET_CONFIG["map_cache"]
+    cache = ControlMapCache(
+        cache_config["memory_items"],
+        cache_config["directory"],
+        max_bytes=cache_config["max_bytes"],
+        max_age=cache_config["max_age_days"] * 24 * 60 * 60,
+        cleanup_interval=STORAGE_CONFIG["cleanup_interval"]
+    )
+    return PreprocessEngine(CONTROLNET_CONFIG["preprocess_workers"], cache)
+
+
+def prefetch_control_maps(image, image_key=None):
+    """Compute every OpenCV control map for a reference image in the background"""
+    engine = get_engine()
+    image = np.asarray(image)
+    return {control_type: engine.submit(image, control_type, image_key=image_key) for control_type in PREPROCESSORS}
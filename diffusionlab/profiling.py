@@ -0,0 +1,266 @@
+"""
+On-demand profiling of generation requests
+
+An armed session profiles the next ``requests`` generation requests (and/or
+every one starting within ``seconds``) with the PyTorch profiler or a
+sampling Python profiler. Each profiled request leaves a Chrome trace
+(``.trace.json``, for chrome://tracing or Perfetto) and folded stacks
+(``.folded``, for flamegraph.pl or speedscope; torch sessions need
+``PROFILER_CONFIG["torch_with_stack"]``) in the session's directory.
+While no session is armed, ``capture`` and ``annotate`` cost one global check.
+"""
+
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from diffusionlab.config import PROFILER_CONFIG
+
+PROFILERS = ("torch", "sampling")
+
+_session = None
+_lock = threading.Lock()
+_record_function = None  # torch.profiler.record_function while a torch capture runs
+# Exporting a torch trace takes seconds; it happens after the request, off the pipelines lock
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile-writer')
+
+
+class ProfileSession:
+    """Which requests to profile, and where their artifacts go"""
+
+    def __init__(self, profiler, directory, requests=None, seconds=None, interval=None):
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler!r} (expected one of {', '.join(PROFILERS)})")
+        if not requests and not seconds:
+            raise ValueError("Give a number of requests and/or seconds to profile")
+        self.profiler = profiler
+        # Sortable by start time; the suffix keeps sessions armed within the same second apart
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{profiler}-{uuid.uuid4().hex[:6]}"
+        self.directory = os.path.join(directory, self.id)
+        self.remaining = requests
+        self.deadline = time.time() + seconds if seconds else None
+        self.interval = interval or PROFILER_CONFIG["sampling_interval"]
+        self.captured = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def expired(self):
+        return self.remaining == 0 or (self.deadline is not None and time.time() >= self.deadline)
+
+    def claim(self, label):
+        """Reserve the next capture; returns its artifact path prefix, or None once the session is over"""
+        if self.expired():
+            return None
+        if self.remaining is not None:
+            self.remaining -= 1
+        self.captured += 1
+        return os.path.join(self.directory, f"{self.captured:03d}-{re.sub(r'[^A-Za-z0-9_-]', '_', label)}")
+
+    def status(self):
+        return {
+            "id": self.id,
+            "profiler": self.profiler,
+            "active": not self.expired(),
+            "remaining_requests": self.remaining,
+            "seconds_left": None if self.deadline is None else max(0.0, round(self.deadline - time.time(), 1)),
+            "captured": self.captured,
+            "artifacts": sorted(name for name in os.listdir(self.directory) if not name.endswith(".tmp")),
+        }
+
+
+def start(profiler, requests=None, seconds=None, interval=None):
+    """Arm a profiling session (replacing any running one) and return its status"""
+    global _session
+    requests = min(int(requests), PROFILER_CONFIG["max_requests"]) if requests else None
+    seconds = min(float(seconds), PROFILER_CONFIG["max_seconds"]) if seconds else None
+    session = ProfileSession(profiler, PROFILER_CONFIG["directory"], requests, seconds, interval)
+    with _lock:
+        _session = session
+    print(f"[DEBUG] Profiling armed: {profiler}, requests={requests}, seconds={seconds} -> {session.directory}")
+    return session.status()
+
+
+def stop():
+    """Disarm the current session; returns its final status (None if there was none)"""
+    global _session
+    with _lock:
+        session, _session = _session, None
+    return session.status() if session else None
+
+
+def status():
+    session = _session
+    return session.status() if session else None
+
+
+def capture(label):
+    """Context manager profiling one request if a session wants it (a no-op otherwise)"""
+    global _session
+    if _session is None:
+        return nullcontext()
+    with _lock:
+        session = _session
+        prefix = session.claim(label) if session else None
+        if prefix is None:
+            _session = None  # Session over: back to zero overhead
+            return nullcontext()
+    if session.profiler == "torch":
+        return _TorchCapture(prefix)
+    return _SamplingCapture(prefix, session.interval)
+
+
+def region(name):
+    """Context manager naming a region in torch profiler traces"""
+    record_function = _record_function
+    return nullcontext() if record_function is None else record_function(name)
+
+
+def annotate(name):
+    """Decorator form of ``region``"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _record_function is None:
+                return func(*args, **kwargs)
+            with region(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def sessions():
+    """Stored sessions and their artifacts, newest first"""
+    root = PROFILER_CONFIG["directory"]
+    if not os.path.isdir(root):
+        return {}
+    return {name: sorted(artifact for artifact in os.listdir(os.path.join(root, name)) if not artifact.endswith(".tmp"))
+            for name in sorted(os.listdir(root), reverse=True) if os.path.isdir(os.path.join(root, name))}
+
+
+def artifact_path(session_id, name):
+    """Path of a stored artifact, or None if the names do not point inside the artifact directory"""
+    root = os.path.abspath(PROFILER_CONFIG["directory"])
+    path = os.path.abspath(os.path.join(root, session_id, name))
+    if os.path.dirname(os.path.dirname(path)) != root or not os.path.isfile(path):
+        return None
+    return path
+
+
+class _TorchCapture:
+    """torch.profiler over one request: CPU (and CUDA) ops with Python stacks"""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __enter__(self):
+        global _record_function
+        import torch
+        from torch.profiler import ProfilerActivity, profile, record_function
+
+        self.cuda = torch.cuda.is_available()
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if self.cuda else [])
+        self.with_stack = PROFILER_CONFIG["torch_with_stack"]
+        options = {}
+        if self.with_stack:
+            try:
+                # Python stacks are only kept for export_stacks in verbose mode
+                options["experimental_config"] = torch._C._profiler._ExperimentalConfig(verbose=True)
+            except AttributeError:
+                pass
+        self.profiler = profile(activities=activities, record_shapes=PROFILER_CONFIG["torch_record_shapes"],
+                                with_stack=self.with_stack, **options)
+        self.profiler.__enter__()
+        _record_function = record_function
+        return self
+
+    def __exit__(self, *exc):
+        global _record_function
+        _record_function = None
+        self.profiler.__exit__(*exc)
+        _writer.submit(self._export)
+        return False
+
+    def _export(self):
+        try:
+            self.profiler.export_chrome_trace(self.prefix + ".trace.json.tmp")
+            os.replace(self.prefix + ".trace.json.tmp", self.prefix + ".trace.json")
+            if self.with_stack:
+                self.profiler.export_stacks(self.prefix + ".folded.tmp",
+                                            "self_cuda_time_total" if self.cuda else "self_cpu_time_total")
+                os.replace(self.prefix + ".folded.tmp", self.prefix + ".folded")
+        except Exception as e:
+            print(f"[WARNING] Could not write profile {self.prefix}: {e}")
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class _SamplingCapture:
+    """Samples the request thread's Python stack every ``interval`` seconds"""
+
+    def __init__(self, prefix, interval):
+        self.prefix = prefix
+        self.interval = interval
+        self.samples = []  # (seconds since start, stack root first)
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.samples.append((time.perf_counter() - self.start, stack[::-1]))
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        end = time.perf_counter() - self.start
+        try:
+            with open(self.prefix + ".folded", "w") as f:
+                for stack, count in Counter(";".join(stack) for _, stack in self.samples).most_common():
+                    f.write(f"{stack} {count}\n")
+            with open(self.prefix + ".trace.json", "w") as f:
+                json.dump({"traceEvents": _trace_events(self.samples, end), "displayTimeUnit": "ms"}, f)
+        except OSError as e:
+            print(f"[WARNING] Could not write profile {self.prefix}: {e}")
+        return False
+
+
+def _trace_events(samples, end):
+    """Chrome trace complete events: a frame spans the consecutive samples it appears in"""
+    events = []
+    open_frames = []  # (name, start)
+
+    def close(depth, at):
+        while len(open_frames) > depth:
+            name, start = open_frames.pop()
+            events.append({"name": name, "ph": "X", "ts": start * 1e6, "dur": (at - start) * 1e6,
+                           "pid": os.getpid(), "tid": 0})
+
+    for at, stack in samples:
+        common = 0
+        while (common < len(open_frames) and common < len(stack)
+               and open_frames[common][0] == stack[common]):
+            common += 1
+        close(common, at)
+        open_frames.extend((name, at) for name in stack[common:])
+    close(0, end)
+    return events
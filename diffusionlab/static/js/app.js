@@ -54,6 +54,16 @@ class StoryboardGenerator {
             this.downloadStoryboard();
         });
 
+        // Export PDF button
+        document.getElementById('exportPdfBtn').addEventListener('click', () => {
+            this.exportPdf();
+        });
+
+        // Export panel bundle (ZIP) button
+        document.getElementById('exportZipBtn').addEventListener('click', () => {
+            this.exportZip();
+        });
+
         // Cancel AI modal
         document.getElementById('aiCancelBtn').addEventListener('click', () => {
             this.cancelAiGeneration();
@@ -183,7 +193,7 @@ class StoryboardGenerator {
 
             if (response.ok) {
                 const data = await response.json();
-                this.controlnetImagePath = data.image_path;
+                this.controlnetImagePath = data.upload_id || data.image_path;
                 this.showControlnetPreview(file);
                 this.updateStatus('ControlNet reference image uploaded successfully', 'success');
             } else {
@@ -806,6 +816,27 @@ class StoryboardGenerator {
         }
     }
 
+    exportPdf() {
+        if (!this.currentFilename) {
+            this.updateStatus('No storyboard to export', 'error');
+            return;
+        }
+
+        // Navigate to the export URL so the browser streams the PDF straight to disk
+        window.location.href = `/export/pdf/${encodeURIComponent(this.currentFilename)}`;
+        this.updateStatus('PDF export started!', 'success');
+    }
+
+    exportZip() {
+        if (!this.currentFilename) {
+            this.updateStatus('No storyboard to export', 'error');
+            return;
+        }
+
+        window.location.href = `/export/zip/${encodeURIComponent(this.currentFilename)}`;
+        this.updateStatus('Panel export started!', 'success');
+    }
+
     showLoading() {
         const generateBtn = document.getElementById('generateBtn');
         const progressBar = document.getElementById('progressBar');
@@ -978,7 +1009,7 @@ class StoryboardGenerator {
             const data = await response.json();
 
             if (response.ok && data.success) {
-                this.uploadedImagePath = data.filepath;
+                this.uploadedImagePath = data.upload_id || data.filepath;
                 this.showImagePreview(file);
                 this.updateStatus('Image uploaded successfully!', 'success');
             } else {
@@ -1036,6 +1067,7 @@ class StoryboardGenerator {
             
             const formData = new FormData();
             formData.append('image', file);
+            formData.append('purpose', 'inpainting');
 
             const response = await fetch('/upload', {
                 method: 'POST',
@@ -1045,7 +1077,7 @@ class StoryboardGenerator {
             const data = await response.json();
 
             if (response.ok && data.success) {
-                this.inpaintingImagePath = data.filepath;
+                this.inpaintingImagePath = data.upload_id || data.filepath;
                 this.showInpaintingCanvas(file);
                 this.updateStatus('Image uploaded successfully! Draw masks on areas you want to change.', 'success');
             } else {
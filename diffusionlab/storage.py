@@ -0,0 +1,300 @@
+"""
+Content-addressed storage for uploads and generated outputs
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from diffusionlab.metrics import stage
+
+INDEX_NAME = '.index.sqlite'
+EVICTION_GRACE = 60  # Seconds a freshly written or read blob is safe from eviction
+
+
+def content_key(data):
+    """Hex digest naming a blob by its content (bytes, or a seekable binary stream read in chunks)"""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+    digest = hashlib.blake2b(digest_size=16)
+    data.seek(0)
+    for chunk in iter(lambda: data.read(1024 * 1024), b''):
+        digest.update(chunk)
+    data.seek(0)
+    return digest.hexdigest()
+
+
+def _stem(name):
+    return name.split('.', 1)[0]
+
+
+class BlobStore:
+    """Deduplicating blob directory with last-access tracking and quotas.
+
+    Blobs are named ``<content hash><suffix>``, so saving the same bytes twice
+    stores a single file and names never collide. Other files sharing a blob's
+    stem (JSON manifests, cached JPEGs) are sidecars that live and die with it.
+    ``link`` records that one blob (a composite) references others (its
+    panels); referenced blobs are only evicted once nothing links to them.
+
+    ``cleanup`` removes blobs idle for longer than ``max_age`` seconds, then the
+    least recently used ones until the directory fits in ``max_bytes``. Files
+    written before the index existed are adopted using their mtime. The index
+    lives in ``root`` unless an ``index_path`` is given (e.g. to keep it out of
+    a directory a web server exposes). Neither the directory nor the index is
+    created before the store is first used, so module-level stores cost
+    nothing to import.
+    """
+
+    def __init__(self, root, max_bytes=None, max_age=None, index_path=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._index_path = index_path or os.path.join(root, INDEX_NAME)
+        self._opened = False
+        self._open_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._cleanup_thread = None
+
+    def _open(self):
+        """Create the directory and the index on first use"""
+        if self._opened:
+            return
+        with self._open_lock:
+            if self._opened:
+                return
+            os.makedirs(self.root, exist_ok=True)
+            if self._index_path != os.path.join(self.root, INDEX_NAME):
+                os.makedirs(os.path.dirname(self._index_path) or '.', exist_ok=True)
+                self._adopt_index(os.path.join(self.root, INDEX_NAME))
+            with closing(sqlite3.connect(self._index_path, timeout=30)) as db, db:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.execute('CREATE TABLE IF NOT EXISTS blobs '
+                           '(key TEXT PRIMARY KEY, size INTEGER, created REAL, last_access REAL)')
+                db.execute('CREATE TABLE IF NOT EXISTS refs '
+                           '(parent TEXT, child TEXT, PRIMARY KEY (parent, child))')
+                db.execute('CREATE INDEX IF NOT EXISTS refs_child ON refs (child)')
+            self._opened = True
+
+    def _adopt_index(self, old_path):
+        """Move an index left in ``root`` by an earlier version to ``index_path``"""
+        if os.path.exists(old_path) and not os.path.exists(self._index_path):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(old_path + suffix):
+                    os.replace(old_path + suffix, self._index_path + suffix)
+
+    def _connect(self):
+        # One short-lived connection per call keeps the store usable from any thread or process
+        self._open()
+        return sqlite3.connect(self._index_path, timeout=30)
+
+    def path(self, key):
+        """Absolute path for a blob key (keys are plain file names)"""
+        if not key or os.path.basename(key) != key or key.startswith('.'):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.root, key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def _write(self, path, data):
+        self._open()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with stage('disk_write'):
+            with open(tmp_path, 'wb') as f:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    f.write(data)
+                else:
+                    data.seek(0)
+                    shutil.copyfileobj(data, f)
+                    data.seek(0)
+            os.replace(tmp_path, path)
+
+    def put_bytes(self, data, suffix='', key=None):
+        """Store bytes under their content hash and return the key.
+
+        ``data`` may also be a seekable binary stream, which is copied to disk
+        without being read into memory. A ``key`` derived elsewhere (e.g. a
+        cache key) can be given instead; an existing file under that key is
+        kept as is.
+        """
+        key = (key or content_key(data)) + suffix
+        path = self.path(key)
+        if not os.path.exists(path):
+            self._write(path, data)
+        size = len(data) if isinstance(data, (bytes, bytearray, memoryview)) else os.path.getsize(path)
+        now = time.time()
+        with closing(self._connect()) as db, db:
+            db.execute('INSERT INTO blobs VALUES (?, ?, ?, ?) '
+                       'ON CONFLICT(key) DO UPDATE SET last_access = excluded.last_access',
+                       (key, size, now, now))
+        # A concurrent cleanup may have removed the old copy before it was touched
+        if not os.path.exists(path):
+            self._write(path, data)
+        return key
+
+    def put_image(self, image, format='PNG'):
+        """Encode and store an image; returns ``(key, encoded_bytes)``"""
+        buffer = io.BytesIO()
+        with stage('image_encode'):
+            image.save(buffer, format=format)
+        data = buffer.getvalue()
+        return self.put_bytes(data, '.' + format.lower()), data
+
+    def read_bytes(self, key):
+        """Return a blob's bytes (and mark it as used), or None if it is missing"""
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.touch(key)
+        return data
+
+    def touch(self, *keys):
+        """Record an access so the blobs count as recently used"""
+        now = time.time()
+        rows = []
+        for key in keys:
+            try:
+                rows.append((key, os.path.getsize(self.path(key)), now, now))
+            except OSError:
+                continue
+        if rows:
+            with closing(self._connect()) as db, db:
+                db.executemany('INSERT INTO blobs VALUES (?, ?, ?, ?) '
+                               'ON CONFLICT(key) DO UPDATE SET last_access = excluded.last_access', rows)
+
+    def link(self, parent, children):
+        """Keep ``children`` alive for as long as ``parent`` is stored"""
+        with closing(self._connect()) as db, db:
+            db.executemany('INSERT OR IGNORE INTO refs VALUES (?, ?)',
+                           [(parent, child) for child in children if child != parent])
+
+    def sidecar_path(self, key, extension):
+        """Path of a sidecar file (e.g. ``.json``) that is removed together with ``key``"""
+        return os.path.join(self.root, _stem(os.path.basename(self.path(key))) + extension)
+
+    def save_sidecar(self, key, extension, data):
+        """Write a sidecar file for a blob and return its name"""
+        path = self.sidecar_path(key, extension)
+        self._write(path, data)
+        return os.path.basename(path)
+
+    def read_sidecar(self, key, extension):
+        """Bytes of a blob's sidecar, or None if it has none"""
+        try:
+            with open(self.sidecar_path(key, extension), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save_json(self, key, obj):
+        """Write a JSON sidecar for a blob"""
+        self.save_sidecar(key, '.json', json.dumps(obj, indent=2).encode())
+        return self.sidecar_path(key, '.json')
+
+    def load_json(self, key):
+        """Load a blob's JSON sidecar, or None if it has none"""
+        data = self.read_sidecar(key, '.json')
+        return None if data is None else json.loads(data)
+
+    def _scan(self):
+        """Group the files on disk by stem: ``{stem: {name: (size, mtime)}}``"""
+        self._open()
+        groups = {}
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                groups.setdefault(_stem(entry.name), {})[entry.name] = (stat.st_size, stat.st_mtime)
+        return groups
+
+    def _remove(self, db, key, names):
+        db.execute('DELETE FROM blobs WHERE key = ?', (key,))
+        db.execute('DELETE FROM refs WHERE parent = ?', (key,))
+        for name in set(names) | {key}:
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+
+    def cleanup(self, now=None):
+        """Enforce the age and size quotas; returns ``(blobs_removed, bytes_on_disk)``"""
+        now = now or time.time()
+        groups = self._scan()
+        group_bytes = {stem: sum(size for size, _ in files.values()) for stem, files in groups.items()}
+        total = sum(group_bytes.values())
+        removed = 0
+
+        with closing(self._connect()) as db, db:
+            indexed = {key for key, in db.execute('SELECT key FROM blobs')}
+            vanished = [(key,) for key in indexed if key not in groups.get(_stem(key), {})]
+            db.executemany('DELETE FROM blobs WHERE key = ?', vanished)
+            db.executemany('DELETE FROM refs WHERE parent = ? OR child = ?', [(k, k) for k, in vanished])
+
+            # Adopt files that predate the index; JSON/JPEG files sharing a stem are sidecars
+            indexed_stems = {_stem(key) for key in indexed if key in groups.get(_stem(key), {})}
+            for stem, files in groups.items():
+                if stem in indexed_stems:
+                    continue
+                names = [name for name in files if not name.endswith('.tmp')]
+                if not names:
+                    continue
+                primary = min(names, key=lambda name: (name.endswith(('.json', '.jpg')), name))
+                size, mtime = files[primary]
+                db.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)', (primary, size, mtime, mtime))
+
+            while True:
+                row = db.execute('SELECT key, last_access FROM blobs '
+                                 'WHERE key NOT IN (SELECT child FROM refs) '
+                                 'ORDER BY last_access LIMIT 1').fetchone()
+                if row is None:
+                    break
+                key, last_access = row
+                idle = now - last_access
+                expired = self.max_age is not None and idle > self.max_age
+                over_quota = self.max_bytes is not None and total > self.max_bytes
+                if idle < EVICTION_GRACE or not (expired or over_quota):
+                    break
+                self._remove(db, key, groups.pop(_stem(key), {}))
+                total -= group_bytes.pop(_stem(key), 0)
+                removed += 1
+
+        if removed:
+            print(f"[DEBUG] Storage cleanup in {self.root}: removed {removed} blobs, {total / 1e6:.1f}MB left")
+        return removed, total
+
+    def usage(self):
+        """Blob count and indexed bytes"""
+        with closing(self._connect()) as db:
+            count, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        return {'blobs': count, 'bytes': size}
+
+    def start_cleanup(self, interval):
+        """Run ``cleanup`` now and then every ``interval`` seconds on a daemon thread"""
+        if self._cleanup_thread is not None:
+            return self._cleanup_thread
+
+        def loop():
+            while True:
+                try:
+                    self.cleanup()
+                except Exception as e:
+                    print(f"[ERROR] Storage cleanup failed for {self.root}: {e}")
+                if self._stop.wait(interval):
+                    break
+
+        self._cleanup_thread = threading.Thread(target=loop, name='storage-cleanup', daemon=True)
+        self._cleanup_thread.start()
+        return self._cleanup_thread
+
+    def stop_cleanup(self):
+        self._stop.set()
@@ -0,0 +1,422 @@
+"""
+Synthetic inference backend for load-testing the web tier without models
+
+``install(storyboard)`` replaces the storyboard module's pipelines, autoencoders
+and caption model with stand-ins that have the same interfaces (like
+benchmarks/tiny_models.py) but do no real work. Each stage takes as long as a
+profile measured on real hardware says, scaled with the image size; the
+stand-in modules hold the profile's model bytes (so /health, RSS limits and
+copy-on-write sharing behave as with real weights) and every call holds its
+activation bytes while it runs. Concurrent calls share the simulated device:
+with ``concurrency`` 1, two overlapping generations each run at half speed, also
+across pre-fork workers when installed before forking. Images have the
+requested size and are smooth, so they encode like real images.
+
+Enable it with ``SYNTHETIC_CONFIG["enabled"]`` or ``DIFFUSIONLAB_SYNTHETIC=1``
+(or ``=<profile.json>``); ``load_models`` then installs it instead of loading
+the models. Record a profile on the target hardware with the real models:
+
+    python -m diffusionlab.synthetic --calibrate profile.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from PIL import Image
+
+from diffusionlab.config import IMAGE_CONFIG, SYNTHETIC_CONFIG, TEXT_CONFIG
+from diffusionlab.metrics import stage
+
+# Reference figures for SDXL base in float16 on one 24 GB data-center GPU, with
+# classifier-free guidance; calibrate to replace them with measured ones
+REFERENCE_PROFILE = {
+    "hardware": "reference (SDXL fp16, single 24 GB GPU)",
+    "reference_pixels": 1024 * 1024,  # Image size the per-call figures below were measured at
+    "resolution_exponent": 1.1,  # Time grows with pixels ** exponent (attention is superlinear)
+    "text_encode_seconds": 0.03,  # Both text encoders, once per pipeline call
+    "step_seconds": 0.28,  # One UNet step (both guidance branches)
+    "controlnet_step_seconds": 0.12,  # Extra per step while a ControlNet is applied
+    "vae_decode_seconds": 0.3,
+    "vae_encode_seconds": 0.15,
+    "draft_decode_seconds": 0.01,  # Tiny autoencoder
+    "caption_token_seconds": 0.006,  # Caption model, per generated token
+    "concurrency": 1,  # Calls that run at full speed at once; more share the device
+    "component_bytes": {
+        "unet": 5_135_000_000,
+        "vae": 167_000_000,
+        "text_encoder": 246_000_000,
+        "text_encoder_2": 1_390_000_000,
+        "tiny_vae": 4_900_000,
+        "caption_model": 250_000_000,
+        "controlnet": 2_500_000_000,  # Each ControlNet type, allocated on first use
+    },
+    "activation_bytes": 3_000_000_000,  # Held during a call at reference_pixels
+}
+
+SLICE = 0.01  # Seconds between checks of how many calls share the device
+CAPTION = "A synthetic panel showing"
+
+
+def load_profile(path=None):
+    """The profile at ``path`` (or the configured one), with reference values for anything missing"""
+    path = path or SYNTHETIC_CONFIG["profile"]
+    profile = dict(REFERENCE_PROFILE)
+    if path:
+        with open(path) as f:
+            profile.update(json.load(f))
+    return profile
+
+
+class Device:
+    """Simulated accelerator shared by every call (and every process forked after it was created)"""
+
+    def __init__(self, concurrency):
+        self.concurrency = max(1, concurrency)
+        self.active = multiprocessing.Value("i", 0)
+
+    def run(self, seconds):
+        """Take ``seconds`` of exclusive device time, stretched while more than ``concurrency`` calls run"""
+        with self.active.get_lock():
+            self.active.value += 1
+        try:
+            remaining = seconds
+            last = time.perf_counter()
+            while remaining > 0:
+                share = min(1.0, self.concurrency / max(1, self.active.value))
+                time.sleep(min(remaining / share, SLICE))
+                now = time.perf_counter()
+                remaining -= (now - last) * share
+                last = now
+        finally:
+            with self.active.get_lock():
+                self.active.value -= 1
+
+
+class Module(torch.nn.Module):
+    """Stands in for a model: holds its bytes (allocated on first use if ``lazy``) and reports a float32 dtype"""
+
+    def __init__(self, size, lazy=False):
+        super().__init__()
+        self.size = int(size)
+        self.register_buffer("weights", torch.empty(0, dtype=torch.uint8))
+        self.config = SimpleNamespace(scaling_factor=1.0, force_upcast=False)
+        if not lazy:
+            self.materialize()
+
+    def materialize(self):
+        if self.weights.numel() < self.size:
+            self.weights = torch.ones(self.size, dtype=torch.uint8)  # Written, so the pages are resident
+
+    @property
+    def dtype(self):
+        return torch.float32
+
+    @property
+    def device(self):
+        return torch.device("cpu")
+
+
+class Autoencoder(Module):
+    """Latents are the image at 1/8 size (first three channels, before a tanh); ``decode`` upsamples them"""
+
+    def __init__(self, backend, size, stage_name, seconds, scaling_factor=1.0):
+        super().__init__(size)
+        self.backend = backend
+        self.stage_name = stage_name
+        self.seconds = seconds
+        self.config.scaling_factor = scaling_factor
+
+    def encode_image(self, image, width, height):
+        pixels = np.asarray(image.convert("RGB").resize((width // 8, height // 8)), dtype=np.float32) / 127.5 - 1
+        latents = torch.zeros((1, 4, height // 8, width // 8))
+        latents[0, :3] = torch.atanh(torch.from_numpy(pixels).permute(2, 0, 1) * 0.95)
+        return latents
+
+    def decode(self, latents):
+        height, width = latents.shape[-2] * 8, latents.shape[-1] * 8
+        with stage(self.stage_name):
+            self.backend.device.run(self.seconds * self.backend.scale(width, height))
+            latents = latents[:, :3].float() * self.config.scaling_factor
+            sample = torch.nn.functional.interpolate(latents, size=(height, width), mode="bilinear")
+        return SimpleNamespace(sample=torch.tanh(sample))
+
+
+class ImageProcessor:
+    def postprocess(self, image, output_type="pil"):
+        array = ((image.float().clamp(-1, 1) + 1) * 127.5).round().to(torch.uint8).permute(0, 2, 3, 1).numpy()
+        return [Image.fromarray(frame) for frame in array]
+
+
+class Pipeline:
+    """SDXL pipeline stand-in (``kind``: text, img2img, inpaint or controlnet), called like the diffusers one"""
+
+    vae_scale_factor = 8
+    watermark = None
+    device = torch.device("cpu")
+    dtype = torch.float32
+
+    def __init__(self, backend, kind, controlnet=None):
+        self.backend = backend
+        self.kind = kind
+        self.unet = backend.unet
+        self.vae = backend.vae
+        self.text_encoder = backend.text_encoder
+        self.text_encoder_2 = backend.text_encoder_2
+        self.controlnet = controlnet
+        self.image_processor = ImageProcessor()
+        self.components = {"unet": self.unet, "vae": self.vae, "text_encoder": self.text_encoder,
+                           "text_encoder_2": self.text_encoder_2}
+
+    def to(self, *args, **kwargs):
+        return self
+
+    def _initial_latents(self, width, height, generator):
+        # Noise at 1/8 of the latent grid, upsampled: decoded images are smooth, like real ones
+        coarse = torch.randn((1, 4, max(1, height // 64), max(1, width // 64)), generator=generator,
+                             device=generator.device if generator is not None else "cpu").cpu()
+        return torch.nn.functional.interpolate(coarse, size=(height // 8, width // 8), mode="bilinear")
+
+    def __call__(self, prompt=None, image=None, mask_image=None, num_inference_steps=50, strength=None,
+                 width=None, height=None, guidance_scale=5.0, generator=None, output_type="pil",
+                 callback_on_step_end=None, control_guidance_start=0.0, control_guidance_end=1.0, **kwargs):
+        backend = self.backend
+        latents = None
+        source = image if self.kind in ("img2img", "inpaint") else None  # A ControlNet image only conditions the steps
+        if self.kind == "controlnet" and image is None:
+            raise ValueError("ControlNet pipelines need a control image")
+        if source is not None:
+            if isinstance(image, torch.Tensor):  # Latents (prompt chains, two-stage refinement)
+                latents = image.float()
+                height, width = latents.shape[-2] * 8, latents.shape[-1] * 8
+            else:
+                width, height = (width or image.size[0]) // 8 * 8, (height or image.size[1]) // 8 * 8
+        width = width or IMAGE_CONFIG["width"]
+        height = height or IMAGE_CONFIG["height"]
+        steps = num_inference_steps
+        if self.kind in ("img2img", "inpaint"):
+            strength = 0.3 if strength is None and self.kind == "img2img" else strength or 0.9999
+            steps = max(1, min(int(num_inference_steps * strength), num_inference_steps))
+        scale = backend.scale(width, height)
+        step_seconds = backend.profile["step_seconds"] * scale * (1.0 if guidance_scale > 1 else 0.5)
+        if self.controlnet is not None:
+            self.controlnet.materialize()
+            guided = max(0.0, control_guidance_end - control_guidance_start)
+            step_seconds += backend.profile["controlnet_step_seconds"] * scale * guided
+
+        activations = backend.activations(width, height)
+        try:
+            with stage("text_encode"):
+                backend.device.run(backend.profile["text_encode_seconds"])
+            if latents is None:
+                latents = self._initial_latents(width, height, generator)
+                if source is not None:
+                    with stage("vae_encode"):
+                        backend.device.run(backend.profile["vae_encode_seconds"] * scale)
+                    latents = (1 - strength) * self.vae.encode_image(source, width, height) + strength * latents
+            for step in range(steps):
+                with stage("denoise_step"):
+                    backend.device.run(step_seconds)
+                if callback_on_step_end is not None:
+                    result = callback_on_step_end(self, step, steps - step, {"latents": latents})
+                    latents = (result or {}).get("latents", latents)
+        finally:
+            del activations
+        if output_type == "latent":
+            return SimpleNamespace(images=latents)
+        sample = self.vae.decode(latents / self.vae.config.scaling_factor).sample
+        return SimpleNamespace(images=self.image_processor.postprocess(sample, output_type=output_type))
+
+
+class Tokenizer:
+    """Byte-level tokenizer, enough for the caption code path"""
+
+    pad_token = eos_token = "\n"
+    eos_token_id = 10
+
+    def __call__(self, text, return_tensors="pt"):
+        ids = torch.tensor([list(text.encode())])
+        return {"input_ids": ids, "attention_mask": torch.ones_like(ids)}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return bytes(int(i) for i in ids).decode(errors="replace")
+
+    def __len__(self):
+        return 256
+
+
+class CaptionModel(Module):
+    def __init__(self, backend, size):
+        super().__init__(size)
+        self.backend = backend
+
+    def generate(self, input_ids, max_new_tokens=None, **kwargs):
+        """Append a caption built from the scene's first words, after the profile's per-token time"""
+        max_new_tokens = max_new_tokens or TEXT_CONFIG["max_new_tokens"]
+        self.backend.device.run(self.backend.profile["caption_token_seconds"] * max_new_tokens)
+        scene = bytes(input_ids[0].tolist()).decode(errors="replace").split(": ", 1)[-1]
+        words = " ".join(scene.split(",")[0].split()[:8])
+        caption = list(f" {CAPTION} {words}."[:max_new_tokens * 4].encode())
+        return torch.cat([input_ids, torch.tensor([caption], dtype=input_ids.dtype)], dim=1)
+
+
+class Backend:
+    """The stand-in models for one profile, sharing one simulated device"""
+
+    def __init__(self, profile, memory_scale=None):
+        self.profile = profile
+        self.memory_scale = SYNTHETIC_CONFIG["memory_scale"] if memory_scale is None else memory_scale
+        self.device = Device(profile["concurrency"])
+        sizes = {name: size * self.memory_scale for name, size in profile["component_bytes"].items()}
+        self.unet = Module(sizes["unet"])
+        self.vae = Autoencoder(self, sizes["vae"], "vae_decode", profile["vae_decode_seconds"], scaling_factor=0.13025)
+        self.tiny_vae = Autoencoder(self, sizes["tiny_vae"], "draft_decode", profile["draft_decode_seconds"])
+        self.text_encoder = Module(sizes["text_encoder"])
+        self.text_encoder_2 = Module(sizes["text_encoder_2"])
+        self.caption_model = CaptionModel(self, sizes["caption_model"])
+        self.controlnet_bytes = sizes["controlnet"]
+
+    def scale(self, width, height):
+        """Time of a per-image stage at ``width`` x ``height`` relative to the reference size"""
+        return (width * height / self.profile["reference_pixels"]) ** self.profile["resolution_exponent"]
+
+    def activations(self, width, height):
+        pixels = width * height / self.profile["reference_pixels"]
+        return torch.ones(int(self.profile["activation_bytes"] * self.memory_scale * pixels), dtype=torch.uint8)
+
+    def pipeline(self, kind):
+        controlnet = Module(self.controlnet_bytes, lazy=True) if kind == "controlnet" else None
+        return Pipeline(self, kind, controlnet)
+
+
+def install(storyboard, profile=None, memory_scale=None):
+    """Replace the storyboard module's models with synthetic ones; returns the ``Backend``.
+
+    ControlNet pipelines are registered for every configured control type;
+    each allocates its module's bytes the first time it is used.
+    """
+    from diffusionlab.config import CONTROLNET_CONFIG
+
+    if not isinstance(profile, dict):
+        profile = load_profile(profile)
+    backend = Backend(profile, memory_scale)
+    storyboard.pipe = backend.pipeline("text")
+    storyboard.img2img_pipe = backend.pipeline("img2img")
+    storyboard.inpaint_pipe = backend.pipeline("inpaint")
+    storyboard.tiny_vae = backend.tiny_vae
+    storyboard.tokenizer = Tokenizer()
+    storyboard.model = backend.caption_model
+    storyboard.controlnet_pipes.clear()
+    for control_type in CONTROLNET_CONFIG["models"]:
+        storyboard.controlnet_pipes[control_type] = backend.pipeline("controlnet")
+    print(f"[DEBUG] Synthetic backend installed ({profile['hardware']}, memory x{backend.memory_scale})")
+    return backend
+
+
+def requested():
+    """Whether ``load_models`` should install the synthetic backend, and from which profile"""
+    value = os.environ.get("DIFFUSIONLAB_SYNTHETIC")
+    if value and value not in ("0", "false"):
+        return True, None if value in ("1", "true") else value
+    return SYNTHETIC_CONFIG["enabled"], None
+
+
+def _stage(stages, name):
+    """``(calls, seconds)`` of a stage in ``start_request`` totals"""
+    return tuple(stages.get(name, (0, 0.0)))
+
+
+def calibrate(steps=10, prompt="a lighthouse on a rocky cliff at dusk, waves crashing below"):
+    """Measure a profile with the real models at the configured image size"""
+    from diffusionlab import memory
+    from diffusionlab.metrics import start_request
+    from diffusionlab.tasks import storyboard
+
+    storyboard.load_models()
+    storyboard.load_tiny_vae()
+    width, height = IMAGE_CONFIG["width"], IMAGE_CONFIG["height"]
+    args = dict(num_inference_steps=steps, guidance_scale=IMAGE_CONFIG["guidance_scale"])
+
+    def measure(run):
+        stages = start_request()
+        with memory.RequestMemory("calibrate"):
+            run()
+        return stages, memory.recent_requests[-1]
+
+    storyboard.generate_image(storyboard.pipe, prompt, width=width, height=height, **args)  # Warm-up
+    stages, usage = measure(lambda: storyboard.generate_image(storyboard.pipe, prompt, width=width, height=height, **args))
+    small_width, small_height = width // 2 // 8 * 8, height // 2 // 8 * 8  # About a quarter of the pixels
+    small = start_request()
+    storyboard.generate_image(storyboard.pipe, prompt, width=small_width, height=small_height, **args)
+    calls, step_total = _stage(stages, "denoise_step")
+    step_seconds = step_total / max(1, calls)
+    small_calls, small_total = _stage(small, "denoise_step")
+    small_step = small_total / max(1, small_calls)
+    ratio = width * height / (small_width * small_height)
+    exponent = float(np.log(step_seconds / small_step) / np.log(ratio)) if small_step else 1.0
+
+    latents = storyboard.pipe(prompt, width=width, height=height, output_type="latent", **args).images
+    draft = start_request()
+    storyboard.decode_latents(latents, draft=True)
+    encode = start_request()
+    storyboard.generate_img2img(prompt, Image.new("RGB", (width, height), "gray"), strength=0.1, **args)
+    caption = start_request()
+    storyboard.generate_caption(prompt)
+
+    controlnet_step = REFERENCE_PROFILE["controlnet_step_seconds"]
+    control_pipe = storyboard.load_controlnet_model("canny")
+    if control_pipe is not None:
+        control = start_request()
+        control_pipe(prompt, image=Image.new("RGB", (width, height)), width=width, height=height, **args)
+        control_calls, control_total = _stage(control, "controlnet")
+        controlnet_step = control_total / max(1, control_calls)
+
+    sizes = memory.component_sizes(storyboard.loaded_components())
+    component_bytes = {name: sum(devices.values()) for name, devices in sizes.items()}
+    controlnets = [size for name, size in component_bytes.items() if name.startswith("controlnet_")]
+    component_bytes = {name: size for name, size in component_bytes.items() if not name.startswith("controlnet_")}
+    component_bytes["controlnet"] = controlnets[0] if controlnets else REFERENCE_PROFILE["component_bytes"]["controlnet"]
+    if torch.cuda.is_available():
+        hardware = torch.cuda.get_device_name()
+        activation_bytes = usage.get("cuda_peak_bytes", 0) - sum(component_bytes.values())
+    else:
+        hardware = platform.processor() or platform.machine()
+        activation_bytes = (usage["peak_rss_bytes"] or 0) - (usage["rss_before_bytes"] or 0)
+    return {
+        "hardware": f"{hardware} ({storyboard.get_optimal_device()})",
+        "reference_pixels": width * height,
+        "resolution_exponent": round(exponent, 3),
+        "text_encode_seconds": _stage(stages, "text_encode")[1],
+        "step_seconds": step_seconds,
+        "controlnet_step_seconds": controlnet_step,
+        "vae_decode_seconds": _stage(stages, "vae_decode")[1],
+        "vae_encode_seconds": _stage(encode, "vae_encode")[1],
+        "draft_decode_seconds": _stage(draft, "draft_decode")[1],
+        "caption_token_seconds": _stage(caption, "caption")[1] / TEXT_CONFIG["max_new_tokens"],
+        "concurrency": REFERENCE_PROFILE["concurrency"],
+        "component_bytes": component_bytes,
+        "activation_bytes": max(0, activation_bytes),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--calibrate", metavar="PROFILE", required=True, help="Write a profile measured with the real models")
+    parser.add_argument("--steps", type=int, default=10, help="Denoising steps per measured call")
+    args = parser.parse_args()
+    os.environ.pop("DIFFUSIONLAB_SYNTHETIC", None)
+    SYNTHETIC_CONFIG["enabled"] = False
+    profile = calibrate(args.steps)
+    with open(args.calibrate, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(json.dumps(profile, indent=2))
+
+
+if __name__ == "__main__":
+    main()
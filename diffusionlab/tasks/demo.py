@@ -1,70 +1,21 @@
 #!/usr/bin/env python3
 """
 Demo script for Storyboard Generator
-This version shows the UI without loading the full AI models
+This version shows the UI without loading the full AI models: panels come from
+the synthetic backend (diffusionlab.synthetic), which takes as long as the
+models would on the hardware of its profile
 """
 
 import gradio as gr
-from PIL import Image, ImageDraw, ImageFont
-import numpy as np
-import time
-from config import *
 
-def create_demo_image(prompt, style):
-    """Create a demo image with placeholder content"""
-    # Create a simple placeholder image
-    width, height = IMAGE_CONFIG["width"], IMAGE_CONFIG["height"]
-    image = Image.new('RGB', (width, height), color='lightblue')
-    draw = ImageDraw.Draw(image)
-    
-    # Add some demo content
-    draw.rectangle([50, 50, width-50, height-50], outline='black', width=3)
-    draw.text((width//2, height//2), f"Demo: {style}", fill='black', anchor='mm')
-    draw.text((width//2, height//2 + 30), "AI Model Not Loaded", fill='red', anchor='mm')
-    
-    return image
+from diffusionlab import synthetic
+from diffusionlab.config import STYLE_PRESETS, UI_CONFIG
+from diffusionlab.export import export_to_pdf
+from diffusionlab.tasks import storyboard
 
 def generate_demo_storyboard(prompt, style, progress=gr.Progress()):
-    """Generate a demo storyboard with placeholder images"""
-    # Validate input
-    is_valid, message = validate_prompt(prompt)
-    if not is_valid:
-        return None, message
-    
-    try:
-        progress(0.1, desc="Generating scene variations...")
-        time.sleep(1)  # Simulate processing time
-        
-        images = []
-        captions = []
-        
-        # Generate 5 demo images
-        for i in range(5):
-            progress((i + 1) * 0.15, desc=f"Generating image {i+1}/5...")
-            
-            # Create demo image
-            image = create_demo_image(prompt, style)
-            
-            # Create demo caption
-            caption = f"Demo panel {i+1}: {prompt[:30]}..."
-            
-            images.append(image)
-            captions.append(caption)
-            
-            time.sleep(0.5)  # Simulate processing time
-        
-        progress(0.9, desc="Creating storyboard layout...")
-        time.sleep(1)
-        
-        # Create storyboard layout
-        storyboard = create_storyboard_grid(images, captions, "horizontal")
-        
-        progress(1.0, desc="Complete!")
-        
-        return storyboard, "Demo storyboard generated successfully! (AI models not loaded)"
-        
-    except Exception as e:
-        return None, f"Error generating demo storyboard: {str(e)}"
+    """Generate a demo storyboard panel by panel with the synthetic backend"""
+    yield from storyboard.generate_storyboard(prompt, style, progress)
 
 def create_demo_interface():
     """Create the demo interface"""
@@ -106,6 +57,7 @@ def create_demo_interface():
                 # Output section
                 gr.Markdown("## Generated Storyboard")
                 storyboard_output = gr.Image(label="Storyboard", type="pil")
+        panel_state = gr.State(None)
         
         # Update style description when style changes
         def update_style_info(style):
@@ -115,19 +67,20 @@ def create_demo_interface():
         style_dropdown.change(
             fn=update_style_info,
             inputs=[style_dropdown],
-            outputs=[style_info]
+            outputs=[style_info],
+            queue=False
         )
         
         # Event handlers
         generate_btn.click(
             fn=generate_demo_storyboard,
             inputs=[prompt_input, style_dropdown],
-            outputs=[storyboard_output, status_output]
+            outputs=[storyboard_output, status_output, panel_state]
         )
         
         export_btn.click(
             fn=export_to_pdf,
-            inputs=[storyboard_output, prompt_input, style_dropdown],
+            inputs=[storyboard_output, prompt_input, style_dropdown, panel_state],
             outputs=[pdf_output]
         )
         
@@ -148,10 +101,12 @@ def create_demo_interface():
 if __name__ == "__main__":
     print("Starting Storyboard Generator Demo...")
     print("This is a demo version without AI models.")
-    print("Run 'python app.py' for the full version with AI generation.")
+    print("Run 'python -m diffusionlab.tasks.storyboard' for the full version with AI generation.")
     
     # Create and launch the demo interface
+    synthetic.install(storyboard)
     demo = create_demo_interface()
+    demo.queue(default_concurrency_limit=UI_CONFIG["concurrency_limit"], max_size=UI_CONFIG["max_queue_size"])
     demo.launch(
         server_name=UI_CONFIG["server_name"],
         server_port=UI_CONFIG["server_port"],
@@ -1,49 +1,65 @@
-import gradio as gr
+# diffusers, transformers, controlnet_aux and gradio are imported where they are
+# used, so importing this module (e.g. from the web app) only loads torch
 import torch
-from diffusers import StableDiffusionXLPipeline, StableDiffusionXLInpaintPipeline, ControlNetModel, StableDiffusionXLControlNetPipeline
-from transformers import AutoTokenizer, AutoModelForCausalLM
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import os
-import tempfile
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.utils import ImageReader
 import io
-import time
-import cv2
-from controlnet_aux import CannyDetector, OpenposeDetector, MLSDdetector, HEDdetector
+import math
+import gc
+import sys
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import closing
 from diffusionlab.config import *
 from diffusionlab.utils import *
+from diffusionlab.compositor import compose_layout
+from diffusionlab.export import export_to_pdf
+from diffusionlab.masking import mask_crop_box, inpaint_working_size, paste_feathered
+from diffusionlab.preprocess import get_engine
+from diffusionlab.tuning import configure_performance, apply_choice, performance_report
+from diffusionlab.metrics import model_load, stage, time_module
+from diffusionlab.profiling import annotate
 
 # --- Model and Pipeline Setup (Top Level) ---
 pipe = None
+img2img_pipe = None
 inpaint_pipe = None
-controlnet_pipes = {}
+controlnet_pipes = OrderedDict()  # control type -> pipeline, least recently used first
+controlnet_lock = threading.Lock()
+panel_lock = threading.Lock()  # Gradio sessions and node job runners take turns on the pipelines, one panel at a time
+tiny_vae = None  # Tiny autoencoder for drafts and step previews, loaded on first use (False if unavailable)
 model = None
 tokenizer = None
-controlnet_processors = {}
+controlnet_processors = {}  # Detectors that need model weights (pose), loaded on demand
 
 # Load models at import time for webapp AI mode
 # (If you want to delay loading for Gradio UI, you can move this into a function)
 def load_models():
-    global pipe, inpaint_pipe, tokenizer, model, controlnet_processors
-    if pipe is not None and inpaint_pipe is not None and tokenizer is not None and model is not None:
+    global pipe, img2img_pipe, inpaint_pipe, tokenizer, model, controlnet_processors
+    if pipe is not None and img2img_pipe is not None and inpaint_pipe is not None and tokenizer is not None and model is not None:
         return
+    from diffusionlab import synthetic
+    enabled, profile = synthetic.requested()
+    if enabled:
+        synthetic.install(sys.modules[__name__], profile)
+        return
+    from diffusers import StableDiffusionXLPipeline, StableDiffusionXLImg2ImgPipeline, StableDiffusionXLInpaintPipeline
+    from transformers import AutoTokenizer, AutoModelForCausalLM
     print("Loading Stable Diffusion XL...")
-    pipe = StableDiffusionXLPipeline.from_pretrained(
-        MODEL_CONFIG["diffusion_model"],
-        torch_dtype=getattr(torch, MODEL_CONFIG["torch_dtype"]),
-        use_safetensors=MODEL_CONFIG["use_safetensors"],
-        variant=MODEL_CONFIG["variant"]
-    )
-    print("Loading Stable Diffusion XL Inpainting...")
-    inpaint_pipe = StableDiffusionXLInpaintPipeline.from_pretrained(
-        MODEL_CONFIG["diffusion_model"],
-        torch_dtype=getattr(torch, MODEL_CONFIG["torch_dtype"]),
-        use_safetensors=MODEL_CONFIG["use_safetensors"],
-        variant=MODEL_CONFIG["variant"]
-    )
+    with model_load("sdxl"):
+        pipe = StableDiffusionXLPipeline.from_pretrained(
+            MODEL_CONFIG["diffusion_model"],
+            torch_dtype=getattr(torch, MODEL_CONFIG["torch_dtype"]),
+            use_safetensors=MODEL_CONFIG["use_safetensors"],
+            variant=MODEL_CONFIG["variant"]
+        )
+    # Image-to-image and inpainting reuse the base UNet, VAE and text encoders
+    # instead of loading a second copy of the SDXL weights
+    print("Creating Stable Diffusion XL Image-to-Image and Inpainting pipelines...")
+    img2img_pipe = StableDiffusionXLImg2ImgPipeline(**pipe.components)
+    inpaint_pipe = StableDiffusionXLInpaintPipeline(**pipe.components)
     
     # Initialize ControlNet processors (lightweight) - moved to on-demand loading
     # This prevents import issues at startup
@@ -52,107 +68,254 @@ def load_models():
     device = get_optimal_device()
     if device == "cuda":
         pipe = pipe.to("cuda")
+        img2img_pipe = img2img_pipe.to("cuda")
         inpaint_pipe = inpaint_pipe.to("cuda")
         print("Using CUDA for image generation")
     elif device == "mps":
         pipe = pipe.to("mps")
+        img2img_pipe = img2img_pipe.to("mps")
         inpaint_pipe = inpaint_pipe.to("mps")
         print("Using MPS for image generation")
     
-    if PERFORMANCE_CONFIG["enable_attention_slicing"]:
-        pipe.enable_attention_slicing()
-        inpaint_pipe.enable_attention_slicing()
+    # Attention, VAE and offload settings (benchmarked on this host in "auto" mode)
+    configure_performance(pipe, [pipe, img2img_pipe, inpaint_pipe], device)
+    # Installed after autotuning so its benchmark runs do not count as requests
+    time_pipeline_stages(pipe)
     
     print("Loading StableLM for caption generation...")
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_CONFIG["caption_model"])
-    model = AutoModelForCausalLM.from_pretrained(
-        MODEL_CONFIG["caption_model"],
-        torch_dtype=getattr(torch, MODEL_CONFIG["torch_dtype"]),
-        device_map="auto" if device == "cuda" else None
-    )
+    with model_load("caption"):
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_CONFIG["caption_model"])
+        model = AutoModelForCausalLM.from_pretrained(
+            MODEL_CONFIG["caption_model"],
+            torch_dtype=getattr(torch, MODEL_CONFIG["torch_dtype"]),
+            device_map="auto" if device == "cuda" else None
+        )
     print("Models loaded successfully!")
 
+def time_pipeline_stages(pipeline):
+    """Report the pipeline's text encoding, denoising steps and VAE passes as stages (see diffusionlab.metrics)"""
+    time_module(pipeline.text_encoder, "text_encode")
+    time_module(pipeline.text_encoder_2, "text_encode")
+    time_module(pipeline.unet, "denoise_step")
+    time_module(pipeline.vae.decoder, "vae_decode")
+    time_module(pipeline.vae.encoder, "vae_encode")
+    time_module(getattr(pipeline, "controlnet", None), "controlnet")
+
+def loaded_components():
+    """Loaded model modules by name, each shared module once (for memory accounting)"""
+    components = {}
+    if pipe is not None:
+        for name in ("unet", "vae", "text_encoder", "text_encoder_2"):
+            components[name] = getattr(pipe, name)
+    if tiny_vae:
+        components["tiny_vae"] = tiny_vae
+    if model is not None:
+        components["caption_model"] = model
+    for control_type, controlnet_pipe in list(controlnet_pipes.items()):
+        components[f"controlnet_{control_type}"] = controlnet_pipe.controlnet
+    return components
+
 def load_controlnet_model(control_type):
-    """Load a specific ControlNet model on-demand"""
-    global controlnet_pipes
-    
-    if control_type in controlnet_pipes:
-        return controlnet_pipes[control_type]
-    
-    try:
-        print(f"Loading ControlNet model: {control_type}")
-        device = get_optimal_device()
-        
-        # Get model config
-        if control_type not in CONTROLNET_CONFIG["models"]:
-            print(f"Unknown control type: {control_type}")
-            return None
-        
-        config = CONTROLNET_CONFIG["models"][control_type]
-        
-        # For now, let's use a simpler approach that doesn't require downloading large models
-        # This will allow the feature to work in demo mode while we work on full implementation
-        print(f"ControlNet model {control_type} not fully implemented yet, using fallback")
-        return None
-        
-    except Exception as e:
-        print(f"Error loading ControlNet model {control_type}: {e}")
+    """Return a ControlNet pipeline for ``control_type``, loading its module on demand.
+
+    The pipeline is built from the base pipeline's UNet, VAE, text encoders and
+    scheduler, so only the ControlNet module itself is loaded. Modules are kept
+    in an LRU of ``CONTROLNET_CONFIG["max_loaded_models"]`` entries.
+    """
+    if control_type not in CONTROLNET_CONFIG["models"]:
+        print(f"Unknown control type: {control_type}")
         return None
 
+    with controlnet_lock:
+        if control_type in controlnet_pipes:
+            controlnet_pipes.move_to_end(control_type)
+            return controlnet_pipes[control_type]
+
+        load_models()
+        from diffusers import ControlNetModel, StableDiffusionXLControlNetPipeline
+        model_name = CONTROLNET_CONFIG["models"][control_type]["name"]
+        try:
+            print(f"Loading ControlNet model: {control_type} ({model_name})")
+            with model_load(f"controlnet_{control_type}"):
+                controlnet = ControlNetModel.from_pretrained(model_name, torch_dtype=pipe.unet.dtype)
+        except Exception as e:
+            print(f"Error loading ControlNet model {control_type}: {e}")
+            return None
+
+        controlnet_pipe = StableDiffusionXLControlNetPipeline(**pipe.components, controlnet=controlnet.to(pipe.device))
+        apply_choice([controlnet_pipe], performance_report["choice"], PERFORMANCE_CONFIG, get_optimal_device(),
+                     offload=False)  # Its shared modules keep the base pipeline's offload hooks
+        time_pipeline_stages(controlnet_pipe)
+        controlnet_pipes[control_type] = controlnet_pipe
+
+        while len(controlnet_pipes) > CONTROLNET_CONFIG["max_loaded_models"]:
+            evicted_type, _ = controlnet_pipes.popitem(last=False)
+            print(f"Unloading ControlNet model: {evicted_type}")
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        return controlnet_pipe
+
+def make_generator(seed):
+    """Create a seeded torch generator so a panel can be reproduced later"""
+    return torch.Generator(device=get_optimal_device()).manual_seed(int(seed))
+
+# --- Draft Decoding ---
+def load_tiny_vae():
+    """Return the tiny autoencoder (TAESD-XL), or None if it cannot be loaded"""
+    global tiny_vae
+    if tiny_vae is None:
+        load_models()
+        try:
+            from diffusers import AutoencoderTiny
+            print(f"Loading tiny autoencoder: {DRAFT_CONFIG['tiny_vae_model']}")
+            with model_load("tiny_vae"):
+                tiny_vae = AutoencoderTiny.from_pretrained(DRAFT_CONFIG["tiny_vae_model"], torch_dtype=pipe.vae.dtype)
+                tiny_vae = tiny_vae.to(pipe.vae.device)
+            time_module(tiny_vae.decoder, "draft_decode")
+        except Exception as e:
+            print(f"Error loading tiny autoencoder, drafts use the full VAE: {e}")
+            tiny_vae = False
+    return tiny_vae or None
+
+@annotate("decode_latents")
+def decode_latents(latents, draft=False):
+    """Decode SDXL latents (a tensor or array, as returned with ``output_type="latent"``) to PIL images.
+
+    Drafts use the tiny autoencoder, which is much cheaper than the full VAE
+    and good enough for previews and variations that are mostly discarded;
+    they fall back to the full VAE if it is unavailable.
+    """
+    if isinstance(latents, np.ndarray):
+        latents = torch.from_numpy(latents)
+    if latents.ndim == 3:
+        latents = latents[None]
+    vae = load_tiny_vae() if draft else None
+    with torch.no_grad():
+        if vae is not None:
+            # The tiny autoencoder takes the latents as the UNet sees them (scaling factor 1)
+            image = vae.decode(latents.to(vae.device, vae.dtype)).sample
+        else:
+            vae = pipe.vae
+            needs_upcast = vae.dtype == torch.float16 and vae.config.force_upcast
+            if needs_upcast:
+                vae.to(dtype=torch.float32)
+            try:
+                image = vae.decode(latents.to(vae.device, vae.dtype) / vae.config.scaling_factor).sample
+            finally:
+                if needs_upcast:
+                    vae.to(dtype=torch.float16)
+    if pipe.watermark is not None:
+        image = pipe.watermark.apply_watermark(image)
+    return pipe.image_processor.postprocess(image, output_type="pil")
+
+@annotate("pipe:text_to_image")
+def generate_image(pipeline, prompt, draft=False, **kwargs):
+    """Run ``pipeline`` and return ``(image, latents)``.
+
+    Drafts are decoded with the tiny autoencoder and also return their final
+    latents (a float16 array) so a kept image can be re-decoded with the full
+    VAE later; full-quality runs return ``None`` latents.
+    """
+    if not draft:
+        return pipeline(prompt, **kwargs).images[0], None
+    latents = pipeline(prompt, output_type="latent", **kwargs).images
+    return decode_latents(latents, draft=True)[0], latents[0].float().cpu().numpy().astype(np.float16)
+
+def preview_callback(on_preview, every=None):
+    """``callback_on_step_end`` that sends a tiny-autoencoder preview to ``on_preview(step, image)``"""
+    every = every or DRAFT_CONFIG["preview_every"]
+
+    def callback(pipeline, step, timestep, callback_kwargs):
+        if (step + 1) % every == 0:
+            on_preview(step, decode_latents(callback_kwargs["latents"][:1], draft=True)[0])
+        return callback_kwargs
+    return callback
+
+def stream_previews(run, every=None):
+    """Run ``run(callback_on_step_end)`` on a thread, yielding ``(step, preview)`` while it denoises.
+
+    The previews come from ``preview_callback`` (tiny autoencoder); the last
+    item is ``(None, result)`` with what ``run`` returned.
+    """
+    updates = queue.Queue()
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = run(preview_callback(lambda step, image: updates.put((step, image)), every))
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            updates.put(None)
+
+    thread = threading.Thread(target=target, name="step-previews", daemon=True)
+    thread.start()
+    try:
+        for update in iter(updates.get, None):
+            yield update
+    finally:
+        thread.join()  # Also when the consumer stops early: the pipelines stay in use until the run ends
+    if "error" in outcome:
+        raise outcome["error"]
+    yield None, outcome["result"]
+
 # --- Expose style presets and image config for webapp ---
 STYLE_PRESETS = STYLE_PRESETS
 IMAGE_CONFIG = IMAGE_CONFIG
 
 # --- ControlNet Functions ---
-def process_control_image(image, control_type):
-    """Process an image for ControlNet based on the control type"""
-    if control_type not in controlnet_processors:
-        return image
-    
-    # Convert PIL image to numpy array
-    image_np = np.array(image)
-    
+def detect_pose(image_np, detect_resolution=512, image_resolution=512):
+    """OpenPose skeleton map, or None if the detector cannot be loaded"""
     try:
-        if control_type == "canny":
-            # Apply Canny edge detection
-            low_threshold = CONTROLNET_CONFIG["preprocessor_settings"]["canny"]["low_threshold"]
-            high_threshold = CONTROLNET_CONFIG["preprocessor_settings"]["canny"]["high_threshold"]
-            processed = controlnet_processors["canny"](image_np, low_threshold, high_threshold)
-        elif control_type == "pose":
-            # Apply pose detection
-            detect_resolution = CONTROLNET_CONFIG["preprocessor_settings"]["pose"]["detect_resolution"]
-            image_resolution = CONTROLNET_CONFIG["preprocessor_settings"]["pose"]["image_resolution"]
-            processed = controlnet_processors["pose"](image_np, detect_resolution, image_resolution)
-        elif control_type == "depth":
-            # For depth, we'll use a simple grayscale conversion as a fallback
-            # In a full implementation, you'd use a depth estimation model
-            processed = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
-            processed = cv2.cvtColor(processed, cv2.COLOR_GRAY2RGB)
-        elif control_type == "segmentation":
-            # For segmentation, we'll use a simple color-based segmentation as a fallback
-            # In a full implementation, you'd use a segmentation model
-            detect_resolution = CONTROLNET_CONFIG["preprocessor_settings"]["segmentation"]["detect_resolution"]
-            processed = controlnet_processors["hed"](image_np, detect_resolution)
-        else:
-            return image
-        
-        # Convert back to PIL Image
-        return Image.fromarray(processed)
+        if "pose" not in controlnet_processors:
+            from controlnet_aux import OpenposeDetector
+            with model_load("openpose"):
+                controlnet_processors["pose"] = OpenposeDetector.from_pretrained("lllyasviel/Annotators")
+        return controlnet_processors["pose"](
+            image_np,
+            detect_resolution=detect_resolution,
+            image_resolution=image_resolution,
+            output_type="np"
+        )
     except Exception as e:
-        print(f"Error processing control image for {control_type}: {e}")
+        print(f"Error processing control image for pose: {e}")
+        return None
+
+def submit_control_image(image, control_type, image_key=None):
+    """Start preprocessing a control image; returns a Future of a uint8 array or None.
+
+    Canny, depth and segmentation maps come from the OpenCV engine; pose uses
+    the OpenPose detector on the same thread pool. Maps are cached by the
+    image's content hash, control type and preprocessor settings.
+    """
+    engine = get_engine()
+    if "pose" not in engine.preprocessors:
+        engine.register("pose", detect_pose)
+    return engine.submit(np.asarray(image), control_type, image_key=image_key)
+
+def process_control_image(image, control_type, image_key=None):
+    """Process an image for ControlNet based on the control type"""
+    control_map = submit_control_image(image, control_type, image_key).result()
+    if control_map is None:
         return image
+    return Image.fromarray(control_map)
 
-def generate_with_controlnet(prompt, control_image, control_type, control_strength=1.0, guidance_start=0.0, guidance_end=1.0, negative_prompt="", **kwargs):
+@annotate("pipe:controlnet")
+def generate_with_controlnet(prompt, control_image, control_type, control_strength=1.0, guidance_start=0.0, guidance_end=1.0, negative_prompt="", image_key=None, **kwargs):
     """Generate an image using ControlNet"""
     try:
+        # Preprocess in the background while the ControlNet module loads
+        control_future = submit_control_image(control_image, control_type, image_key)
+        
         # Load ControlNet pipeline on-demand
         controlnet_pipe = load_controlnet_model(control_type)
         if controlnet_pipe is None:
             print(f"ControlNet model {control_type} not available, falling back to regular generation")
             return pipe(prompt, negative_prompt=negative_prompt, **kwargs).images[0]
         
-        # Process the control image
-        processed_control_image = process_control_image(control_image, control_type)
+        control_map = control_future.result()
+        processed_control_image = control_image if control_map is None else Image.fromarray(control_map)
         
         # Generate with ControlNet
         result = controlnet_pipe(
@@ -160,8 +323,8 @@ def generate_with_controlnet(prompt, control_image, control_type, control_streng
             image=processed_control_image,
             negative_prompt=negative_prompt,
             controlnet_conditioning_scale=control_strength,
-            guidance_start=guidance_start,
-            guidance_end=guidance_end,
+            control_guidance_start=guidance_start,
+            control_guidance_end=guidance_end,
             **kwargs
         )
         
@@ -171,20 +334,199 @@ def generate_with_controlnet(prompt, control_image, control_type, control_streng
         print("Falling back to regular generation")
         return pipe(prompt, negative_prompt=negative_prompt, **kwargs).images[0]
 
+# --- Image-to-Image ---
+@annotate("pipe:img2img")
+def generate_img2img(prompt, image, strength=None, negative_prompt="", num_inference_steps=None, **kwargs):
+    """Transform an image with the dedicated img2img pipeline.
+
+    The pipeline encodes ``image`` to latents, noises them to ``strength`` and
+    only runs the last ``strength * num_inference_steps`` denoising steps, so a
+    light restyle costs a fraction of a full generation.
+    """
+    strength = IMG2IMG_CONFIG["strength"] if strength is None else float(strength)
+    strength = min(max(strength, 0.01), 1.0)
+    num_inference_steps = num_inference_steps or IMG2IMG_CONFIG["num_inference_steps"]
+    # Make sure at least one denoising step survives the strength cut
+    num_inference_steps = max(num_inference_steps, math.ceil(1 / strength))
+    return img2img_pipe(
+        prompt,
+        image=image,
+        strength=strength,
+        negative_prompt=negative_prompt,
+        num_inference_steps=num_inference_steps,
+        **kwargs
+    ).images[0]
+
+# --- Two-Stage Generation ---
+def upscale_latents(latents, width, height, mode=None):
+    """Resize latents to the latent grid of a ``width`` x ``height`` image"""
+    mode = mode or TWO_STAGE_CONFIG["upscale_mode"]
+    scale = pipe.vae_scale_factor
+    # Interpolate in float32 (half-precision bicubic is not available on every device)
+    upscaled = torch.nn.functional.interpolate(latents.float(), size=(height // scale, width // scale), mode=mode)
+    return upscaled.to(latents.dtype)
+
+@annotate("generate_two_stage")
+def generate_two_stage(prompt, width=None, height=None, num_inference_steps=None, scale=None, strength=None, refine_steps=None, draft=False, **kwargs):
+    """Generate at ``width`` x ``height``, upscale the latents and refine at the target size.
+
+    The full schedule runs at the small size, where every step is several
+    times cheaper; the latents are interpolated to ``scale`` times that size
+    and re-noised to ``strength`` for a short img2img pass that adds detail at
+    the target resolution. Returns ``(image, latents)`` like ``generate_image``.
+    """
+    width = width or IMAGE_CONFIG["width"]
+    height = height or IMAGE_CONFIG["height"]
+    scale = scale or TWO_STAGE_CONFIG["scale"]
+    strength = strength or TWO_STAGE_CONFIG["refine_strength"]
+    refine_steps = max(refine_steps or TWO_STAGE_CONFIG["refine_steps"], math.ceil(1 / strength))
+    multiple = pipe.vae_scale_factor
+    target_width = int(width * scale) // multiple * multiple
+    target_height = int(height * scale) // multiple * multiple
+
+    latents = pipe(
+        prompt,
+        width=width,
+        height=height,
+        num_inference_steps=num_inference_steps or IMAGE_CONFIG["num_inference_steps"],
+        output_type="latent",
+        **kwargs
+    ).images
+    return generate_image(
+        img2img_pipe,
+        prompt,
+        draft=draft,
+        image=upscale_latents(latents, target_width, target_height),
+        strength=strength,
+        num_inference_steps=refine_steps,
+        **kwargs
+    )
+
+def generate_text_to_image(prompt, draft=False, two_stage=False, **kwargs):
+    """Text-to-image, optionally two-stage; returns ``(image, latents)`` like ``generate_image``"""
+    if two_stage:
+        return generate_two_stage(prompt, draft=draft, **kwargs)
+    return generate_image(pipe, prompt, draft=draft, **kwargs)
+
+# --- Prompt Chaining ---
+@annotate("pipe:prompt_chain")
+def generate_prompt_chain(prompts, evolution_strength=None, negative_prompt="", seeds=None, num_inference_steps=None, draft=False,
+                          previous_latents=None, on_frame=None, **kwargs):
+    """Generate one frame per prompt, each evolved from the previous frame's latents.
+
+    The first frame is a full text-to-image run. Every later frame starts from
+    the previous frame's final latents re-noised to ``evolution_strength`` (no
+    VAE round trip) and only runs that fraction of the schedule, which keeps
+    frames coherent and makes a chain much cheaper than independent frames.
+    ``previous_latents`` (as passed to ``on_frame``) continues an interrupted
+    chain; ``on_frame(index, image, draft_latents, chain_latents)`` is called
+    as each frame finishes. Returns the list of images, or ``(images, latents)``
+    for drafts.
+    """
+    strength = PROMPT_CHAINING_CONFIG["evolution_strength"] if evolution_strength is None else float(evolution_strength)
+    num_inference_steps = num_inference_steps or PROMPT_CHAINING_CONFIG["num_inference_steps"]
+    final = {}
+    if previous_latents is not None:
+        final["latents"] = torch.from_numpy(previous_latents).to(pipe.device, pipe.dtype)
+
+    def keep_latents(pipeline, step, timestep, callback_kwargs):
+        final["latents"] = callback_kwargs["latents"]
+        return callback_kwargs
+
+    images = []
+    latents = []
+    if draft:
+        kwargs["output_type"] = "latent"
+    for i, prompt in enumerate(prompts):
+        generator = make_generator(seeds[i]) if seeds else None
+        if "latents" not in final or strength >= 1.0:
+            image = pipe(
+                prompt,
+                negative_prompt=negative_prompt,
+                num_inference_steps=num_inference_steps,
+                generator=generator,
+                callback_on_step_end=keep_latents,
+                **kwargs
+            ).images[0]
+        else:
+            # Output size follows the latents, so width/height do not apply here
+            img2img_kwargs = {key: value for key, value in kwargs.items() if key not in ("width", "height")}
+            image = generate_img2img(
+                prompt,
+                final["latents"],
+                strength=strength,
+                negative_prompt=negative_prompt,
+                num_inference_steps=num_inference_steps,
+                generator=generator,
+                callback_on_step_end=keep_latents,
+                **img2img_kwargs
+            )
+        if draft:
+            image = decode_latents(final["latents"], draft=True)[0]
+            latents.append(final["latents"][0].float().cpu().numpy().astype(np.float16))
+        images.append(image)
+        if on_frame is not None:
+            on_frame(i, image, latents[-1] if draft else None, final["latents"].float().cpu().numpy())
+    return (images, latents) if draft else images
+
+# --- Inpainting ---
+@annotate("pipe:inpainting")
+def inpaint_masked_region(prompt, image, mask, negative_prompt="", **kwargs):
+    """Inpaint only the area around the mask and feather it back into the image.
+
+    The mask's bounding box (plus ``inpaint_full_res_padding``) is cropped at
+    the image's native resolution, denoised at a working size between
+    ``inpaint_min_size`` and the configured width/height, then blended back
+    with a ``mask_blur`` feather. Small touch-ups therefore denoise far fewer
+    pixels than a full frame, and large images never need to be downscaled.
+    """
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.Resampling.NEAREST)
+    max_side = max(INPAINTING_CONFIG["width"], INPAINTING_CONFIG["height"])
+    if INPAINTING_CONFIG["inpaint_full_res"]:
+        aspect = INPAINTING_CONFIG["width"] / INPAINTING_CONFIG["height"]
+        box = mask_crop_box(mask, INPAINTING_CONFIG["inpaint_full_res_padding"], aspect)
+        if box is None:
+            return image
+        min_side = INPAINTING_CONFIG["inpaint_min_size"]
+    else:
+        box = (0, 0, image.width, image.height)
+        min_side = max_side
+
+    crop = image.crop(box)
+    width, height = inpaint_working_size(crop.size, max_side, min_side)
+    print(f"Inpainting region {box} at {width}x{height}")
+    result = inpaint_pipe(
+        prompt,
+        image=crop.resize((width, height), Image.Resampling.LANCZOS),
+        mask_image=mask.crop(box).resize((width, height), Image.Resampling.NEAREST),
+        negative_prompt=negative_prompt,
+        width=width,
+        height=height,
+        **kwargs
+    ).images[0]
+    return paste_feathered(image, result, mask, box, INPAINTING_CONFIG["mask_blur"])
+
 # --- AI Functions (Top Level) ---
 def generate_scene_variations(prompt, style):
-    style_preset = STYLE_PRESETS.get(style, STYLE_PRESETS["cinematic"])
-    style_text = style_preset["prompt_suffix"]
-    variations = []
-    for variation in SCENE_VARIATIONS:
-        enhanced_prompt = enhance_prompt_with_style(prompt, style)
-        full_prompt = f"{enhanced_prompt}, {variation['suffix']}, {style_text}"
-        variations.append(full_prompt)
-    return variations
+    with stage("prompt_build"):
+        style_preset = STYLE_PRESETS.get(style, STYLE_PRESETS["cinematic"])
+        style_text = style_preset["prompt_suffix"]
+        variations = []
+        for variation in SCENE_VARIATIONS:
+            enhanced_prompt = enhance_prompt_with_style(prompt, style)
+            full_prompt = f"{enhanced_prompt}, {variation['suffix']}, {style_text}"
+            variations.append(full_prompt)
+        return variations
 
+@annotate("generate_caption")
 def generate_caption(scene_description):
     if tokenizer is None or model is None:
         return "Scene description"
+    with stage("caption"):
+        return _generate_caption(scene_description)
+
+def _generate_caption(scene_description):
     prompt = f"Describe this scene in one short sentence: {scene_description}"
     inputs = tokenizer(prompt, return_tensors="pt")
     device = get_optimal_device()
@@ -210,39 +552,75 @@ def generate_caption(scene_description):
     return caption if caption else "Scene description"
 
 # --- Gradio UI Launch (Only under __main__) ---
-def generate_storyboard(prompt, style, progress=gr.Progress()):
+def storyboard_preview(images, captions, count):
+    """Layout of the panels finished so far, with blank placeholders for the rest"""
+    size = images[0].size if images else (IMAGE_CONFIG["width"], IMAGE_CONFIG["height"])
+    placeholder = Image.new("RGB", size, COMPOSITOR_CONFIG["caption_fill"])
+    return compose_layout(images + [placeholder] * (count - len(images)), captions)
+
+def generate_storyboard(prompt, style, progress=None):
+    """Yield ``(layout, status, panels)`` as each panel finishes, for the Gradio UI to stream.
+
+    While a panel denoises, the layout shows a tiny-autoencoder preview of it
+    every ``DRAFT_CONFIG["preview_every"]`` steps.
+
+    Concurrent sessions (see ``UI_CONFIG["concurrency_limit"]``) take turns on
+    the pipelines per panel, so every queued storyboard keeps making progress.
+    """
+    progress = progress or (lambda *args, **kwargs: None)
     is_valid, message = validate_prompt(prompt)
     if not is_valid:
-        return None, message
+        yield None, message, None
+        return
     try:
-        progress(0.1, desc="Generating scene variations...")
+        load_models()
         scene_variations = generate_scene_variations(prompt, style)
         images = []
         captions = []
         style_preset = STYLE_PRESETS.get(style, STYLE_PRESETS["cinematic"])
         negative_prompt = style_preset["negative_prompt"]
+        count = len(scene_variations)
+        yield storyboard_preview(images, captions, count), f"Generating panel 1/{count}...", None
         for i, scene in enumerate(scene_variations):
-            progress((i + 1) * 0.15, desc=f"Generating image {i+1}/5...")
-            image = pipe(
-                scene,
-                negative_prompt=negative_prompt,
-                num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
-                guidance_scale=IMAGE_CONFIG["guidance_scale"],
-                width=IMAGE_CONFIG["width"],
-                height=IMAGE_CONFIG["height"]
-            ).images[0]
+            progress(i / count, desc=f"Generating panel {i+1}/{count}...")
+
+            # The lock is only held by the generation thread, never across a yield: a session whose
+            # client goes away cannot keep the pipelines from the others
+            def run(callback, scene=scene):
+                with panel_lock:
+                    return generate_text_to_image(
+                        scene,
+                        negative_prompt=negative_prompt,
+                        num_inference_steps=IMAGE_CONFIG["num_inference_steps"],
+                        guidance_scale=IMAGE_CONFIG["guidance_scale"],
+                        width=IMAGE_CONFIG["width"],
+                        height=IMAGE_CONFIG["height"],
+                        callback_on_step_end=callback
+                    )
+            with closing(stream_previews(run)) as updates:
+                for step, update in updates:
+                    if step is None:
+                        image, _ = update
+                    else:  # Tiny-autoencoder preview of the panel being denoised
+                        yield (storyboard_preview(images + [update], captions, count),
+                               f"Generating panel {i+1}/{count} (step {step+1})...", None)
             caption = generate_caption(scene)
             images.append(image)
             captions.append(caption)
-            time.sleep(0.5)
-        progress(0.9, desc="Creating storyboard layout...")
-        storyboard = create_storyboard_layout(images, captions)
+            status = "Storyboard generated successfully!" if i + 1 == count else f"Generating panel {i+2}/{count}..."
+            yield storyboard_preview(images, captions, count), status, {"images": list(images), "captions": list(captions)}
         progress(1.0, desc="Complete!")
-        return storyboard, "Storyboard generated successfully!"
     except Exception as e:
-        return None, f"Error generating storyboard: {str(e)}"
+        yield None, f"Error generating storyboard: {str(e)}", None
 
 def create_interface():
+    import gradio as gr
+
+    # Gradio tracks progress for functions whose default argument is a gr.Progress,
+    # and streams every value a generator yields
+    def generate_with_progress(prompt, style, progress=gr.Progress()):
+        yield from generate_storyboard(prompt, style, progress)
+
     with gr.Blocks(title="Storyboard Generator", theme=getattr(gr.themes, UI_CONFIG["theme"].title())()) as demo:
         gr.Markdown("# 🎬 Storyboard Generator")
         gr.Markdown("Transform your script ideas into visual storyboards using AI")
@@ -268,22 +646,24 @@ def create_interface():
             with gr.Column(scale=2):
                 gr.Markdown("## Generated Storyboard")
                 storyboard_output = gr.Image(label="Storyboard", type="pil")
+        panel_state = gr.State(None)
         def update_style_info(style):
             preset = STYLE_PRESETS.get(style, STYLE_PRESETS["cinematic"])
             return f"**{style.title()}**: {preset['description']}"
         style_dropdown.change(
             fn=update_style_info,
             inputs=[style_dropdown],
-            outputs=[style_info]
+            outputs=[style_info],
+            queue=False
         )
         generate_btn.click(
-            fn=generate_storyboard,
+            fn=generate_with_progress,
             inputs=[prompt_input, style_dropdown],
-            outputs=[storyboard_output, status_output]
+            outputs=[storyboard_output, status_output, panel_state]
         )
         export_btn.click(
             fn=export_to_pdf,
-            inputs=[storyboard_output, prompt_input, style_dropdown],
+            inputs=[storyboard_output, prompt_input, style_dropdown, panel_state],
             outputs=[pdf_output]
         )
         gr.Examples(
@@ -301,8 +681,9 @@ def create_interface():
 if __name__ == "__main__":
     print("Starting Storyboard Generator...")
     print("Loading AI models (this may take a few minutes on first run)...")
-    # Models are loaded at import time
+    # Models are loaded by the first generation
     demo = create_interface()
+    demo.queue(default_concurrency_limit=UI_CONFIG["concurrency_limit"], max_size=UI_CONFIG["max_queue_size"])
     demo.launch(
         server_name=UI_CONFIG["server_name"],
         server_port=UI_CONFIG["server_port"],
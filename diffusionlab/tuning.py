@@ -0,0 +1,281 @@
+"""
+Performance settings for the diffusion pipelines and a startup autotuner
+"""
+
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+import time
+
+import torch
+
+from diffusionlab.config import IMAGE_CONFIG, MODEL_CONFIG, PERFORMANCE_CONFIG
+from diffusionlab.memory import rss_bytes as _rss_bytes
+
+ATTENTION_MODES = ("sdpa", "sliced", "xformers")
+VAE_MODES = ("plain", "sliced", "tiled")
+
+# Decision made by the last call to configure_performance (reported on /health)
+performance_report = {"mode": None}
+
+
+def xformers_available(device):
+    return device == "cuda" and importlib.util.find_spec("xformers") is not None
+
+
+def apply_attention(pipeline, mode, memory_efficient=True):
+    """Set the attention implementation on every attention module of a pipeline.
+
+    ``"sdpa"`` and ``"sliced"`` use PyTorch's scaled dot product attention, or
+    the classic processor when ``memory_efficient`` is off.
+    """
+    from diffusers.models.attention_processor import AttnProcessor, AttnProcessor2_0
+
+    if mode == "xformers":
+        pipeline.enable_xformers_memory_efficient_attention()
+        return
+    pipeline.disable_attention_slicing()
+    for name in ("unet", "controlnet", "vae"):
+        module = getattr(pipeline, name, None)
+        if module is not None and hasattr(module, "set_attn_processor"):
+            module.set_attn_processor(AttnProcessor2_0() if memory_efficient else AttnProcessor())
+    if mode == "sliced":
+        pipeline.enable_attention_slicing()
+
+
+def apply_vae(pipeline, mode):
+    vae = pipeline.vae
+    vae.disable_slicing()
+    vae.disable_tiling()
+    if mode == "sliced":
+        vae.enable_slicing()
+    elif mode == "tiled":
+        vae.enable_tiling()
+
+
+def manual_choice(settings, device):
+    """Translate the PERFORMANCE_CONFIG flags into an attention/VAE choice"""
+    if settings["enable_xformers_memory_efficient_attention"] and xformers_available(device):
+        attention = "xformers"
+    elif settings["enable_attention_slicing"]:
+        attention = "sliced"
+    else:
+        attention = "sdpa"
+    if settings.get("enable_vae_tiling"):
+        vae = "tiled"
+    elif settings.get("enable_vae_slicing"):
+        vae = "sliced"
+    else:
+        vae = "plain"
+    return {"attention": attention, "vae": vae}
+
+
+def apply_choice(pipelines, choice, settings, device, offload=True):
+    """Apply an attention/VAE choice to pipelines sharing components, and the offload flags to the first.
+
+    Offload hooks live on the shared modules, so enabling offload on each
+    pipeline would only replace the previous pipeline's hooks: it is enabled
+    once, on the base pipeline, and the pipelines built from its components
+    (img2img, inpainting, ControlNet) inherit it. Pass ``offload=False`` for
+    pipelines added after the base one.
+    """
+    for pipeline in pipelines:
+        apply_attention(pipeline, choice["attention"], settings["enable_memory_efficient_attention"])
+        apply_vae(pipeline, choice["vae"])
+    if device != "cuda" or not offload:
+        return
+    if settings["enable_sequential_cpu_offload"]:
+        pipelines[0].enable_sequential_cpu_offload()
+    elif settings["enable_model_cpu_offload"]:
+        pipelines[0].enable_model_cpu_offload()
+
+
+class PeakMemory:
+    """Peak memory used while the block runs (CUDA allocator, or sampled process RSS)"""
+
+    def __init__(self, device, interval=0.005):
+        self.device = device
+        self.interval = interval
+        self.peak = None
+
+    def __enter__(self):
+        if self.device == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            self._base = torch.cuda.memory_allocated()
+            return self
+        self._base = _rss_bytes()
+        self._max = self._base
+        self._stop = threading.Event()
+        if self._base is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._max = max(self._max, _rss_bytes() or 0)
+
+    def __exit__(self, *exc):
+        if self.device == "cuda":
+            torch.cuda.synchronize()
+            self.peak = torch.cuda.max_memory_allocated() - self._base
+        elif self._base is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self._max, _rss_bytes() or 0) - self._base
+        return False
+
+
+def memory_budget(device, settings):
+    """Bytes the autotuner may use for a generation"""
+    if settings.get("memory_budget_gb"):
+        return int(settings["memory_budget_gb"] * 1024 ** 3)
+    if device == "cuda":
+        free, _ = torch.cuda.mem_get_info()
+        return int(free * 0.9)
+    try:
+        return int(os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") * 0.8)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _timed(run, device, repeats):
+    run()  # Warm-up: kernel selection, allocator growth
+    timings = []
+    with PeakMemory(device) as memory:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            if device == "cuda":
+                torch.cuda.synchronize()
+            timings.append(time.perf_counter() - start)
+    return min(timings), memory.peak
+
+
+def autotune(pipe, device, settings, width, height):
+    """Benchmark attention and VAE modes on this host and return the fastest that fit the budget.
+
+    Attention only affects the UNet and the VAE mode only the decode, so the
+    two are measured independently (a few UNet steps at the real resolution
+    and one decode of matching latents) instead of timing every combination.
+    """
+    budget = memory_budget(device, settings)
+    steps = settings.get("autotune_steps", 2)
+    repeats = settings.get("autotune_repeats", 1)
+    attention_modes = [mode for mode in ATTENTION_MODES if mode != "xformers" or xformers_available(device)]
+    results = {"attention": {}, "vae": {}}
+
+    def unet_run():
+        pipe("autotune", num_inference_steps=steps, width=width, height=height, output_type="latent",
+             num_images_per_prompt=IMAGE_CONFIG["num_images_per_prompt"])
+
+    for mode in attention_modes:
+        try:
+            apply_attention(pipe, mode, settings["enable_memory_efficient_attention"])
+            seconds, peak = _timed(unet_run, device, repeats)
+            results["attention"][mode] = {"seconds": round(seconds, 4), "peak_bytes": peak}
+        except Exception as e:
+            results["attention"][mode] = {"error": str(e)}
+
+    scale = 2 ** (len(pipe.vae.config.block_out_channels) - 1)
+    latents = torch.randn(1, pipe.vae.config.latent_channels, height // scale, width // scale,
+                          device=pipe.vae.device, dtype=pipe.vae.dtype)
+    for mode in VAE_MODES:
+        try:
+            apply_vae(pipe, mode)
+            with torch.no_grad():
+                seconds, peak = _timed(lambda: pipe.vae.decode(latents), device, repeats)
+            results["vae"][mode] = {"seconds": round(seconds, 4), "peak_bytes": peak}
+        except Exception as e:
+            results["vae"][mode] = {"error": str(e)}
+
+    def pick(candidates, default):
+        measured = {mode: r for mode, r in candidates.items() if "seconds" in r}
+        if not measured:
+            return default
+        fitting = {mode: r for mode, r in measured.items()
+                   if budget is None or r["peak_bytes"] is None or r["peak_bytes"] <= budget}
+        if fitting:
+            return min(fitting, key=lambda mode: fitting[mode]["seconds"])
+        # Nothing fits: take the most frugal mode
+        return min(measured, key=lambda mode: measured[mode]["peak_bytes"] or 0)
+
+    fallback = manual_choice(settings, device)
+    choice = {"attention": pick(results["attention"], fallback["attention"]),
+              "vae": pick(results["vae"], fallback["vae"])}
+    return choice, results, budget
+
+
+def _cache_key(pipe, device, width, height):
+    device_name = torch.cuda.get_device_name() if device == "cuda" else f"{device}-{os.cpu_count()}cpu"
+    description = json.dumps([MODEL_CONFIG["diffusion_model"], str(pipe.unet.dtype), device_name,
+                              torch.__version__, width, height], sort_keys=True)
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def _load_cached(path, key):
+    try:
+        with open(path) as f:
+            return json.load(f).get(key)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_cached(path, key, entry):
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data[key] = entry
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"[WARNING] Could not save autotune result: {e}")
+
+
+def configure_performance(pipe, pipelines, device, settings=None):
+    """Apply PERFORMANCE_CONFIG to ``pipelines`` (the base ``pipe`` first).
+
+    In ``"auto"`` mode the attention and VAE modes are benchmarked on the base
+    pipeline at IMAGE_CONFIG's size; the winner is cached per host, model and
+    shape so later restarts skip the benchmark. ``"manual"`` mode applies the
+    individual flags. Returns the report that /health exposes.
+    """
+    settings = settings or PERFORMANCE_CONFIG
+    width, height = IMAGE_CONFIG["width"], IMAGE_CONFIG["height"]
+    report = {"mode": settings.get("mode", "manual"), "device": device}
+
+    if report["mode"] == "auto":
+        key = _cache_key(pipe, device, width, height)
+        cache_path = settings.get("autotune_cache")
+        cached = _load_cached(cache_path, key) if cache_path else None
+        if cached:
+            choice = cached["choice"]
+            report.update(source="cache", benchmarks=cached["benchmarks"], budget_bytes=cached["budget_bytes"])
+        else:
+            print(f"Autotuning attention and VAE settings at {width}x{height} on {device}...")
+            start = time.perf_counter()
+            choice, benchmarks, budget = autotune(pipe, device, settings, width, height)
+            report.update(source="benchmark", benchmarks=benchmarks, budget_bytes=budget,
+                          tuning_seconds=round(time.perf_counter() - start, 2))
+            if cache_path:
+                _save_cached(cache_path, key, {"choice": choice, "benchmarks": benchmarks, "budget_bytes": budget})
+    else:
+        choice = manual_choice(settings, device)
+
+    apply_choice(pipelines, choice, settings, device)
+    report["choice"] = choice
+    report["offload"] = ("sequential" if settings["enable_sequential_cpu_offload"] else
+                         "model" if settings["enable_model_cpu_offload"] else None) if device == "cuda" else None
+    print(f"Performance settings ({report['mode']}): attention={choice['attention']}, vae={choice['vae']}, "
+          f"offload={report['offload']}")
+    performance_report.clear()
+    performance_report.update(report)
+    return report
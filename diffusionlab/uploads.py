@@ -0,0 +1,138 @@
+"""
+Upload ingestion: fast decoding and an in-memory image store
+"""
+
+import io
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from diffusionlab.config import UPLOAD_CONFIG
+from diffusionlab.storage import content_key
+
+
+def fit_size(size, bound):
+    """Largest size with the same aspect ratio as ``size`` that fits inside ``bound``"""
+    width, height = size
+    scale = min(bound[0] / width, bound[1] / height)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def decode_upload(stream, target_size=None, keep_resolution=False):
+    """Decode an uploaded image straight from its stream.
+
+    JPEGs are decoded in draft mode, letting libjpeg scale by 1/2, 1/4 or 1/8
+    in the DCT domain so a 12 MP photo is never fully decoded just to be
+    shrunk to 512px; other formats use ``reduce`` before the final LANCZOS
+    pass. By default the result is letterboxed onto a white ``target_size``
+    canvas; with ``keep_resolution`` it is only capped at
+    ``UPLOAD_CONFIG["max_native_side"]`` (possibly landing a little under the
+    cap when a draft scale gets there without a resample).
+    """
+    target_size = tuple(target_size or UPLOAD_CONFIG["target_size"])
+    with Image.open(stream) as img:
+        if keep_resolution:
+            # Any draft scale that keeps at least half the cap is close enough
+            max_side = UPLOAD_CONFIG["max_native_side"]
+            img.draft('RGB', fit_size(img.size, (max_side // 2, max_side // 2)))
+            size = fit_size(img.size, (max_side, max_side)) if max(img.size) > max_side else img.size
+        else:
+            size = fit_size(img.size, target_size)
+            img.draft('RGB', size)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != size:
+            img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        else:
+            img.load()
+
+    if keep_resolution or img.size == target_size:
+        return img
+    result = Image.new('RGB', target_size, (255, 255, 255))
+    result.paste(img, ((target_size[0] - size[0]) // 2, (target_size[1] - size[1]) // 2))
+    return result
+
+
+class UploadStore:
+    """Bounded LRU of decoded uploads keyed by upload id.
+
+    Upload ids are content hashes of the uploaded bytes, so re-uploading the
+    same file skips decoding. Entries are evicted once either ``max_items`` or
+    ``max_bytes`` is exceeded. With a ``blobs`` store the original bytes are
+    also written to disk before the id is returned, so any process sharing
+    the store (see diffusionlab.api.server) can resolve the id at once, and
+    evicted entries are decoded again from there.
+    """
+
+    def __init__(self, max_items, max_bytes, blobs=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.blobs = blobs
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def _image_bytes(image):
+        return image.width * image.height * len(image.getbands())
+
+    def path_for(self, upload_id):
+        """Path the upload is (or will be) persisted to, or None without persistence"""
+        if not self.blobs:
+            return None
+        return self.blobs.path(upload_id)
+
+    def _lookup(self, entry):
+        with self._lock:
+            image = self._images.get(entry)
+            if image is not None:
+                self._images.move_to_end(entry)
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+            return image
+
+    def _admit(self, entry, image):
+        with self._lock:
+            if entry in self._images:
+                self._bytes -= self._image_bytes(self._images.pop(entry))
+            self._images[entry] = image
+            self._bytes += self._image_bytes(image)
+            while len(self._images) > 1 and (len(self._images) > self.max_items or self._bytes > self.max_bytes):
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= self._image_bytes(evicted)
+
+    def put(self, data, keep_resolution=False):
+        """Decode an upload (unless already cached) and return the upload id.
+
+        ``data`` is bytes or a seekable binary stream (e.g. the request's
+        spooled file), which is hashed, decoded and persisted without being
+        read into memory.
+        """
+        stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+        upload_id = content_key(stream)
+        entry = (upload_id, keep_resolution)
+        if self._lookup(entry) is None:
+            self._admit(entry, decode_upload(stream, keep_resolution=keep_resolution))
+        if self.blobs:
+            self.blobs.put_bytes(stream)  # Only written the first time: blobs are named by content
+        return upload_id
+
+    def get(self, upload_id, keep_resolution=False):
+        """Return the decoded image for an upload id, or None if it is unknown"""
+        entry = (upload_id, keep_resolution)
+        image = self._lookup(entry)
+        if image is not None:
+            return image
+        data = self.blobs.read_bytes(upload_id) if self.blobs else None
+        if data is None:
+            return None
+        image = decode_upload(io.BytesIO(data), keep_resolution=keep_resolution)
+        self._admit(entry, image)
+        return image
+
+    def __contains__(self, upload_id):
+        with self._lock:
+            return any((upload_id, keep) in self._images for keep in (False, True))
@@ -39,7 +39,12 @@ echo "Press Ctrl+C to stop the server"
 echo
 
 # Start the webapp in the background briefly to allow browser to open
-python3 -m diffusionlab.api.webapp &
+# (DIFFUSIONLAB_WORKERS=N runs the pre-forking production server instead)
+if [ -n "$DIFFUSIONLAB_WORKERS" ]; then
+    python3 -m diffusionlab.api.server --workers "$DIFFUSIONLAB_WORKERS" &
+else
+    python3 -m diffusionlab.api.webapp &
+fi
 WEBAPP_PID=$!
 
 # Wait a moment for the server to start
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for the offline benchmark suite
+"""
+
+import threading
+
+import pytest
+
+from benchmarks.suite import StageTimer, compare
+
+
+def report(latency, unet, rss=100 * 1024 * 1024):
+    return {"modes": {"single": {"latency_s": latency, "latency_min_s": latency, "peak_rss_bytes": rss,
+                                 "stages": {"unet": {"calls": 4, "seconds": unet, "min_seconds": unet}}}}}
+
+
+def test_stage_timer_counts_calls_across_threads():
+    timer = StageTimer()
+    work = timer.timed(lambda: None, "preprocess")
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stages = timer.snapshot()
+    assert stages["preprocess"]["calls"] == 8
+    assert timer.snapshot() == {}
+
+
+def test_compare_flags_slowdowns_above_tolerance():
+    baseline = report(1.0, 0.5)
+    _, regressions = compare(report(1.1, 0.55), baseline)
+    assert regressions == []
+    _, regressions = compare(report(1.5, 0.9), baseline)
+    assert {row["metric"] for row in regressions} == {"latency_s", "stages.unet.seconds"}
+
+
+def test_compare_ignores_noise_floor():
+    # Doubling a 1ms stage is below MIN_SECONDS
+    _, regressions = compare(report(1.0, 0.002), report(1.0, 0.001))
+    assert regressions == []
+
+
+def test_suite_runs_offline():
+    for module in ("diffusers", "transformers"):
+        pytest.importorskip(module)
+    from benchmarks.suite import run
+    result = run({"single"}, repeats=1, size=64, steps=2)
+    single = result["modes"]["single"]
+    assert single["images"] == 1
+    assert single["stages"]["unet"]["calls"] == 2
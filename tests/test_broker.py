@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for the job broker and inference nodes
+"""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from diffusionlab import node
+from diffusionlab.broker import Broker, HTTPBroker, SQLiteBroker, decode_result, encode_result
+
+
+def test_jobs_round_trip_with_encoded_results(tmp_path):
+    broker = SQLiteBroker(str(tmp_path / "broker.sqlite"))
+    first = broker.submit("panel", {"prompt": "a"}, "web-1")
+    second = broker.submit("panel", {"prompt": "b"}, "web-2")
+    assert broker.claim("node", origin="web-2")["id"] == second
+    job = broker.claim("node")
+    assert job == {"id": first, "kind": "panel", "params": {"prompt": "a"}}
+    assert broker.claim("node") is None
+
+    image = Image.new("RGB", (8, 4), "red")
+    latents = np.arange(12, dtype=np.float16).reshape(3, 4)
+    assert broker.complete(first, "node", encode_result({"image": image, "latents": latents, "caption": None}))
+    finished = broker.results([first, second])
+    assert list(finished) == [first]
+    result = decode_result(finished[first]["result"])
+    assert result["image"].size == (8, 4) and result["image"].getpixel((0, 0)) == (255, 0, 0)
+    assert np.array_equal(result["latents"], latents) and result["caption"] is None
+    broker.forget([first, second])
+    assert broker.stats() == {}
+
+
+def test_jobs_of_lost_nodes_are_requeued_then_failed(tmp_path):
+    broker = SQLiteBroker(str(tmp_path / "broker.sqlite"), node_timeout=0.2, max_attempts=2)
+    job_id = broker.submit("panel", {}, "web")
+    for attempt in range(2):
+        broker.heartbeat(f"flaky-{attempt}", 1, 1)
+        assert broker.claim(f"flaky-{attempt}")["id"] == job_id
+        time.sleep(0.3)  # No heartbeat: the node is lost
+        assert [n["name"] for n in broker.nodes()] == []
+    assert broker.claim("other") is None
+    assert broker.results([job_id])[job_id]["error"] == "node lost"
+
+
+def test_run_distributed_shares_jobs_with_nodes(tmp_path, monkeypatch):
+    def square(params):
+        time.sleep(0.3)  # Longer than the node's poll interval, so both sides get jobs
+        return {"value": np.array([params["x"] ** 2]), "thread": threading.current_thread().name}
+
+    monkeypatch.setitem(node.JOB_KINDS, "square", square)
+    broker = SQLiteBroker(str(tmp_path / "broker.sqlite"))
+    worker = node.Node(broker, "remote")
+    thread = threading.Thread(target=worker.run, name="remote")
+    thread.start()
+    try:
+        results = node.run_distributed(broker, "square", [{"x": x} for x in range(6)], timeout=30)
+    finally:
+        worker.stopped.set()
+        thread.join()
+    assert [int(result["value"][0]) for result in results] == [x ** 2 for x in range(6)]
+    assert {result["thread"] for result in results} == {"remote", threading.current_thread().name}
+    assert broker.stats() == {}
+
+
+def test_concurrent_requests_only_run_their_own_jobs(tmp_path, monkeypatch):
+    def tagged(params):
+        time.sleep(0.05)
+        return {"request": params["request"]}
+
+    monkeypatch.setitem(node.JOB_KINDS, "tagged", tagged)
+    broker = SQLiteBroker(str(tmp_path / "broker.sqlite"))
+    results = {}
+
+    def request(name):
+        results[name] = node.run_distributed(broker, "tagged", [{"request": name}] * 4, timeout=30)
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {name: [r["request"] for r in rs] for name, rs in results.items()} == {"a": ["a"] * 4, "b": ["b"] * 4}
+
+
+def test_nodes_are_not_given_more_jobs_than_their_capacity(tmp_path):
+    broker = SQLiteBroker(str(tmp_path / "broker.sqlite"))
+    for _ in range(3):
+        broker.submit("panel", {}, "web")
+    broker.heartbeat("node", 2, 0)
+    assert broker.claim("node") and broker.claim("node")
+    assert broker.claim("node") is None
+    assert broker.claim("other") is not None  # No heartbeat yet: not limited
+
+
+def test_brokers_must_implement_the_node_interface(tmp_path):
+    class Incomplete(Broker):
+        def claim(self, node):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+    SQLiteBroker(str(tmp_path / "broker.sqlite"))
+    HTTPBroker("http://localhost:5000")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for the storyboard layout compositor
+"""
+
+from PIL import Image
+
+from diffusionlab.compositor import compose_layout, compute_geometry, get_font
+
+
+def make_panels(count, size=(64, 48)):
+    return [Image.new('RGB', size, (i * 30 % 256, 100, 200)) for i in range(count)]
+
+
+def test_any_panel_count():
+    """Layouts accept panel counts other than 5"""
+    for count in (1, 3, 8):
+        images = make_panels(count)
+        captions = [f"caption {i}" for i in range(count)]
+        for layout in ("horizontal", "vertical", "grid"):
+            storyboard = compose_layout(images, captions, layout)
+            geometry = compute_geometry(layout, count, 64, 48)
+            assert storyboard.size == geometry["canvas_size"]
+
+
+def test_grid_columns():
+    """Grid layout honours an explicit column count"""
+    geometry = compute_geometry("grid", 7, 64, 48, 3)
+    assert geometry["columns"] == 3
+    assert geometry["rows"] == 3
+    assert geometry["canvas_size"] == (64 * 3 + 20 * 2, (48 + 80 + 20) * 3)
+
+
+def test_panels_are_pasted():
+    """Panel pixels land at their computed positions"""
+    images = make_panels(4)
+    storyboard = compose_layout(images, ["a", "b", "c", "d"], "grid")
+    geometry = compute_geometry("grid", 4, 64, 48)
+    for image, (x0, y0, _, _) in zip(images, geometry["panels"]):
+        assert storyboard.getpixel((x0 + 5, y0 + 5)) == image.getpixel((5, 5))
+
+
+def test_font_is_cached():
+    """Fonts are loaded once per size"""
+    assert get_font(16) is get_font(16)
+
+
+def test_empty_input():
+    assert compose_layout([], []) is None
+
+
+def test_partial_storyboard_keeps_its_final_size():
+    """Streamed storyboards show placeholders for unfinished panels"""
+    from diffusionlab.tasks.storyboard import storyboard_preview
+    images = make_panels(2)
+    partial = storyboard_preview(images, ["a", "b"], 5)
+    assert partial.size == compose_layout(make_panels(5), ["a"] * 5).size
+    geometry = compute_geometry("horizontal", 5, 64, 48)
+    assert partial.getpixel(geometry["panels"][1][:2]) == images[1].getpixel((0, 0))
+    assert partial.getpixel(geometry["panels"][4][:2]) == (248, 249, 250)
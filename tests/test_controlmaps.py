@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Tests for the control map cache
+"""
+
+import numpy as np
+from PIL import Image
+
+from diffusionlab.controlmaps import ControlMapCache, control_map_key, image_content_key
+
+
+def test_keys_depend_on_image_type_and_settings():
+    image = Image.new('RGB', (32, 32), (10, 20, 30))
+    image_key = image_content_key(image)
+    assert image_key == image_content_key(image.copy())
+    assert image_key != image_content_key(Image.new('RGB', (32, 32), (10, 20, 31)))
+
+    key = control_map_key(image_key, "canny", {"low_threshold": 100, "high_threshold": 200}, image.size)
+    assert key == control_map_key(image_key, "canny", {"high_threshold": 200, "low_threshold": 100}, image.size)
+    assert key != control_map_key(image_key, "canny", {"low_threshold": 50, "high_threshold": 200}, image.size)
+    assert key != control_map_key(image_key, "depth", {"low_threshold": 100, "high_threshold": 200}, image.size)
+
+
+def test_memory_tier_skips_recompute():
+    cache = ControlMapCache(max_items=2)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.full((8, 8), 255, np.uint8)
+
+    first = cache.get_or_compute("a", compute)
+    second = cache.get_or_compute("a", compute)
+    assert len(calls) == 1
+    assert second is first and first.shape == (8, 8, 3)
+    assert cache.stats == {'memory_hits': 1, 'disk_hits': 0, 'misses': 1, 'coalesced': 0}
+    assert cache.get_or_compute("b", lambda: None) is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    cache = ControlMapCache(max_items=1, directory=str(tmp_path))
+    control_map = np.random.default_rng(0).integers(0, 255, (8, 8, 3), dtype=np.uint8)
+    cache.put("a", control_map)
+    cache._writer.shutdown(wait=True)
+
+    restarted = ControlMapCache(max_items=1, directory=str(tmp_path))
+    assert np.array_equal(restarted.get_or_compute("a", lambda: None), control_map)
+    assert restarted.stats['disk_hits'] == 1
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Tests for storyboard export (PDF and ZIP bundles)
+"""
+
+import io
+import json
+import re
+import zipfile
+
+from PIL import Image
+
+from diffusionlab.export import iter_panel_zip, iter_storyboard_pdf, load_jpeg_stream
+
+
+def make_panels(count, size=(96, 64)):
+    return [Image.new('RGB', size, (i * 40 % 256, 120, 60)) for i in range(count)]
+
+
+def test_pdf_pages_and_xref():
+    """Panels are split across pages and every xref entry points at its object"""
+    data = b"".join(iter_storyboard_pdf(make_panels(5), ["one", "two (2)", "three"], panels_per_page=2))
+    assert data.startswith(b"%PDF-1.4")
+    assert data.rstrip().endswith(b"%%EOF")
+    assert re.search(rb"/Type /Pages /Kids \[[^\]]*\] /Count 3", data)
+
+    xref_offset = int(data.rsplit(b"startxref\n", 1)[1].split(b"\n")[0])
+    lines = data[xref_offset:].split(b"\n")
+    count = int(lines[1].split()[1])
+    for obj_num in range(1, count):
+        offset = int(lines[2 + obj_num].split()[0])
+        assert data[offset:].startswith(f"{obj_num} 0 obj".encode())
+
+
+def test_jpeg_passthrough():
+    """JPEG input bytes are embedded without re-encoding"""
+    buffer = io.BytesIO()
+    make_panels(1)[0].save(buffer, format='JPEG', quality=80)
+    jpeg = buffer.getvalue()
+    data, size, mode = load_jpeg_stream(jpeg)
+    assert data == jpeg
+    assert size == (96, 64)
+    assert mode == 'RGB'
+    assert jpeg in b"".join(iter_storyboard_pdf([jpeg], ["caption"]))
+
+
+def test_panel_zip_bundle():
+    """ZIP bundles hold every panel, the composite and the manifest"""
+    panels = make_panels(6)
+    manifest = {"prompt": "a test", "panels": [{"seed": i} for i in range(6)]}
+    data = b"".join(iter_panel_zip(panels, composite=panels[0], manifest=manifest, max_workers=2))
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.testzip() is None
+    names = set(archive.namelist())
+    assert {f"panels/panel_{i:02d}.png" for i in range(1, 7)} <= names
+    assert "composite.png" in names
+    saved = json.loads(archive.read("manifest.json"))
+    assert [panel["seed"] for panel in saved["panels"]] == list(range(6))
+    assert Image.open(io.BytesIO(archive.read("panels/panel_03.png"))).size == (96, 64)
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Tests that the lightweight entry points do not import the ML stack
+"""
+
+import pytest
+
+from benchmarks.import_time import measure
+
+
+@pytest.mark.parametrize("module", ["diffusionlab.api.webapp", "diffusionlab.api.server", "diffusionlab.utils",
+                                    "diffusionlab.preprocess"])
+def test_module_imports_no_heavy_dependencies(module):
+    assert measure(module, repeats=1)["heavy"] == []
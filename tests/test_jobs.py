@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for resumable multi-panel jobs
+"""
+
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from diffusionlab.jobs import JobStore
+
+
+def panel(color, latents=None, caption=None):
+    return {"image": Image.new("RGB", (8, 8), color), "latents": latents, "caption": caption}
+
+
+def test_repeated_request_finds_saved_panels(tmp_path):
+    store = JobStore(str(tmp_path))
+    request = {"prompt": "a lighthouse", "seed": None}
+    with pytest.raises(RuntimeError):
+        with store.open("batch", request) as job:
+            job.start("batch", request, [{"seed": 11}, {"seed": 12}, {"seed": 13}])
+            job.save_panel(0, panel("red", np.ones((4, 2, 2), dtype=np.float16)))
+            job.save_panel(2, panel("blue", caption="third"), chain_latents=np.zeros((1, 4, 2, 2), dtype=np.float32))
+            raise RuntimeError("crash")
+
+    with store.open("batch", dict(request)) as job:
+        assert job.started and [p["seed"] for p in job.panels] == [11, 12, 13]
+        assert job.finished() == [0, 2]
+        saved = job.finished_panels()
+        assert saved[0]["image"].getpixel((0, 0)) == (255, 0, 0) and saved[0]["latents"].dtype == np.float16
+        assert saved[2]["caption"] == "third" and saved[2]["latents"] is None
+        assert job.chain_latents(2).shape == (1, 4, 2, 2) and job.chain_latents(0) is None
+        job.finish()
+    assert store.unfinished() == []
+
+
+def test_unstarted_and_expired_jobs_are_removed(tmp_path):
+    store = JobStore(str(tmp_path), max_age=60)
+    with store.open("storyboard", {"prompt": "never started"}):
+        pass
+    with store.open("storyboard", {"prompt": "old"}) as job:
+        job.start("storyboard", {"prompt": "old"}, [{"seed": 1}])
+        old = job.id
+    with store.open("storyboard", {"prompt": "new"}) as job:
+        job.start("storyboard", {"prompt": "new"}, [{"seed": 2}])
+        new = job.id
+    os.utime(os.path.join(str(tmp_path), old, "job.json"), (0, 0))
+    assert store.unfinished() == [new]
+    assert sorted(os.listdir(str(tmp_path))) == [new]
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for inpainting mask processing
+"""
+
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+from diffusionlab.masking import (classify_brush_pixels, inpaint_working_size, mask_crop_box,
+                                  paste_feathered, process_mask_data)
+
+
+def encode_mask(rgba):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba).save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_no_uint8_wraparound():
+    """Green-dominant pixels are not classified as red strokes"""
+    rgba = np.zeros((8, 8, 4), dtype=np.uint8)
+    rgba[..., 0] = 90
+    rgba[..., 1] = 200  # 90 - 200 wraps to 146 on uint8
+    rgba[..., 3] = 255
+    assert not classify_brush_pixels(rgba, 80, 30, 200).any()
+
+
+def test_process_mask_data():
+    """Red strokes become white, everything else black"""
+    rgba = np.zeros((64, 64, 4), dtype=np.uint8)
+    rgba[16:48, 16:48] = (230, 20, 20, 255)
+    mask = process_mask_data(encode_mask(rgba))
+    assert mask.mode == 'L'
+    mask_array = np.asarray(mask)
+    assert mask_array[32, 32] == 255
+    assert mask_array[2, 2] == 0
+    assert set(np.unique(mask_array)) <= {0, 255}
+
+
+def test_invalid_mask_data():
+    assert process_mask_data('data:image/png;base64,bm90IGFuIGltYWdl') is None
+
+
+def test_mask_crop_box():
+    """Crop boxes pad the mask, keep the working aspect and stay inside the image"""
+    mask_array = np.zeros((300, 400), dtype=np.uint8)
+    mask_array[100:120, 200:240] = 255
+    x0, y0, x1, y1 = mask_crop_box(Image.fromarray(mask_array), 16)
+    assert (x1 - x0) == (y1 - y0) == 72
+    assert x0 <= 184 and x1 >= 256 and y0 <= 84 and y1 >= 136
+
+    mask_array[:] = 0
+    mask_array[0:5, 395:400] = 255
+    x0, y0, x1, y1 = mask_crop_box(Image.fromarray(mask_array), 32)
+    assert x0 >= 0 and y0 == 0 and x1 == 400 and y1 <= 300
+    assert mask_crop_box(Image.new('L', (10, 10)), 4) is None
+
+
+def test_small_region_is_denoised_small():
+    """Small touch-ups denoise at the minimum working size, not the full frame"""
+    assert inpaint_working_size((72, 72), 512, 256) == (256, 256)
+    assert inpaint_working_size((2000, 1000), 512, 256) == (512, 256)
+
+
+def test_paste_feathered_only_touches_box():
+    image = Image.new('RGB', (64, 64), 'blue')
+    mask = Image.new('L', (64, 64))
+    mask.paste(255, (20, 20, 40, 40))
+    result = paste_feathered(image, Image.new('RGB', (16, 16), 'red'), mask, (16, 16, 48, 48), 2)
+    assert result.getpixel((30, 30)) == (255, 0, 0)
+    assert result.getpixel((5, 5)) == (0, 0, 255)
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Tests for memory accounting
+"""
+
+import torch
+from PIL import Image
+
+from diffusionlab import memory
+
+
+def test_module_bytes_counts_shared_weights_once():
+    linear = torch.nn.Linear(16, 8)
+    assert memory.module_bytes(linear) == {"cpu": (16 * 8 + 8) * 4}
+    tied = torch.nn.Sequential(linear, torch.nn.Linear(16, 8))
+    tied[1].weight = linear.weight
+    assert memory.module_bytes(tied)["cpu"] == (16 * 8 + 8 + 8) * 4
+
+
+def test_live_objects_sees_new_tensors_and_images():
+    before = memory.live_objects()
+    tensors = [torch.zeros(256, 256) for _ in range(3)]
+    images = [Image.new("RGB", (64, 32)) for _ in range(2)]
+    after = memory.live_objects()
+    assert after["tensors"] - before["tensors"] >= len(tensors)
+    assert after["tensor_bytes"] - before["tensor_bytes"] >= 3 * 256 * 256 * 4
+    assert after["images"] - before["images"] >= len(images)
+    assert after["image_bytes"] - before["image_bytes"] >= 2 * 64 * 32 * 3
+
+
+def test_request_memory_records_peak_and_cleanup(monkeypatch):
+    monkeypatch.setitem(memory.MEMORY_CONFIG, "cleanup_after_request", True)
+    with memory.RequestMemory("generate"):
+        block = bytearray(64 * 1024 * 1024)
+        block[::4096] = b"x" * len(block[::4096])
+        del block
+    record = memory.recent_requests[-1]
+    assert record["endpoint"] == "generate"
+    if record["peak_rss_bytes"] is not None:  # Linux only
+        assert record["peak_rss_bytes"] - record["rss_before_bytes"] >= 32 * 1024 * 1024
+    assert set(record["cleanup"]) >= {"rss_before_bytes", "rss_after_bytes", "freed_bytes", "collected_objects"}
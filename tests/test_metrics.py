@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Tests for the Prometheus metrics and stage timing
+"""
+
+import threading
+
+from diffusionlab.metrics import Counter, Gauge, Histogram, record_stage, render, server_timing, stage, start_request
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = []
+    histogram = Histogram('test_seconds', 'Test', ['stage'], buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, stage='decode')
+    text = render(registry)
+    assert '# TYPE test_seconds histogram' in text
+    assert 'test_seconds_bucket{stage="decode",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{stage="decode",le="1"} 3' in text
+    assert 'test_seconds_bucket{stage="decode",le="+Inf"} 4' in text
+    assert 'test_seconds_count{stage="decode"} 4' in text
+    assert 'test_seconds_sum{stage="decode"} 6.05' in text
+
+
+def test_counter_gauge_and_collected_values():
+    registry = []
+    counter = Counter('test_total', 'Test', ['result'], registry=registry)
+    counter.inc(result='hit')
+    counter.inc(2, result='hit')
+    gauge = Gauge('test_depth', 'Test', registry=registry)
+    with gauge.track():
+        assert gauge.value() == 1
+    Gauge('test_ratio', 'Test', ['cache'], collect=lambda: [({'cache': 'a"b'}, 0.5)], registry=registry)
+    text = render(registry)
+    assert 'test_total{result="hit"} 3' in text
+    assert 'test_depth 0' in text
+    assert 'test_ratio{cache="a\\"b"} 0.5' in text
+
+
+def test_stages_are_collected_per_request():
+    stages = start_request()
+    with stage('layout'):
+        pass
+    record_stage('denoise_step', 0.25)
+    record_stage('denoise_step', 0.25)
+
+    # Another thread has its own (empty) request context
+    thread = threading.Thread(target=record_stage, args=('denoise_step', 1.0))
+    thread.start()
+    thread.join()
+
+    assert stages['denoise_step'] == [2, 0.5]
+    header = server_timing(stages, total=1.0)
+    assert 'denoise_step;dur=500.0;desc="2x"' in header
+    assert header.startswith('layout;dur=') and header.endswith('total;dur=1000.0')
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Tests for the OpenCV control map preprocessing engine
+"""
+
+import threading
+
+import numpy as np
+
+from diffusionlab.controlmaps import ControlMapCache
+from diffusionlab.preprocess import PREPROCESSORS, PreprocessEngine, canny_map
+
+
+def make_image(size=(96, 128)):
+    image = np.full(size + (3,), 40, np.uint8)
+    image[24:72, 32:96] = (220, 200, 180)
+    return image
+
+
+def test_preprocessors_return_rgb_maps_of_input_size():
+    image = make_image()
+    for control_type, preprocessor in PREPROCESSORS.items():
+        control_map = preprocessor(image)
+        assert control_map.shape == image.shape, control_type
+        assert control_map.dtype == np.uint8, control_type
+
+
+def test_canny_finds_square_outline():
+    edges = canny_map(make_image())[..., 0]
+    assert edges[24:72, 32].any() and edges[48, 32:96].any()
+    assert not edges[:16].any()
+
+
+def test_engine_batches_and_caches():
+    engine = PreprocessEngine(max_workers=2, cache=ControlMapCache(max_items=8))
+    images = [np.roll(make_image(), shift, axis=1) for shift in range(3)]
+    maps = engine.map(images, "canny")
+    assert [m.shape for m in maps] == [images[0].shape] * 3
+    assert np.array_equal(maps[1], canny_map(images[1]))
+    assert engine.run(images[0], "canny") is maps[0]
+    assert engine.cache.stats['memory_hits'] == 1
+
+
+def test_engine_custom_and_unknown_preprocessors():
+    engine = PreprocessEngine(max_workers=1, cache=ControlMapCache(max_items=8))
+    assert engine.run(make_image(), "unknown") is None
+    engine.register("pose", lambda image, **settings: None)
+    assert engine.run(make_image(), "pose") is None
+    assert engine.cache.stats['misses'] == 1
+
+
+def test_engine_counts_joined_requests_as_coalesced():
+    release = threading.Event()
+    engine = PreprocessEngine(max_workers=2, cache=ControlMapCache(max_items=8))
+    engine.register("slow", lambda image, **settings: release.wait(5) and image)
+    first = engine.submit(make_image(), "slow")
+    second = engine.submit(make_image(), "slow")
+    release.set()
+    assert second is first and first.result().shape == make_image().shape
+    assert engine.cache.stats['misses'] == 1 and engine.cache.stats['coalesced'] == 1
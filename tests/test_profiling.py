@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Tests for on-demand profiling
+"""
+
+import json
+import os
+import time
+from contextlib import nullcontext
+
+import pytest
+
+from diffusionlab import profiling
+from diffusionlab.config import PROFILER_CONFIG
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setitem(PROFILER_CONFIG, "directory", str(tmp_path))
+    yield tmp_path
+    profiling.stop()
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_capture_is_a_no_op_without_a_session(profile_dir):
+    assert isinstance(profiling.capture("generate"), nullcontext)
+
+
+def test_sampling_session_writes_trace_and_folded_stacks(profile_dir):
+    session = profiling.start("sampling", requests=1, interval=0.001)
+    with profiling.capture("generate"):
+        busy(0.05)
+    # The session covered one request and is now disarmed
+    assert isinstance(profiling.capture("generate"), nullcontext)
+    assert profiling.status() is None
+
+    artifacts = profiling.sessions()[session["id"]]
+    assert artifacts == ["001-generate.folded", "001-generate.trace.json"]
+    folded = (profile_dir / session["id"] / "001-generate.folded").read_text()
+    assert "test_profiling.busy" in folded
+    trace = json.loads((profile_dir / session["id"] / "001-generate.trace.json").read_text())
+    assert any(event["name"].endswith("test_profiling.busy") for event in trace["traceEvents"])
+
+
+def test_trace_events_span_consecutive_samples():
+    samples = [(0.0, ["main", "a"]), (1.0, ["main", "a", "b"]), (2.0, ["main", "c"])]
+    events = {event["name"]: (event["ts"], event["dur"]) for event in profiling._trace_events(samples, 3.0)}
+    assert events == {"main": (0.0, 3e6), "a": (0.0, 2e6), "b": (1e6, 1e6), "c": (2e6, 1e6)}
+
+
+def test_session_limits_and_validation(profile_dir):
+    with pytest.raises(ValueError):
+        profiling.start("perf", requests=1)
+    with pytest.raises(ValueError):
+        profiling.start("sampling")
+    status = profiling.start("sampling", requests=10 ** 6, seconds=10 ** 9)
+    assert status["remaining_requests"] == PROFILER_CONFIG["max_requests"]
+    assert status["seconds_left"] <= PROFILER_CONFIG["max_seconds"]
+
+
+def test_artifact_path_stays_in_profile_directory(profile_dir):
+    session = profiling.start("sampling", requests=1)
+    (profile_dir / session["id"] / "001-generate.folded").write_text("main 1\n")
+    assert profiling.artifact_path(session["id"], "001-generate.folded") == os.path.join(
+        str(profile_dir), session["id"], "001-generate.folded")
+    assert profiling.artifact_path("..", os.path.basename(str(profile_dir))) is None
+    assert profiling.artifact_path(session["id"], "missing.folded") is None
+
+
+def test_sessions_started_in_the_same_second_keep_their_captures(profile_dir):
+    first = profiling.ProfileSession("sampling", str(profile_dir), requests=1)
+    second = profiling.ProfileSession("sampling", str(profile_dir), requests=1)
+    assert first.id != second.id and first.directory != second.directory
+    assert first.claim("generate") != second.claim("generate")
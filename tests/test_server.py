@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Tests for the pre-forking production server
+"""
+
+import gc
+import signal
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from diffusionlab.api import server
+
+
+def slow_app(environ, start_response):
+    time.sleep(0.3)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+def test_worker_recycles_after_max_requests_and_finishes_in_flight():
+    sock = server.listen('127.0.0.1', 0, 16)
+    worker = server.Worker(slow_app, sock, max_requests=2)
+    url = f'http://127.0.0.1:{sock.getsockname()[1]}/'
+    statuses = []
+
+    def clients():
+        with ThreadPoolExecutor(4) as pool:
+            statuses.extend(pool.map(lambda _: urllib.request.urlopen(url, timeout=10).status, range(4)))
+
+    thread = threading.Thread(target=clients)
+    thread.start()
+    handlers = signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)
+    worker.run(graceful_timeout=10, handle_signals=False)
+    thread.join()
+    sock.close()
+    assert (signal.getsignal(signal.SIGTERM), signal.getsignal(signal.SIGINT)) == handlers  # Ctrl+C still works
+    assert worker.stopping
+    assert statuses == [200] * 4
+    assert worker.active == 0 and worker.served == 4
+
+
+def test_freeze_puts_modules_in_inference_mode():
+    module = torch.nn.Linear(4, 4)
+    try:
+        server.freeze({"linear": module})
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+    assert not module.training
+    assert not any(parameter.requires_grad for parameter in module.parameters())
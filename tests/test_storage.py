@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Tests for content-addressed storage and quota cleanup
+"""
+
+import io
+import os
+import time
+
+from PIL import Image
+
+from diffusionlab.storage import BlobStore, content_key
+
+
+def test_put_deduplicates(tmp_path):
+    store = BlobStore(str(tmp_path))
+    first = store.put_bytes(b"same bytes", ".bin")
+    second = store.put_bytes(b"same bytes", ".bin")
+    assert first == second == content_key(b"same bytes") + ".bin"
+    assert store.read_bytes(first) == b"same bytes"
+    assert store.usage() == {'blobs': 1, 'bytes': len(b"same bytes")}
+
+    key, data = store.put_image(Image.new('RGB', (4, 4)))
+    assert key.endswith('.png') and data.startswith(b"\x89PNG")
+
+
+def test_cleanup_by_age_keeps_linked_children(tmp_path):
+    store = BlobStore(str(tmp_path), max_age=3600)
+    panel = store.put_bytes(b"panel", ".png")
+    composite = store.put_bytes(b"composite", ".png")
+    store.link(composite, [panel])
+    store.save_json(composite, {'panels': [panel]})
+    assert store.load_json(composite) == {'panels': [panel]}
+    latents = store.save_sidecar(panel, '.latents.npy', b"latents")
+    assert latents == panel.split('.')[0] + '.latents.npy'
+    assert store.read_sidecar(panel, '.latents.npy') == b"latents"
+
+    # Nothing is old enough yet
+    assert store.cleanup()[0] == 0
+
+    # The composite expires first and takes its sidecar with it; then the panel (and its latents) go too
+    removed, remaining = store.cleanup(now=time.time() + 7200)
+    assert removed == 2
+    assert remaining == 0
+    assert os.listdir(tmp_path) == [name for name in os.listdir(tmp_path) if name.startswith('.')]
+
+
+def test_cleanup_enforces_size_quota(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=250)
+    keys = []
+    for i in range(4):
+        keys.append(store.put_bytes(bytes([i]) * 100))
+        store.touch(keys[-1])
+        time.sleep(0.01)
+    store.touch(keys[0])  # most recently used now
+
+    removed, remaining = store.cleanup(now=time.time() + 120)
+    assert removed == 2 and remaining == 200
+    assert store.exists(keys[0]) and store.exists(keys[3])
+    assert not store.exists(keys[1]) and not store.exists(keys[2])
+
+
+def test_cleanup_adopts_legacy_files(tmp_path):
+    for name in ("storyboard_20240101_120000.png", "storyboard_20240101_120000.json"):
+        (tmp_path / name).write_bytes(b"x" * 10)
+        os.utime(tmp_path / name, (0, 0))
+    store = BlobStore(str(tmp_path), max_age=3600)
+    assert store.cleanup() == (1, 0)
+    assert not (tmp_path / "storyboard_20240101_120000.json").exists()
+
+
+def test_streams_are_stored_and_the_index_can_live_elsewhere(tmp_path):
+    old = BlobStore(str(tmp_path / "served"))
+    old.put_bytes(b"older blob", ".bin")
+    store = BlobStore(str(tmp_path / "served"), index_path=str(tmp_path / "index" / "outputs.sqlite"))
+    assert store.usage() == {'blobs': 1, 'bytes': len(b"older blob")}
+    assert sorted(os.listdir(tmp_path / "served")) == [content_key(b"older blob") + ".bin"]  # Index moved out
+
+    stream = io.BytesIO(b"streamed bytes")
+    stream.read(3)
+    key = store.put_bytes(stream, ".bin")
+    assert key == content_key(b"streamed bytes") + ".bin" == content_key(io.BytesIO(b"streamed bytes")) + ".bin"
+    assert store.read_bytes(key) == b"streamed bytes" and store.usage()['bytes'] == 24
+
+
+def test_store_is_created_on_first_use(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"), index_path=str(tmp_path / "index" / "blobs.sqlite"))
+    assert os.listdir(tmp_path) == []
+    store.put_bytes(b"first", ".bin")
+    assert sorted(os.listdir(tmp_path)) == ["blobs", "index"] and store.usage()['blobs'] == 1
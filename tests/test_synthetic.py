@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests for the synthetic inference backend
+"""
+
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from diffusionlab import memory, synthetic
+from diffusionlab.config import IMAGE_CONFIG
+from diffusionlab.metrics import start_request
+from diffusionlab.tasks import storyboard
+
+PROFILE = dict(synthetic.REFERENCE_PROFILE, reference_pixels=256 * 256, resolution_exponent=1.0,
+               text_encode_seconds=0.0, step_seconds=0.02, vae_decode_seconds=0.01, draft_decode_seconds=0.0,
+               caption_token_seconds=0.0, activation_bytes=1_000_000,
+               component_bytes={name: 1_000_000 for name in synthetic.REFERENCE_PROFILE["component_bytes"]})
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    for name in ("pipe", "img2img_pipe", "inpaint_pipe", "tiny_vae", "tokenizer", "model"):
+        monkeypatch.setattr(storyboard, name, None)
+    monkeypatch.setattr(storyboard, "controlnet_pipes", storyboard.OrderedDict())
+    return synthetic.install(storyboard, PROFILE, memory_scale=0.5)
+
+
+def test_generation_follows_the_profile(backend):
+    stages = start_request()
+    image, latents = storyboard.generate_text_to_image("a lighthouse at dusk", draft=True, width=512, height=256,
+                                                       num_inference_steps=5, generator=storyboard.make_generator(1))
+    assert image.size == (512, 256) and latents.shape == (4, 32, 64)
+    calls, seconds = stages["denoise_step"]
+    assert calls == 5 and 0.18 <= seconds < 0.4  # 5 steps of 0.02 s at twice the reference pixels
+    same, _ = storyboard.generate_text_to_image("a lighthouse at dusk", draft=True, width=512, height=256,
+                                                num_inference_steps=5, generator=storyboard.make_generator(1))
+    assert same.tobytes() == image.tobytes()
+    assert storyboard.generate_caption("a lighthouse at dusk, cinematic") == "A synthetic panel showing a lighthouse at dusk."
+    sizes = memory.component_sizes(storyboard.loaded_components())
+    assert sizes["unet"] == {"cpu": 500_000} and not any(sizes["controlnet_canny"].values())  # Allocated on first use
+
+
+def test_controlnet_generation_uses_the_control_image(backend, capsys):
+    control = Image.new("RGB", (256, 256), "white")
+    stages = start_request()
+    image = storyboard.generate_with_controlnet("a lighthouse", control, "canny", width=256, height=256,
+                                                num_inference_steps=4)
+    assert image.size == (256, 256) and "Falling back" not in capsys.readouterr().out
+    assert "vae_encode" not in stages and stages["denoise_step"][0] == 4
+    assert memory.component_sizes(storyboard.loaded_components())["controlnet_canny"] == {"cpu": 500_000}
+
+
+def test_concurrent_calls_share_the_device(backend):
+    durations = []
+
+    def generate():
+        start = time.perf_counter()
+        storyboard.pipe("a lighthouse", width=256, height=256, num_inference_steps=10, output_type="latent")
+        durations.append(time.perf_counter() - start)
+
+    generate()
+    threads = [threading.Thread(target=generate) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert min(durations[1:]) > 1.7 * durations[0]
+
+
+def test_abandoned_storyboard_stream_frees_the_pipelines(backend, monkeypatch):
+    for key, value in {"width": 256, "height": 256, "num_inference_steps": 10}.items():
+        monkeypatch.setitem(IMAGE_CONFIG, key, value)
+    stream = storyboard.generate_storyboard("A detective walks into a neon-lit alley at midnight", "cinematic")
+    assert "panel 1/" in next(stream)[1]
+    layout, status, _ = next(stream)
+    assert "(step 5)" in status and layout is not None and storyboard.panel_lock.locked()
+    # The client went away mid-panel: Gradio stops iterating, leaving the generator suspended
+    assert storyboard.panel_lock.acquire(timeout=5)  # Free once the running panel is done
+    storyboard.panel_lock.release()
+    stream.close()
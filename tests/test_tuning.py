@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tests for the performance settings helpers
+"""
+
+import pytest
+
+from diffusionlab.config import PERFORMANCE_CONFIG
+from diffusionlab.tuning import PeakMemory, apply_choice, manual_choice, memory_budget
+
+
+def test_manual_choice_follows_flags():
+    settings = dict(PERFORMANCE_CONFIG, enable_attention_slicing=True, enable_vae_tiling=True)
+    assert manual_choice(settings, "cpu") == {"attention": "sliced", "vae": "tiled"}
+    settings = dict(settings, enable_attention_slicing=False, enable_vae_tiling=False, enable_vae_slicing=True)
+    assert manual_choice(settings, "cpu") == {"attention": "sdpa", "vae": "sliced"}
+
+
+def test_xformers_needs_cuda():
+    settings = dict(PERFORMANCE_CONFIG, enable_xformers_memory_efficient_attention=True)
+    assert manual_choice(settings, "cpu")["attention"] != "xformers"
+
+
+def test_memory_budget_setting():
+    assert memory_budget("cpu", {"memory_budget_gb": 2}) == 2 * 1024 ** 3
+    assert memory_budget("cpu", {}) is None or memory_budget("cpu", {}) > 0
+
+
+def test_peak_memory_sees_allocation():
+    with PeakMemory("cpu", interval=0.001) as memory:
+        block = bytearray(64 * 1024 * 1024)
+        block[::4096] = b"x" * len(block[::4096])
+        del block
+    assert memory.peak is None or memory.peak >= 32 * 1024 * 1024
+
+
+def test_apply_choice_sets_attention_processors():
+    pytest.importorskip("diffusers")
+    from diffusers.models.attention_processor import AttnProcessor, AttnProcessor2_0
+    from benchmarks.tiny_models import build_controlnet_pipeline, build_pipelines
+
+    pipe, _, _ = build_pipelines()
+    controlnet_pipe = build_controlnet_pipeline(pipe)
+    modules = (pipe.unet, pipe.vae, controlnet_pipe.controlnet)
+    settings = dict(PERFORMANCE_CONFIG, enable_memory_efficient_attention=True)
+    apply_choice([pipe, controlnet_pipe], {"attention": "sdpa", "vae": "plain"}, settings, "cpu")
+    assert all(isinstance(p, AttnProcessor2_0) for m in modules for p in m.attn_processors.values())
+    settings["enable_memory_efficient_attention"] = False
+    apply_choice([pipe, controlnet_pipe], {"attention": "sdpa", "vae": "plain"}, settings, "cpu")
+    assert all(type(p) is AttnProcessor for m in modules for p in m.attn_processors.values())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests for upload decoding and the in-memory upload store
+"""
+
+import io
+
+from PIL import Image
+
+from diffusionlab.storage import BlobStore
+from diffusionlab.uploads import UploadStore, decode_upload, fit_size
+
+
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    buffer.seek(0)
+    return buffer
+
+
+def test_fit_size():
+    assert fit_size((4000, 3000), (512, 512)) == (512, 384)
+    assert fit_size((300, 600), (512, 512)) == (256, 512)
+
+
+def test_decode_letterboxes_to_target():
+    """Wide JPEGs are draft-decoded, resized and centred on a white canvas"""
+    image = decode_upload(encode(Image.new('RGB', (1600, 800), (200, 10, 10)), 'JPEG'))
+    assert image.size == (512, 512)
+    assert image.mode == 'RGB'
+    assert image.getpixel((256, 0)) == (255, 255, 255)
+    red, green, blue = image.getpixel((256, 256))
+    assert red > 150 and green < 60 and blue < 60
+
+
+def test_decode_keep_resolution():
+    """Inpainting uploads keep their size (and alpha PNGs are flattened to RGB)"""
+    image = decode_upload(encode(Image.new('RGBA', (640, 480)), 'PNG'), keep_resolution=True)
+    assert image.size == (640, 480)
+    assert image.mode == 'RGB'
+
+
+def png_bytes(color):
+    return encode(Image.new('RGB', (8, 8), color), 'PNG').getvalue()
+
+
+def test_store_evicts_least_recently_used():
+    store = UploadStore(max_items=2, max_bytes=10 ** 9)
+    first = store.put(png_bytes((1, 0, 0)))
+    second = store.put(png_bytes((2, 0, 0)))
+    assert store.get(first) is not None  # first is now most recently used
+    third = store.put(png_bytes((3, 0, 0)))
+    assert second not in store
+    assert first in store and third in store
+    assert store.get(second) is None
+
+
+def test_store_ids_are_content_hashes():
+    store = UploadStore(max_items=4, max_bytes=10 ** 9)
+    assert store.put(png_bytes((1, 2, 3))) == store.put(png_bytes((1, 2, 3)))
+    assert store.put(png_bytes((1, 2, 3))) != store.put(png_bytes((3, 2, 1)))
+
+
+def test_store_reloads_persisted_uploads(tmp_path):
+    store = UploadStore(max_items=1, max_bytes=10 ** 9, blobs=BlobStore(str(tmp_path)))
+    first = store.put(png_bytes((1, 2, 3)))
+    store.put(png_bytes((4, 5, 6)))
+    assert first not in store
+    assert store.get(first).getpixel((0, 0)) == (1, 2, 3)
+
+
+def test_persisted_upload_resolves_in_another_store_at_once(tmp_path):
+    upload_id = UploadStore(4, 10 ** 9, blobs=BlobStore(str(tmp_path))).put(png_bytes((7, 8, 9)))
+    other_worker = UploadStore(4, 10 ** 9, blobs=BlobStore(str(tmp_path)))
+    assert other_worker.get(upload_id).getpixel((0, 0)) == (7, 8, 9)
+
+
+def test_store_accepts_streams(tmp_path):
+    store = UploadStore(4, 10 ** 9, blobs=BlobStore(str(tmp_path)))
+    upload_id = store.put(io.BytesIO(png_bytes((5, 6, 7))))
+    assert upload_id == store.put(png_bytes((5, 6, 7)))
+    assert store.blobs.read_bytes(upload_id) == png_bytes((5, 6, 7))
+    assert store.get(upload_id).getpixel((0, 0)) == (5, 6, 7)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Tests for the web app's generation endpoints, on tiny random-weight models
+"""
+
+import base64
+import io
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from diffusionlab.config import IMAGE_CONFIG
+
+pytest.importorskip("diffusers")
+
+from benchmarks import tiny_models  # noqa: E402
+from diffusionlab.api import webapp  # noqa: E402
+from diffusionlab.jobs import JobStore  # noqa: E402
+from diffusionlab.storage import BlobStore  # noqa: E402
+from diffusionlab.tasks import storyboard  # noqa: E402
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    for name in ("pipe", "img2img_pipe", "inpaint_pipe", "tiny_vae", "tokenizer", "model"):
+        monkeypatch.setattr(storyboard, name, None)
+    monkeypatch.setattr(storyboard, "controlnet_pipes", OrderedDict())
+    tiny_models.install(storyboard, control_types=())
+    for key, value in {"width": 64, "height": 64, "num_inference_steps": 2}.items():
+        monkeypatch.setitem(IMAGE_CONFIG, key, value)
+    monkeypatch.setattr(webapp, "output_store", BlobStore(str(tmp_path / "outputs")))
+    store = JobStore(str(tmp_path / "jobs"))
+    monkeypatch.setattr(webapp, "get_store", lambda: store)
+    return webapp.app.test_client()
+
+
+def decode(response):
+    return Image.open(io.BytesIO(base64.b64decode(response.get_json()["image"])))
+
+
+def test_draft_decode_round_trip(client):
+    generator = storyboard.make_generator(3)
+    image, latents = storyboard.generate_image(storyboard.pipe, "a lighthouse", draft=True, width=64, height=64,
+                                               num_inference_steps=2, generator=generator)
+    assert image.size == (64, 64) and latents.shape == (4, 8, 8) and latents.dtype == np.float16
+    full = storyboard.decode_latents(latents)[0]
+    assert full.size == (64, 64) and full.tobytes() != image.tobytes()  # Full VAE, not the tiny one
+
+    response = client.post("/generate", json={"mode": "ai", "genType": "single", "draft": True, "seed": 1,
+                                              "prompt": "a lighthouse at dusk"})
+    assert response.status_code == 200 and response.get_json()["draft"] is True
+    filename = response.get_json()["filename"]
+    finalized = client.post(f"/finalize/{filename}")
+    assert finalized.status_code == 200 and finalized.get_json()["finalized"] == [0]
+    assert decode(finalized).size == (64, 64)
+    assert webapp.load_panel_manifest(finalized.get_json()["filename"])["finalized_from"] == filename
+
+
+def test_step_previews_stream_before_the_result(client):
+    def run(callback):
+        return storyboard.generate_text_to_image("a lighthouse", width=64, height=64, num_inference_steps=4,
+                                                 callback_on_step_end=callback)
+
+    updates = list(storyboard.stream_previews(run, every=2))
+    assert [step for step, _ in updates] == [1, 3, None]
+    assert updates[0][1].size == (64, 64)
+    image, latents = updates[-1][1]
+    assert image.size == (64, 64) and latents is None
+
+
+def test_two_stage_manifests_record_the_output_size(client, monkeypatch):
+    monkeypatch.setitem(webapp.TWO_STAGE_CONFIG, "refine_steps", 2)
+    response = client.post("/generate", json={"mode": "ai", "genType": "single", "draft": True, "twoStage": True,
+                                              "prompt": "a lighthouse at dusk"})
+    manifest = webapp.load_panel_manifest(response.get_json()["filename"])
+    assert decode(response).size == (128, 128) and manifest["size"] == [128, 128] and manifest["two_stage"]
+
+    response = client.post("/generate", json={"mode": "ai", "genType": "batch", "twoStage": True, "prompt": "a lighthouse",
+                                              "batch": {"count": 2, "scene": "a lighthouse at dusk"}})
+    manifest = webapp.load_panel_manifest(response.get_json()["filename"])
+    assert manifest["size"] == [128, 128] and manifest["parameters"]["scale"] == 2.0
+    finalized = client.post(f"/finalize/{response.get_json()['filename']}")
+    assert webapp.load_panel_manifest(finalized.get_json()["filename"])["size"] == [128, 128]
+
+
+def test_render_panels_only_runs_missing_panels(client, monkeypatch, tmp_path):
+    jobs = [{"prompt": f"panel {i}", "negative_prompt": "", "num_inference_steps": 2, "guidance_scale": 5.0,
+             "width": 64, "height": 64, "seed": i, "draft": True, "two_stage": False} for i in range(3)]
+    ran = []
+    run_panel = webapp.run_panel
+    monkeypatch.setattr(webapp, "run_panel", lambda params: ran.append(params["seed"]) or run_panel(params))
+    store = webapp.get_store()
+    with store.open("batch", {"prompt": "panels"}) as job:
+        job.start("batch", {"prompt": "panels"}, jobs)
+        job.save_panel(1, {"image": Image.new("RGB", (64, 64), "red"), "latents": None, "caption": None})
+        panels = webapp.render_panels(job.panels, job)
+        assert ran == [0, 2] and job.finished() == [0, 1, 2]
+    assert panels[1]["image"].getpixel((0, 0)) == (255, 0, 0)
+    assert panels[0]["latents"].shape == panels[2]["latents"].shape == (4, 8, 8)
+
+
+def test_prompt_chain_continues_from_saved_latents(client):
+    prompts, seeds = ["a lighthouse", "a lighthouse in fog", "a lighthouse at night"], [1, 2, 3]
+    saved = {}
+
+    def on_frame(index, image, draft_latents, chain_latents):
+        saved[index] = chain_latents
+
+    args = dict(evolution_strength=0.5, num_inference_steps=4, width=64, height=64)
+    full = storyboard.generate_prompt_chain(prompts, seeds=seeds, on_frame=on_frame, **args)
+    assert sorted(saved) == [0, 1, 2] and saved[0].dtype == np.float32
+    rest = storyboard.generate_prompt_chain(prompts[1:], seeds=seeds[1:], previous_latents=saved[0], **args)
+    assert [image.tobytes() for image in rest] == [image.tobytes() for image in full[1:]]
+
+
+def test_interrupted_storyboard_resumes(client, monkeypatch):
+    calls = []
+    run_panel = webapp.run_panel
+
+    def crash_on_third_panel(params):
+        calls.append(params["seed"])
+        if len(calls) == 3:
+            raise RuntimeError("crash")
+        return run_panel(params)
+
+    monkeypatch.setattr(webapp, "run_panel", crash_on_third_panel)
+    request = {"mode": "ai", "genType": "storyboard", "prompt": "a detective walks into a neon-lit alley"}
+    assert client.post("/generate", json=request).status_code == 500
+    store = webapp.get_store()
+    [key] = store.unfinished()
+    with store.open_id(key) as job:
+        assert job.finished() == [0, 1]
+        count = len(job.panels)
+
+    webapp.resume_unfinished_jobs()
+    with store.open_id(key) as job:
+        assert job.finished() == list(range(count))
+    resumed = len(calls)
+    response = client.post("/generate", json=request)
+    assert response.status_code == 200 and response.get_json()["resumed"] is True
+    assert len(calls) == resumed and store.unfinished() == []  # The retry only built the composite
+    assert client.post("/generate", json=request).get_json()["resumed"] is False